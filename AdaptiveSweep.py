@@ -0,0 +1,179 @@
+import itertools
+import numpy as np
+import numpy.linalg as LA
+from scipy.interpolate import RBFInterpolator
+from scipy.spatial.distance import cdist
+from scipy.special import ndtr
+from scipy.stats import qmc
+from ParametricSweep import ParametricSweep
+
+# 代理モデル(RBF補間)を使った適応的サンプリングで、許容応力を満たす最も軽い形状を探すクラス
+# 最大応力(対数)と体積比をRBFで補間し、「許容応力を満たす確率 x 体積の改善量」が大きいケースだけを
+# FEMで解析する。全ケースの格子を解くより少ない解析回数で最軽量の形状が求まる
+class AdaptiveSweep:
+    # コンストラクタ
+    # sweep           : ケースの解析に使うParametricSweep
+    # bounds          : X/Y/Z方向の(最小, 最大)のスケール[%]の組のリスト(最小と最大が同じ方向は固定)
+    # allowableStress : 許容応力[Pa](降伏応力 / 目標安全率)
+    # maxCases        : 解析するケース数の上限
+    # initialCases    : 最初にラテン超方格で解析するケース数(Noneの場合は方向数と並列数から決める)
+    # batchSize       : 1回に選んで並列に解析するケース数(Noneの場合は並列数)
+    # seed            : 乱数のシード
+    def __init__(self, sweep, bounds, allowableStress, maxCases = 40, initialCases = None, batchSize = None,
+                 seed = 0):
+
+        # インスタンス変数を定義する
+        self.sweep = sweep                                         # ケースの解析に使うParametricSweep
+        self.bounds = np.asarray(bounds, dtype=float)              # 各方向のスケールの範囲
+        self.allowableStress = allowableStress                     # 許容応力
+        self.maxCases = maxCases                                   # 解析するケース数の上限
+        self.seed = seed                                           # 乱数のシード
+        self.candidateNum = 2048                                   # ケースを選ぶ候補点の数
+        self.improvementTol = 1e-3                                 # 期待できる体積比の改善がこれ未満になったら終了する
+        self.freeAxes = np.flatnonzero(self.bounds[:, 1] > self.bounds[:, 0])   # 固定していない方向
+        self.batchSize = batchSize if not batchSize is None else sweep.getWorkerNum(maxCases)
+        if initialCases is None:
+            initialCases = max(2 * (len(self.freeAxes) + 1), self.batchSize)
+        self.initialCases = min(initialCases, maxCases)            # 最初に解析するケース数
+        self.results = []                                          # 解析したケースの結果のリスト
+        self.best = None                                           # 許容応力を満たす最も軽いケースの結果
+        self.surrogateError = None                                 # 最大応力の代理モデルの誤差(対数、一つ抜き交差検証)
+        self.converged = False                                     # 体積比の改善が見込めなくなって終了したかどうか
+
+    # ケースを選んで解析し、解析が終わったケースから順に結果を返す(ジェネレータ)
+    # 終了後はself.bestに許容応力を満たす最も軽いケースの結果が入る
+    def run(self):
+
+        self.results = []
+        self.best = None
+        self.converged = False
+        if len(self.freeAxes) == 0:
+            cases = [tuple(self.bounds[:, 0])]
+        else:
+            bounds = self.bounds[self.freeAxes]
+            cases = [self.expandCase(scales) for scales in
+                     ParametricSweep.makeLatinHypercubeCases(bounds, self.initialCases, self.seed)]
+
+        # ワーカーのプロセスプールはケースを選ぶたびに起動し直さず、全体で使い回す
+        with self.sweep:
+            while len(cases) > 0:
+                for result in self.sweep.run(cases, len(self.results) + 1):
+                    self.addResult(result)
+                    yield result
+
+                if len(self.freeAxes) == 0 or len(self.results) >= self.maxCases:
+                    break
+                cases = self.selectCases(min(self.batchSize, self.maxCases - len(self.results)))
+
+    # 解析したケースの結果を記録し、許容応力を満たす最も軽いケースを更新する
+    def addResult(self, result):
+
+        self.results.append(result)
+        if self.isFeasible(result) and (self.best is None or result['volume_ratio'] < self.best['volume_ratio']):
+            self.best = result
+
+    # 許容応力を満たすかどうか
+    def isFeasible(self, result):
+
+        return not result['max_stress'] is None and result['max_stress'] <= self.allowableStress
+
+    # 固定していない方向のスケールの組に、固定した方向のスケールを加えてX/Y/Z方向のケースにする
+    def expandCase(self, scales):
+
+        case = self.bounds[:, 0].copy()
+        case[self.freeAxes] = scales
+
+        return tuple(float(scale) for scale in case)
+
+    # 固定していない方向のスケールを0～1に正規化する
+    # cases : X/Y/Z方向のスケールの組のリスト
+    def normalize(self, cases):
+
+        cases = np.asarray(cases, dtype=float).reshape(-1, 3)[:, self.freeAxes]
+        bounds = self.bounds[self.freeAxes]
+
+        return (cases - bounds[:, 0]) / (bounds[:, 1] - bounds[:, 0])
+
+    # 代理モデルから次に解析するケースを選ぶ
+    # 最大応力の予測の不確かさは、一つ抜き交差検証の誤差を最も近い解析済みのケースまでの距離で補正して見積もる
+    # 選んだケースは解析済みとみなして距離を更新し、同じ場所にケースが集まらないようにする
+    # caseNum : 選ぶケース数
+    # 戻り値  : X/Y/Z方向のスケールの組のリスト(改善が見込めない場合は空)
+    def selectCases(self, caseNum):
+
+        solved = [result for result in self.results if not result['max_stress'] is None and result['max_stress'] > 0]
+        if len(solved) < len(self.freeAxes) + 1:
+            return []
+
+        points = self.normalize([(r['x_scale'], r['y_scale'], r['z_scale']) for r in solved])
+        logStress = np.log([r['max_stress'] for r in solved])
+        volumes = np.array([r['volume_ratio'] for r in solved])
+        stressModel = RBFInterpolator(points, logStress, kernel='thin_plate_spline', degree=1)
+        volumeModel = RBFInterpolator(points, volumes, kernel='thin_plate_spline', degree=1)
+        self.surrogateError = self.crossValidate(points, logStress)
+
+        # 候補点はSobol列で範囲全体から取り、解析済みのケースと重なるものは除く
+        # 最軽量の形状はスケールの範囲の端にあることが多いため、範囲の面と角にも候補点を置く
+        candidates = self.makeCandidates(len(self.results))
+        distances = cdist(candidates, points).min(axis=1)
+        spacing = np.mean(np.sort(cdist(points, points), axis=1)[:, 1]) if len(points) > 1 else 1.0
+        keep = distances > 1e-3 * spacing
+        candidates, distances = candidates[keep], distances[keep]
+
+        margin = np.log(self.allowableStress) - stressModel(candidates)
+        volumeGain = np.ones(len(candidates))
+        if not self.best is None:
+            volumeGain = np.maximum(self.best['volume_ratio'] - volumeModel(candidates), 0.0)
+
+        cases = []
+        picked = np.zeros(len(candidates), dtype=bool)
+        for i in range(caseNum):
+            sigma = max(self.surrogateError, 1e-6) * distances / spacing
+            feasibleProb = ndtr(margin / np.maximum(sigma, 1e-12))
+            score = np.where(picked, -1.0, feasibleProb * volumeGain)
+            index = int(np.argmax(score))
+            if not self.best is None and score[index] < self.improvementTol * self.best['volume_ratio']:
+                self.converged = len(cases) == 0
+                break
+            cases.append(self.expandCase(self.bounds[self.freeAxes, 0] + candidates[index]
+                                         * (self.bounds[self.freeAxes, 1] - self.bounds[self.freeAxes, 0])))
+            picked[index] = True
+            distances = np.minimum(distances, LA.norm(candidates - candidates[index], axis=1))
+
+        return cases
+
+    # ケースを選ぶ候補点(正規化したスケール)を作成する
+    # Sobol列の点に加え、1方向ずつ範囲の端(0または1)に寄せた点と、範囲の角の点を含める
+    # seedOffset : 乱数のシードに加える値(選ぶたびに異なる候補点にする)
+    def makeCandidates(self, seedOffset):
+
+        dim = len(self.freeAxes)
+        sampler = qmc.Sobol(d=dim, scramble=True, seed=self.seed + seedOffset)
+        points = sampler.random(self.candidateNum)
+        faceNum = max(self.candidateNum // (4 * dim), 1)
+        candidates = [points]
+        for axis in range(dim):
+            for value in (0.0, 1.0):
+                face = points[:faceNum].copy()
+                face[:, axis] = value
+                candidates.append(face)
+        candidates.append(np.array(list(itertools.product((0.0, 1.0), repeat=dim))))
+
+        return np.vstack(candidates)
+
+    # 一つ抜き交差検証で代理モデルの誤差(二乗平均平方根)を求める
+    # points : 正規化したケース(ケース数 x 方向数)
+    # values : ケースごとの値
+    @staticmethod
+    def crossValidate(points, values):
+
+        if len(points) <= points.shape[1] + 2:
+            return float(np.std(values))
+
+        errors = []
+        for i in range(len(points)):
+            mask = np.arange(len(points)) != i
+            model = RBFInterpolator(points[mask], values[mask], kernel='thin_plate_spline', degree=1)
+            errors.append(model(points[i:i + 1])[0] - values[i])
+
+        return float(np.sqrt(np.mean(np.square(errors))))
@@ -0,0 +1,182 @@
+import os
+import numpy as np
+from OutOfCoreAssembly import OutOfCoreAssembly
+
+# 解析を始める前に、解き方ごとのメモリと計算時間を見積もり、メモリの上限に収まる最も速い解き方を選ぶクラス
+# 節点数、要素数、拘束されていない自由度数、メッシュの外形だけから見積もり、全体マトリクスなどの大きな配列は作らない
+#
+# 見積もりのモデル(定数は開発環境で立方体と片持ち梁のメッシュを解いて合わせた目安で、CPUやディスクにより変わる)
+#   非ゼロのブロック数 : オイラーの多面体公式から辺の数 ≈ 節点数 + 要素数 となるため、≈ 3N + 2E
+#   予測フィルイン     : SuperLU(MMD順序)の分解(LとU)のバイト数 ≈ 12.5 n^1.75 (nは拘束されていない自由度数)
+#   分解の時間         : ≈ 3.55e-11 n^2.66 [s]
+#   反復回数           : ブロックJacobi前処理で ≈ 14 N^(1/3) √(外形の最も長い辺 / 外形の辺の幾何平均)
+class AnalysisPlanner:
+    # コンストラクタ
+    # fem   : 解析するFEM(メッシュ、境界条件、メモリの上限、スレッド数、要素の範囲の大きさを使う)
+    # paths : 候補にする解き方のリスト(Noneの場合はself.pathLabelsの全て)
+    def __init__(self, fem, paths = None):
+
+        # 見積もる解き方と表示名
+        # denseは(3N)^2の密行列を作る場合の参考値で、このツールでは使わないため選ばない
+        self.pathLabels = {
+            "dense": "密行列の直接法(参考)",
+            "direct": "疎行列の直接法",
+            "direct_single": "疎行列の直接法(混合精度)",
+            "pcg": "反復法(PCG)",
+            "matrix_free": "省メモリ反復法",
+            "out_of_core": "ディスク上で組み立てる反復法",
+        }
+
+        # メモリの見積もりに使う大きさ[バイト]
+        self.nodeBytes = 320          # 節点あたりの常駐する配列(座標、境界条件、荷重・変位・反力などのベクトル)
+        self.elemBytes = 80           # 要素あたりの常駐する配列(接続関係、材料番号、応力の結果)
+        self.geometryBytes = 104      # 要素あたりの形状キャッシュ(ヤコビアン、dN/dx)
+        self.symbolicBytes = 64       # 要素あたりのシンボリック組み立ての格納先
+        self.blockBytes = 76          # 3x3ブロックあたりのBSR形式の値と列番号
+        self.chunkElemBytes = 3000    # 組み立てで要素あたりに使う一時配列(Bマトリクス、要素マトリクス、格納先)
+        self.ebeElemBytes = 900       # 組み立てない作用素の積と応力の計算で要素あたりに使う一時配列
+        self.factorCoef = 12.5        # 分解のバイト数の係数
+        self.factorExponent = 1.75    # 分解のバイト数の指数
+
+        # 計算時間の見積もりに使う値[s]
+        self.assemblyTime = 5.5e-6    # 要素あたりの全体マトリクスの組み立て
+        self.outOfCoreTime = 23e-6    # 要素あたりのディスク上の組み立て(三つ組の書き出しと足し合わせ)
+        self.factorTimeCoef = 3.55e-11   # 分解の時間の係数
+        self.factorTimeExponent = 2.66   # 分解の時間の指数
+        self.spmvTime = 1.2e-9        # 非ゼロ成分あたりの疎行列とベクトルの積
+        self.diskSpmvTime = 10e-9     # 非ゼロ成分あたりのディスク上の行列とベクトルの積
+        self.ebeTime = 350e-9         # 要素あたりの組み立てない作用素とベクトルの積
+        self.vectorTime = 55e-9       # 自由度あたりの反復1回のベクトル演算と前処理
+        self.flopRate = 2e10          # 密行列の分解の浮動小数点演算の速さ[回/s]
+        self.iterationCoef = 14.0     # 反復回数の係数
+
+        # インスタンス変数を定義する
+        self.nodeNum = fem.mesh.nodeNum                           # 節点数
+        self.elemNum = fem.mesh.elemNum                           # 要素数
+        self.dofNum = fem.mesh.nodeNum * fem.nodeDof              # 全自由度数
+        self.freeNum = int(np.count_nonzero(np.equal(fem.bound.makeDispVector(), None)))   # 拘束されていない自由度数
+        self.memoryBudget = fem.memoryBudget                      # メモリの上限[バイト]
+        if self.memoryBudget is None:
+            physicalMemory = self.getPhysicalMemory()
+            self.memoryBudget = None if physicalMemory is None else 0.8 * physicalMemory
+        self.paths = list(self.pathLabels) if paths is None else list(paths)   # 候補にする解き方
+        self.blockNum = None                                      # 非ゼロのブロック数の見積もり
+        self.iterations = None                                    # 反復法の反復回数の見積もり
+        self.candidates = self.estimate(fem)                      # 解き方ごとの見積もり
+        self.selected = self.select()                             # 選んだ解き方の見積もり(収まるものがない場合はNone)
+
+    # 実メモリの大きさ[バイト](求められない場合はNone)
+    @staticmethod
+    def getPhysicalMemory():
+
+        try:
+            return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    # 解き方ごとのメモリ[バイト]と計算時間[s]を見積もる
+    # 戻り値 : 解き方ごとの見積もり('path', 'label', 'memory', 'time', 'fits')のリスト
+    def estimate(self, fem):
+
+        nodeNum, elemNum, freeNum = self.nodeNum, self.elemNum, self.freeNum
+        freeRatio = freeNum / max(self.dofNum, 1)
+
+        # 非ゼロのブロック数と、K_ffの非ゼロ成分の数
+        blockNum = 3 * nodeNum + 2 * elemNum
+        freeNnz = fem.nodeDof * fem.nodeDof * blockNum * freeRatio ** 2
+
+        # 反復回数
+        extent = np.ptp(fem.mesh.coords, axis=0) if nodeNum > 0 else np.zeros(3)
+        extent = extent[extent > 0.0]
+        aspect = extent.max() / np.exp(np.mean(np.log(extent))) if len(extent) > 0 else 1.0
+        iterations = min(self.iterationCoef * nodeNum ** (1.0 / 3.0) * np.sqrt(aspect), max(freeNum, 1))
+
+        # 全体マトリクスを組み立てる解き方に共通する配列(Kとそこから取り出したK_ff、組み立ての一時配列)
+        resident = self.nodeBytes * nodeNum + self.elemBytes * elemNum
+        workers = fem.getAssemblyWorkers()
+        chunkBytes = self.chunkElemBytes * min(elemNum, workers * fem.chunkSize)
+        matrixBytes = self.blockBytes * blockNum
+        partialBytes = 8 * fem.nodeDof * fem.nodeDof * blockNum * (workers - 1)   # スレッドごとのdata配列
+        assembled = (resident + (self.geometryBytes + self.symbolicBytes) * elemNum +
+                     max(matrixBytes + partialBytes + chunkBytes, matrixBytes * (1.0 + freeRatio ** 2)))
+        assemblyTime = self.assemblyTime * elemNum
+
+        # 分解(LとU)のバイト数と時間、反復1回の時間
+        factorBytes = self.factorCoef * freeNum ** self.factorExponent
+        factorTime = self.factorTimeCoef * freeNum ** self.factorTimeExponent
+        vectorTime = self.vectorTime * freeNum
+        outOfCore = OutOfCoreAssembly(fem.mesh, fem.nodeDof)
+
+        estimates = {
+            "dense": (resident + 8.0 * freeNum ** 2, freeNum ** 3 / 3.0 / self.flopRate),
+            "direct": (assembled + 24 * freeNnz + factorBytes, assemblyTime + factorTime),
+            "direct_single": (assembled + 20 * freeNnz + factorBytes * 2.0 / 3.0, assemblyTime + 0.6 * factorTime),
+            "pcg": (assembled + 144 * nodeNum + 48 * freeNum,
+                    assemblyTime + iterations * (self.spmvTime * freeNnz + vectorTime)),
+            "matrix_free": (resident + self.geometryBytes * elemNum + 144 * nodeNum + 48 * freeNum +
+                            self.ebeElemBytes * min(elemNum, fem.chunkSize),
+                            iterations * (self.ebeTime * elemNum + vectorTime)),
+            "out_of_core": (outOfCore.residentBytes + 2 * outOfCore.minChunkSize * outOfCore.chunkElemBytes,
+                            self.outOfCoreTime * elemNum + iterations * (self.diskSpmvTime * freeNnz + vectorTime)),
+        }
+
+        candidates = []
+        for path in self.paths:
+            memory, time = estimates[path]
+            candidates.append({
+                'path': path,
+                'label': self.pathLabels[path],
+                'memory': float(memory),
+                'time': float(time),
+                'fits': self.memoryBudget is None or memory <= self.memoryBudget,
+            })
+        self.iterations = int(iterations)
+        self.blockNum = blockNum
+
+        return candidates
+
+    # メモリの上限に収まる解き方のうち、計算時間が最も短いものを選ぶ(denseは参考値のため選ばない)
+    def select(self):
+
+        candidates = [c for c in self.candidates if c['fits'] and c['path'] != "dense"]
+        if len(candidates) == 0:
+            return None
+
+        return min(candidates, key=lambda c: c['time'])
+
+    # 選んだ解き方をFEMに設定する
+    # メモリの上限がなく実メモリから決めた場合、ディスク上で組み立てる解き方にはその値を上限として渡す
+    # fem : 解析するFEM
+    def apply(self, fem):
+
+        if self.selected is None:
+            raise ValueError("メモリの上限に収まる解き方がありません。\n" + self.formatPlan())
+
+        path = self.selected['path']
+        fem.matrixFree = path == "matrix_free"
+        fem.outOfCore = path == "out_of_core"
+        fem.iterative = path == "pcg"
+        fem.precision = "single" if path == "direct_single" else "double"
+        if fem.outOfCore and fem.memoryBudget is None:
+            fem.memoryBudget = self.memoryBudget
+
+    # 見積もりを文字列にする
+    def formatPlan(self):
+
+        budget = "なし" if self.memoryBudget is None else format(self.memoryBudget / 1e6, ".0f") + " MB"
+        lines = ["解析計画: 節点数 " + str(self.nodeNum) + ", 要素数 " + str(self.elemNum) +
+                 ", 自由度数 " + str(self.freeNum) + ", メモリ上限 " + budget]
+        lines.append("".ljust(4) + "解き方".ljust(20) + "メモリ[MB]".rjust(12) + "時間[s]".rjust(12))
+        for candidate in self.candidates:
+            mark = "→" if candidate is self.selected else ("○" if candidate['fits'] else "×")
+            if candidate['path'] == "dense":
+                mark = "-"
+            lines.append(mark.ljust(4) + candidate['label'].ljust(20) +
+                         format(candidate['memory'] / 1e6, ".1f").rjust(12) +
+                         format(candidate['time'], ".3g").rjust(12))
+        if self.selected is None:
+            lines.append("メモリの上限に収まる解き方がありません")
+        else:
+            lines.append("選択: " + self.selected['label'])
+
+        return "\n".join(lines)
@@ -35,8 +35,8 @@ class C3D4:
         # ヤコビ行列を計算する
         matJ = self.makeJmatrix()
 
-        # Bマトリクスを計算する
-        matB = self.makeBmatrix()
+        # Bマトリクスを計算する(計算済みのヤコビ行列を使う)
+        matB = self.makeBmatrix(matJ)
         
         # Dマトリクスを計算する
         matD = self.makeDmatrix()
@@ -76,7 +76,8 @@ class C3D4:
         return matJ
 
     # Bマトリクスを作成する
-    def makeBmatrix(self):
+    # matJ : 計算済みのヤコビ行列(Noneの場合はここで計算する)
+    def makeBmatrix(self, matJ = None):
 
         # dNi/da, dNi/dbを計算する
         dN1da = -1.0
@@ -97,8 +98,9 @@ class C3D4:
                               [dN1db, dN2db, dN3db, dN4db],
                               [dN1dc, dN2dc, dN3dc, dN4dc]])
 
-         # ヤコビ行列を計算する
-        matJ = self.makeJmatrix()
+        # ヤコビ行列を計算する
+        if matJ is None:
+            matJ = self.makeJmatrix()
 
         #dNdxy = matJinv * matdNdab
         dNdxy = LA.solve(matJ, matdNdab)
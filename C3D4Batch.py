@@ -0,0 +1,173 @@
+import numpy as np
+import numpy.linalg as LA
+from Dmatrix import Dmatrix
+
+# 四面体4節点要素を全要素まとめて計算するクラス
+# C3D4と同じ計算を(要素数, ...)の配列に対してまとめて行う
+class C3D4Batch:
+    # コンストラクタ
+    # coords       : 要素の節点座標(要素数 x 4 x 3のnp.array型、geometryを与える場合はNoneでもよい)
+    # young        : ヤング率(スカラーまたは要素数の長さのnp.array型)
+    # poisson      : ポアソン比(スカラーまたは要素数の長さのnp.array型)
+    # density      : 密度(スカラーまたは要素数の長さのnp.array型)
+    # vecGravity   : 重力加速度のベクトル(np.array型、要素ごとに与える場合は要素数 x 3)
+    # geometry     : 計算済みの(ヤコビアン, 形状関数の微分dN/dx)の組(Noneの場合は座標から計算する)
+    def __init__(self, coords, young, poisson, density, vecGravity = None, geometry = None):
+
+        # インスタンス変数を定義する
+        self.nodeNum = 4               # 節点の数
+        self.nodeDof = 3               # 節点の自由度
+        self.coords = None if coords is None else np.asarray(coords, dtype=float)
+        self.vecGravity = vecGravity   # 重力加速度のベクトル(np.array型)
+        self.ipNum = 1                 # 積分点の数
+        self.w = 1.0 / 6.0             # 積分点の重み係数
+        self.ai = 1.0 / 4.0            # 積分点の座標(a,b,c座標系)
+        self.bi = 1.0 / 4.0            # 積分点の座標(a,b,c座標系)
+        self.ci = 1.0 / 4.0            # 積分点の座標(a,b,c座標系)
+
+        # ヤコビアンと形状関数の微分は一度だけ計算して使い回す
+        if geometry is None:
+            geometry = self.makeGeometry(self.coords)
+        self.detJ, self.dNdxy = geometry
+        self.elemNum = len(self.detJ)
+        self.young = np.broadcast_to(np.asarray(young, dtype=float), (self.elemNum,))
+        self.poisson = np.broadcast_to(np.asarray(poisson, dtype=float), (self.elemNum,))
+        self.density = np.broadcast_to(np.asarray(density, dtype=float), (self.elemNum,))
+        self.matB = self.makeBmatrix()
+
+    # 要素の形状に関する量を計算する
+    # coords : 要素の節点座標(要素数 x 4 x 3)
+    # 戻り値 : ヤコビアン(要素数)、形状関数の微分dN/dx(要素数 x 3 x 4)
+    @staticmethod
+    def makeGeometry(coords):
+
+        matJ = C3D4Batch.makeJmatrix(coords)
+        detJ = LA.det(matJ)
+        if np.any(detJ < 0):
+            raise ValueError("要素の計算に失敗しました")
+
+        # dNi/da, dNi/db, dNi/dcを計算する
+        matdNdab = np.array([[-1.0, 1.0, 0.0, 0.0],
+                             [-1.0, 0.0, 1.0, 0.0],
+                             [-1.0, 0.0, 0.0, 1.0]])
+
+        # dNi/dx, dNi/dy, dNi/dzを計算する
+        dNdxy = LA.solve(matJ, np.broadcast_to(matdNdab, (len(matJ), 3, 4)))
+
+        return detJ, dNdxy
+
+    # ヤコビ行列を計算する(要素数 x 3 x 3)
+    @staticmethod
+    def makeJmatrix(coords):
+
+        # i行目は節点i+1と節点1の座標の差
+        matJ = coords[:, 1:, :] - coords[:, :1, :]
+
+        return matJ
+
+    # Bマトリクスを作成する(要素数 x 6 x 12)
+    def makeBmatrix(self):
+
+        dNdxy = self.dNdxy
+
+        # Bマトリクスを計算する
+        matB = np.zeros((self.elemNum, 6, self.nodeNum * self.nodeDof))
+        for i in range(self.nodeNum):
+            c = self.nodeDof * i
+            matB[:, 0, c + 0] = dNdxy[:, 0, i]
+            matB[:, 1, c + 1] = dNdxy[:, 1, i]
+            matB[:, 2, c + 2] = dNdxy[:, 2, i]
+            matB[:, 3, c + 1] = dNdxy[:, 2, i]
+            matB[:, 3, c + 2] = dNdxy[:, 1, i]
+            matB[:, 4, c + 0] = dNdxy[:, 2, i]
+            matB[:, 4, c + 2] = dNdxy[:, 0, i]
+            matB[:, 5, c + 0] = dNdxy[:, 1, i]
+            matB[:, 5, c + 1] = dNdxy[:, 0, i]
+
+        return matB
+
+    # Dマトリクスを作成する(要素数 x 6 x 6)
+    def makeDmatrix(self):
+
+        # 材料が1種類の場合は1つのDマトリクスを全要素で共有する
+        if np.all(self.young == self.young[0]) and np.all(self.poisson == self.poisson[0]):
+            matD = Dmatrix(self.young[0], self.poisson[0]).makeDematrix()
+            return np.broadcast_to(matD, (self.elemNum, 6, 6))
+
+        tmp = self.young / ((1.0 + self.poisson) * (1.0 - 2.0 * self.poisson))
+        matD = np.zeros((self.elemNum, 6, 6))
+        matD[:, :3, :3] = self.poisson[:, None, None]
+        for i in range(3):
+            matD[:, i, i] = 1.0 - self.poisson
+            matD[:, 3 + i, 3 + i] = 0.5 * (1.0 - 2.0 * self.poisson)
+        matD = tmp[:, None, None] * matD
+
+        return matD
+
+    # 要素剛性マトリクスKeを作成する(要素数 x 12 x 12)
+    def makeKematrix(self):
+
+        # Dマトリクスを計算する
+        matD = self.makeDmatrix()
+
+        # Ketマトリクスをガウス積分で計算する
+        matKet = np.einsum('eji,ejk,ekl->eil', self.matB, matD, self.matB, optimize=True)
+        matKet *= (self.w * self.detJ)[:, None, None]
+
+        return matKet
+
+    # 形状関数行列Nを作成する(3 x 12)
+    def makeNmatrix(self):
+
+        N1 = 1 - self.ai - self.bi - self.ci
+        N2 = self.ai
+        N3 = self.bi
+        N4 = self.ci
+        matN = np.array([[N1, 0.0, 0.0, N2, 0.0, 0.0, N3, 0.0, 0.0, N4, 0.0, 0.0],
+                         [0.0, N1, 0.0, 0.0, N2, 0.0, 0.0, N3, 0.0, 0.0, N4, 0.0],
+                         [0.0, 0.0, N1, 0.0, 0.0, N2, 0.0, 0.0, N3, 0.0, 0.0, N4]])
+
+        return matN
+
+    # 等価節点力の荷重ベクトルを作成する(要素数 x 12)
+    def makeEqNodeForceVector(self):
+
+        vecEqNodeForce = np.zeros((self.elemNum, self.nodeNum * self.nodeDof))
+        if self.vecGravity is None:
+            return vecEqNodeForce
+
+        # 物体力による等価節点力を計算する
+        vecb = self.density[:, None] * np.broadcast_to(self.vecGravity, (self.elemNum, 3))
+        matN = self.makeNmatrix()
+        vecEqNodeForce = self.w * (vecb @ matN) * self.detJ[:, None]
+
+        return vecEqNodeForce
+
+    # 要素質量マトリクスMe(consistent mass matrix)を作成する(要素数 x 12 x 12)
+    def makeMematrix(self):
+
+        # 質量マトリクスをガウス積分で計算: Me = ∫ ρ N^T N dV
+        matN = self.makeNmatrix()
+        matMe = (self.w * self.density * self.detJ)[:, None, None] * (matN.T @ matN)
+
+        return matMe
+
+    # 要素の応力を計算する
+    # elemDisp : 要素の節点変位ベクトル(要素数 x 12)
+    # 戻り値   : 応力ベクトル(要素数 x 6)、von Mises応力(要素数)
+    def calculateStress(self, elemDisp):
+
+        # 歪を計算 ε = B × u
+        strain = np.einsum('eij,ej->ei', self.matB, elemDisp)
+
+        # 応力を計算 σ = D × ε
+        stress = np.einsum('eij,ej->ei', self.makeDmatrix(), strain)
+
+        # von Mises応力を計算
+        sxx, syy, szz, txy, tyz, tzx = stress.T
+        vonMises = np.sqrt(
+            ((sxx - syy)**2 + (syy - szz)**2 + (szz - sxx)**2) / 2.0 +
+            3.0 * (txy**2 + tyz**2 + tzx**2)
+        )
+
+        return stress, vonMises
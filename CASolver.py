@@ -0,0 +1,164 @@
+import time
+import numpy as np
+import numpy.linalg as LA
+from DirectSolver import DirectSolver
+
+# 組み合わせ近似法(Combined Approximations)による近似再解析のソルバー
+# 基準の係数行列K0の分解だけを使い、変更後の係数行列K = K0 + ΔKの解を少数の基底で近似する
+# 基底は二項級数の項 r1 = K0^-1 f、r(i+1) = -K0^-1 ΔK r(i) で、Kに関して正規直交化して使う
+# 近似解の誤差指標が許容値を超えた場合は、Kを分解して厳密に解き直す
+class CASolver:
+    # コンストラクタ
+    # basisNum  : 近似に使う基底の最大数
+    # errorTol  : 誤差指標(近似解の変位の相対誤差の見積もり)の許容値
+    #             超えた場合は厳密に解き直す
+    # nodeDof   : 節点の自由度
+    def __init__(self, basisNum = 6, errorTol = 1e-2, nodeDof = 3):
+
+        # インスタンス変数を定義する
+        self.basisNum = basisNum                                 # 基底の最大数
+        self.errorTol = errorTol                                 # 誤差指標の許容値
+        self.nodeDof = nodeDof                                   # 節点の自由度
+        self.baseSolver = DirectSolver(nodeDof=nodeDof)          # 基準の係数行列K0の分解
+        self.matBase = None                                      # 基準の係数行列K0
+        self.baseDofs = None                                     # K0の各行に対応する全体自由度の番号
+        self.exactSolver = DirectSolver(nodeDof=nodeDof)         # 厳密に解き直す場合のソルバー(並び替えを使い回す)
+        self.matA = None                                         # 解く係数行列K
+        self.dofs = None                                         # Kの各行に対応する全体自由度の番号
+        self.info = {}                                           # 分解、求解の情報
+
+    # 基準の係数行列K0を分解する(以降のケースはこの分解だけで近似する)
+    # matA : 基準の係数行列(疎行列)
+    # dofs : matAの各行に対応する全体自由度の番号(Noneの場合は行番号)
+    def setBaseline(self, matA, dofs = None):
+
+        if dofs is None:
+            dofs = np.arange(matA.shape[0])
+        self.baseSolver.factorize(matA, dofs)
+        self.matBase = matA
+        self.baseDofs = np.asarray(dofs)
+
+    # 係数行列を設定する
+    # 基準の係数行列がない場合、または自由度が基準と異なる場合は、この係数行列を基準として分解する
+    # matA : 係数行列(疎行列)
+    # dofs : matAの各行に対応する全体自由度の番号(Noneの場合は行番号)
+    def factorize(self, matA, dofs = None):
+
+        if dofs is None:
+            dofs = np.arange(matA.shape[0])
+        dofs = np.asarray(dofs)
+
+        startTime = time.perf_counter()
+        baseline = self.matBase is None or not np.array_equal(self.baseDofs, dofs)
+        if baseline:
+            self.setBaseline(matA, dofs)
+        self.matA = matA
+        self.dofs = dofs
+
+        self.info = {
+            'dofNum': matA.shape[0],
+            'baseline': baseline,
+            'setupTime': time.perf_counter() - startTime,
+        }
+
+    # 連立方程式を近似的に解く(誤差指標が許容値を超えた場合は厳密に解く)
+    # vecb  : 右辺ベクトル(複数の右辺を列に並べた行列も可、いずれかの列が許容値を超えた場合は全列を厳密に解く)
+    # vecx0 : 反復法の初期値(PCGSolverと同じ呼び出し方にするための引数で、近似再解析では使わない)
+    def solve(self, vecb, vecx0 = None):
+
+        if self.matA is None:
+            raise ValueError("係数行列が設定されていません。先にfactorize()を実行してください。")
+
+        startTime = time.perf_counter()
+        vecb = np.asarray(vecb, dtype=float)
+        matB = vecb.reshape(len(vecb), -1)
+
+        # 基準の係数行列そのものの場合は、基準の分解で厳密に解ける
+        if self.info['baseline']:
+            vecx = self.baseSolver.solve(vecb)
+            self.info.update({'approximate': False, 'fallback': False, 'basisSize': 0,
+                              'errorIndicator': 0.0, 'solveTime': time.perf_counter() - startTime})
+            return vecx
+
+        matX = np.zeros_like(matB)
+        basisSize = 0
+        errorIndicator = 0.0
+        for i in range(matB.shape[1]):
+            matX[:, i], basisNum, lastTerm = self.approximate(matB[:, i])
+            errorIndicator = max(errorIndicator, lastTerm, self.estimateError(matB[:, i], matX[:, i]))
+            basisSize = max(basisSize, basisNum)
+
+        # 誤差指標が許容値を超えた場合は、Kを分解して厳密に解き直す
+        fallback = errorIndicator > self.errorTol
+        if fallback:
+            self.exactSolver.factorize(self.matA, self.dofs)
+            matX = self.exactSolver.solve(matB)
+
+        self.info.update({
+            'approximate': not fallback,
+            'fallback': fallback,
+            'basisSize': basisSize,
+            'errorIndicator': errorIndicator,
+            'solveTime': time.perf_counter() - startTime,
+        })
+
+        return matX.reshape(vecb.shape)
+
+    # 近似解の残差から誤差指標を求める
+    # 誤差 e = K^-1 (f - K u) を基準の分解で e ≈ K0^-1 (f - K u) と見積もり、解に対する相対値 ||e|| / ||u|| を返す
+    # (残差そのものは剛性の大きい成分に支配され、変位や応力の誤差を大きく見積もりすぎるため使わない)
+    # 変更が大きくK0^-1がK^-1の近似にならない場合は小さく見積もるため、基底の最後の項の大きさと併用する
+    def estimateError(self, vecb, vecx):
+
+        normx = LA.norm(vecx)
+        if normx == 0.0:
+            return 0.0 if LA.norm(vecb) == 0.0 else np.inf
+
+        # K0とKの剛性の違いは、見積もった誤差の向きでエネルギーが最小になる大きさに補正する
+        vecr = vecb - self.matA @ vecx
+        vece = self.baseSolver.solve(vecr)
+        eKe = vece @ (self.matA @ vece)
+        if eKe > 0.0:
+            vece *= abs(vece @ vecr) / eKe
+
+        return LA.norm(vece) / normx
+
+    # 右辺ベクトル1本について、組み合わせ近似法で近似解を求める
+    # 基底をKに関して正規直交化(Gram-Schmidt)すると、縮約した係数行列は単位行列になり
+    # 近似解は u = Σ (q_i^T f) q_i で求まる
+    # 戻り値 : 近似解、使った基底の数、最後の基底の項の解に対する相対的な大きさ
+    #          (級数が収束していなければ大きくなるため、誤差指標に使う)
+    def approximate(self, vecb):
+
+        vecx = np.zeros_like(vecb)
+        basis = []
+        converged = False
+        vecr = self.baseSolver.solve(vecb)
+        for i in range(self.basisNum):
+            vecKr = self.matA @ vecr
+            vecv = vecr.copy()
+            vecKv = vecKr.copy()
+            for vecq, vecKq in basis:
+                coef = vecq @ vecKr
+                vecv -= coef * vecq
+                vecKv -= coef * vecKq
+
+            # 前の基底でほぼ表せる(新しい方向がない)場合は、級数の残りの項も同じ空間に入るため
+            # 近似解は厳密解と一致する
+            norm = vecv @ vecKv
+            if norm <= 1e-14 * (vecr @ vecKr) or norm <= 0.0:
+                converged = True
+                break
+            norm = np.sqrt(norm)
+            basis.append((vecv / norm, vecKv / norm))
+            vecx += (basis[-1][0] @ vecb) * basis[-1][0]
+
+            # 次の基底 r(i+1) = -K0^-1 ΔK r(i) = -K0^-1 (K - K0) r(i)
+            if i + 1 < self.basisNum:
+                vecr = -self.baseSolver.solve(vecKr - self.matBase @ vecr)
+
+        lastTerm = 0.0
+        if not converged and len(basis) > 0 and LA.norm(vecx) > 0.0:
+            lastTerm = abs(basis[-1][0] @ vecb) * LA.norm(basis[-1][0]) / LA.norm(vecx)
+
+        return vecx, len(basis), lastTerm
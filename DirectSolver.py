@@ -0,0 +1,245 @@
+import time
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as SLA
+
+# 疎行列の直接法ソルバー(LU分解)
+# 対称正定値の係数行列を分解し、分解時のピボットから拘束不足を検出する
+# 分解は解析(フィルインを減らす並び替えを求める)と数値分解に分け、解析は非ゼロ構造ごとに一度だけ行う
+# 解析は係数行列を節点ごとにまとめたグラフ(自由度の1/3の次数)の最小次数順序で行い、
+# 並べ替えた係数行列を並び替えなし(NATURAL)で数値分解する
+# 非ゼロ構造が同じ係数行列(パラメトリック解析の各ケースなど)は前回の並び替えを使い、数値分解だけを行う
+# 混合精度(precision="single")の場合は係数行列を単精度で分解し(分解のメモリが約半分になる)、
+# 倍精度の係数行列で求めた残差による反復改良で倍精度の解に近づける
+class DirectSolver:
+    # コンストラクタ
+    # pivotTol : ピボットと元の対角成分の比がこの値以下の自由度を拘束不足とみなす
+    #            (単精度で分解する場合は単精度の丸め誤差より小さい値は使わない)
+    # nodeDof  : 節点の自由度(自由度番号から節点番号を求めるのに使う)
+    # permcSpec: 解析で使うSuperLUの並び替えの方法(並び替え済みの行列を渡す場合は"NATURAL")
+    # precision: 分解の精度("double" : 倍精度、"single" : 単精度で分解して反復改良する)
+    # refineTol: 反復改良を終える相対残差 ||b - Ax|| / ||b||
+    # maxRefine: 反復改良の最大回数(収束しない場合は倍精度で分解し直して解く)
+    def __init__(self, pivotTol = 1e-10, nodeDof = 3, permcSpec = "MMD_AT_PLUS_A", precision = "double",
+                 refineTol = 1e-10, maxRefine = 10):
+
+        # インスタンス変数を定義する
+        self.pivotTol = pivotTol                                 # 特異判定の許容値
+        self.nodeDof = nodeDof                                   # 節点の自由度
+        self.permcSpec = permcSpec                               # SuperLUの並び替えの方法
+        self.factor = None                                       # LU分解の結果
+        self.analysis = None                                     # 解析の結果(非ゼロ構造、並び替え、解析の時間)
+        self.unconstrainedDofs = np.empty(0, dtype=np.int64)     # 拘束不足の自由度番号(0始まり)
+        self.precision = precision                               # 分解の精度
+        self.refineTol = refineTol                               # 反復改良の収束判定の相対残差
+        self.maxRefine = maxRefine                               # 反復改良の最大回数
+        self.matA = None                                         # 反復改良の残差に使う倍精度の係数行列(CSC形式)
+        self.dofs = None                                         # 係数行列の各行に対応する全体自由度の番号
+        self.info = {}                                           # 分解、求解の情報
+
+    # 係数行列をLU分解する
+    # matA : 係数行列(疎行列、BSR形式の場合は成分単位のCSC形式に変換して分解する)
+    # dofs : matAの各行に対応する全体自由度の番号(Noneの場合は行番号)
+    def factorize(self, matA, dofs = None):
+
+        matA = sparse.csc_matrix(matA)
+        if dofs is None:
+            dofs = np.arange(matA.shape[0])
+        dofs = np.asarray(dofs)
+        if not self.precision in ("double", "single"):
+            raise ValueError("未対応の精度です: " + str(self.precision))
+        single = self.precision == "single"
+        self.matA = matA if single else None
+        self.dofs = dofs
+        self.factor = None
+        self.unconstrainedDofs = np.empty(0, dtype=np.int64)
+
+        # 対角成分が0の自由度は剛性を持たないため、分解する前に検出する
+        vecDiag = np.abs(matA.diagonal())
+        if np.any(vecDiag == 0.0):
+            self.unconstrainedDofs = np.sort(dofs[vecDiag == 0.0])
+            raise ValueError(self.makeSingularMessage())
+
+        # 非ゼロ構造が前回の解析と同じであれば並び替えを使い回し、異なる場合は解析し直す
+        reused = self.hasAnalysis(matA, dofs)
+        if not reused:
+            self.analysis = self.analyze(matA, dofs)
+        perm = self.analysis['perm']
+
+        # 並べ替えた係数行列を並び替えなしで分解し、ピボットが元の自由度に対応するようにする
+        # ピボットがちょうど0になり分解できない場合は、対角成分をわずかに増やして分解し直し
+        # 拘束不足の自由度をピボットから特定する
+        startTime = time.perf_counter()
+        matP = sparse.csc_matrix(matA[perm][:, perm])
+        matF = matP.astype(np.float32) if single else matP
+        try:
+            factor = self.makeFactor(matF)
+        except RuntimeError:
+            factor = self.makeFactor(matF + sparse.diags(1e-2 * self.pivotTol * vecDiag[perm]).astype(matF.dtype))
+        factorTime = time.perf_counter() - startTime
+
+        # ピボットが元の対角成分に比べて極端に小さい自由度は拘束不足
+        # 並べ替えた行列のi列は分解後のperm_c[i]列に移るため、i列のピボットはUのperm_c[i]番目の対角成分
+        # 並べ替えた行列のk列は元の行列のperm[k]列
+        vecPivot = np.empty(len(perm))
+        vecPivot[perm] = np.abs(factor.U.diagonal())[factor.perm_c]
+        vecRatio = vecPivot / vecDiag
+        pivotTol = max(self.pivotTol, 10.0 * np.finfo(np.float32).eps) if single else self.pivotTol
+        if np.any(vecRatio <= pivotTol):
+            self.unconstrainedDofs = np.sort(dofs[vecRatio <= pivotTol])
+            raise ValueError(self.makeSingularMessage())
+
+        self.factor = factor
+        self.info = {
+            'dofNum': matA.shape[0],
+            'nnzA': matA.nnz,
+            'nnzFactor': factor.L.nnz + factor.U.nnz,
+            'minPivotRatio': float(vecRatio.min()),
+            'analysisReused': reused,
+            'analysisTime': 0.0 if reused else self.analysis['time'],
+            'analysisTimeSaved': self.analysis['time'] if reused else 0.0,
+            'factorTime': factorTime,
+            'precision': self.precision,
+            'factorBytes': self.getFactorBytes(factor),
+        }
+
+    # 分解結果(LとUの値と添字)のバイト数を返す
+    @staticmethod
+    def getFactorBytes(factor):
+
+        return sum(mat.data.nbytes + mat.indices.nbytes + mat.indptr.nbytes for mat in (factor.L, factor.U))
+
+    # 係数行列の非ゼロ構造と自由度が前回の解析と同じかどうかを返す
+    # matA : 係数行列(CSC形式)
+    # dofs : matAの各行に対応する全体自由度の番号
+    def hasAnalysis(self, matA, dofs):
+
+        analysis = self.analysis
+        if analysis is None or analysis['shape'] != matA.shape:
+            return False
+
+        return (np.array_equal(analysis['dofs'], dofs) and np.array_equal(analysis['indptr'], matA.indptr) and
+                np.array_equal(analysis['indices'], matA.indices))
+
+    # フィルインを減らす自由度の並び(perm[新しい番号] = 元の番号)を求める
+    # 係数行列を節点ごとにまとめたグラフと同じ非ゼロ構造を持つ対角優位な行列をself.permcSpecの順序で分解し、
+    # SuperLUが選んだ節点の順に、節点の自由度をまとめて並べる
+    # matA : 係数行列(CSC形式)
+    # dofs : matAの各行に対応する全体自由度の番号
+    def analyze(self, matA, dofs):
+
+        startTime = time.perf_counter()
+        if self.permcSpec == "NATURAL":
+            perm = np.arange(matA.shape[0])
+        else:
+            _, vecNodes = np.unique(dofs // self.nodeDof, return_inverse=True)
+            matNode = sparse.csr_matrix((np.ones(len(dofs)), (np.arange(len(dofs)), vecNodes)))
+            matPattern = sparse.csc_matrix((np.ones(matA.nnz), matA.indices, matA.indptr), shape=matA.shape)
+            matGraph = sparse.csr_matrix(matNode.T @ matPattern @ matNode)
+            matGraph.data[:] = 1.0
+            vecDeg = np.diff(matGraph.indptr)
+            factor = SLA.splu(sparse.csc_matrix(sparse.diags(2.0 * vecDeg) - matGraph), permc_spec=self.permcSpec,
+                              diag_pivot_thresh=0.0, options=dict(SymmetricMode=True))
+            vecRank = np.asarray(factor.perm_c, dtype=np.int64)
+            perm = np.argsort(vecRank[vecNodes] * self.nodeDof + dofs % self.nodeDof, kind="stable")
+
+        return {
+            'shape': matA.shape,
+            'dofs': dofs.copy(),
+            'indptr': matA.indptr.copy(),
+            'indices': matA.indices.copy(),
+            'perm': perm,
+            'time': time.perf_counter() - startTime,
+        }
+
+    # SuperLUで並べ替え済みの係数行列をLU分解する
+    def makeFactor(self, matA):
+
+        return SLA.splu(sparse.csc_matrix(matA), permc_spec="NATURAL", diag_pivot_thresh=0.0,
+                        options=dict(SymmetricMode=True))
+
+    # 分解済みの係数行列で連立方程式を解く
+    # vecb  : 右辺ベクトル(複数の右辺を列に並べた行列も可)
+    # vecx0 : 反復法の初期値(PCGSolverと同じ呼び出し方にするための引数で、直接法では使わない)
+    def solve(self, vecb, vecx0 = None):
+
+        if self.factor is None:
+            raise ValueError("係数行列が分解されていません。先にfactorize()を実行してください。")
+
+        startTime = time.perf_counter()
+        vecb = np.asarray(vecb, dtype=float)
+        if self.precision == "single":
+            vecx = self.solveRefined(vecb)
+        else:
+            vecx = self.solveFactor(vecb)
+        self.info['solveTime'] = time.perf_counter() - startTime
+
+        return vecx
+
+    # 分解結果で前進・後退代入を行う(単精度で分解した場合は単精度で解き、倍精度で返す)
+    # vecb : 右辺ベクトル(複数の右辺を列に並べた行列も可)
+    def solveFactor(self, vecb):
+
+        perm = self.analysis['perm']
+        vecx = np.empty(vecb.shape)
+        vecx[perm] = self.factor.solve(vecb[perm].astype(self.factor.L.dtype))
+
+        return vecx
+
+    # 単精度の分解と倍精度の残差で反復改良して解く
+    # x(k+1) = x(k) + A32^-1 (b - A x(k)) を、相対残差がrefineTol以下になるまで繰り返す
+    # 残差は単精度の範囲に収まるよう大きさで割ってから解く
+    # maxRefine回で収束しない場合(条件数が大きく単精度の分解では改良が進まない場合)は、倍精度で分解し直して解く
+    # vecb : 右辺ベクトル(複数の右辺を列に並べた行列も可、全ての列が収束するまで繰り返す)
+    def solveRefined(self, vecb):
+
+        normb = np.linalg.norm(vecb, axis=0)
+        normb = np.where(normb > 0.0, normb, 1.0)
+        vecx = self.solveFactor(vecb)
+        residuals = []
+        for step in range(self.maxRefine + 1):
+            vecr = vecb - self.matA @ vecx
+            residuals.append(float(np.max(np.linalg.norm(vecr, axis=0) / normb)))
+            if residuals[-1] <= self.refineTol or step == self.maxRefine:
+                break
+            scale = np.linalg.norm(vecr, axis=0)
+            scale = np.where(scale > 0.0, scale, 1.0)
+            vecx = vecx + self.solveFactor(vecr / scale) * scale
+
+        self.info['refinementSteps'] = len(residuals) - 1
+        self.info['residuals'] = residuals
+        self.info['relativeResidual'] = residuals[-1]
+        self.info['precisionFallback'] = residuals[-1] > self.refineTol
+
+        # 収束しない場合は倍精度で分解し直して解く(以降の分解も倍精度で行う)
+        if self.info['precisionFallback']:
+            matA = self.matA
+            self.precision = "double"
+            self.factorize(matA, self.dofs)
+            vecx = self.solveFactor(vecb)
+            vecr = vecb - matA @ vecx
+            self.info.update({
+                'refinementSteps': len(residuals) - 1,
+                'residuals': residuals,
+                'relativeResidual': float(np.max(np.linalg.norm(vecr, axis=0) / normb)),
+                'precisionFallback': True,
+            })
+
+        return vecx
+
+    # 拘束不足の節点番号(1始まり)を返す
+    def getUnconstrainedNodes(self):
+
+        return np.unique(self.unconstrainedDofs // self.nodeDof) + 1
+
+    # 拘束不足を知らせるメッセージを作成する
+    def makeSingularMessage(self, maxNum = 10):
+
+        nodeNos = self.getUnconstrainedNodes()
+        strNodes = ", ".join(str(no) for no in nodeNos[:maxNum])
+        if len(nodeNos) > maxNum:
+            strNodes += " ... (他" + str(len(nodeNos) - maxNum) + "節点)"
+
+        return ("有限要素法の計算に失敗しました。拘束が不足しています。\n" +
+                "拘束されていない自由度: " + str(len(self.unconstrainedDofs)) + "個\n" +
+                "該当する節点番号: " + strNodes)
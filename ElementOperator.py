@@ -0,0 +1,146 @@
+import numpy as np
+import scipy.sparse.linalg as SLA
+
+# 剛性マトリクスを組み立てずに、要素ごとの計算(Element-by-Element)で K u を求める線形作用素
+# 保持するのはメッシュの形状キャッシュ(ヤコビアン、dN/dx)と要素の接続関係だけで、
+# 全体マトリクスの非ゼロ成分やシンボリック組み立ての格納先の配列を作らない
+#
+# メモリと計算時間の目安(四面体4節点要素、1万要素程度の片持ち梁で測定)
+#   組み立てたK : CSR形式の値と列番号で1要素あたり約450バイト、シンボリック組み立ての格納先で
+#                 約580バイト、合わせて約1kB(組み立て中は要素マトリクスの一時配列も加わる)
+#   この作用素   : 形状キャッシュ(dN/dxの12個とヤコビアン)と接続関係で、1要素あたり約125バイト
+#   K u の計算   : 1要素あたり約300回の浮動小数点演算で、組み立てたKの疎行列積の約9倍の時間がかかる
+#                  (反復法の1回の反復が遅くなる代わりに、メモリは約1/8になる)
+# 要素はchunkSizeごとにまとめて計算し、一時配列の大きさを抑える
+class ElementOperator(SLA.LinearOperator):
+    # コンストラクタ
+    # mesh      : メッシュ(Mesh型、形状キャッシュを共有する)
+    # nodeDof   : 節点の自由度
+    # dofs      : 作用素の行と列に対応する全体自由度の番号(Noneの場合は全自由度)
+    #             拘束されていない自由度を与えるとK_ffとして働く(他の自由度の変位は0として扱う)
+    # chunkSize : まとめて計算する要素数
+    def __init__(self, mesh, nodeDof = 3, dofs = None, chunkSize = 50000):
+
+        # インスタンス変数を定義する
+        self.mesh = mesh                                     # メッシュ
+        self.nodeDof = nodeDof                               # 節点の自由度
+        self.dofNum = mesh.nodeNum * nodeDof                 # 全自由度数
+        self.dofs = None if dofs is None else np.asarray(dofs)   # 作用素の自由度の番号
+        self.chunkSize = chunkSize                           # まとめて計算する要素数
+        self.nodeBlocks = None                               # 節点ごとの3x3対角ブロック(前処理に使う)
+        self.cacheGeometry = True                            # メッシュの形状キャッシュを作成して保持するかどうか
+
+        # 材料ごとのラメ定数 λ, μ (Dマトリクスと同じ等方性弾性体)
+        self.lame1 = mesh.young * mesh.poisson / ((1.0 + mesh.poisson) * (1.0 - 2.0 * mesh.poisson))
+        self.lame2 = mesh.young / (2.0 * (1.0 + mesh.poisson))
+
+        size = self.dofNum if self.dofs is None else len(self.dofs)
+        super().__init__(dtype=np.float64, shape=(size, size))
+
+    # 自由度を絞り込んだ作用素を作成する(形状キャッシュは共有する)
+    # dofs : 全体自由度の番号
+    def restrict(self, dofs):
+
+        operator = ElementOperator(self.mesh, self.nodeDof, dofs, self.chunkSize)
+        operator.nodeBlocks = self.nodeBlocks
+        operator.cacheGeometry = self.cacheGeometry
+
+        return operator
+
+    # 作用素が保持する配列のバイト数(形状キャッシュと接続関係、材料番号)
+    # メッシュが形状キャッシュを保持しない場合、形状キャッシュの分は含めない
+    @property
+    def nbytes(self):
+
+        geometryBytes = 0
+        if not self.mesh.geometry is None:
+            geometryBytes = sum(array.nbytes for array in self.mesh.geometry)
+
+        return geometryBytes + self.mesh.conn.nbytes + self.mesh.materialIds.nbytes
+
+    def _matvec(self, vecx):
+
+        if self.dofs is None:
+            return self.applyFull(np.ravel(vecx))
+
+        vecu = np.zeros(self.dofNum)
+        vecu[self.dofs] = np.ravel(vecx)
+
+        return self.applyFull(vecu)[self.dofs]
+
+    def _matmat(self, matX):
+
+        return np.column_stack([self._matvec(matX[:, i]) for i in range(matX.shape[1])])
+
+    def _adjoint(self):
+
+        return self
+
+    # 全自由度の変位から K u を計算する
+    # 要素ごとに 変位勾配 → ひずみ → 応力 σ = λ tr(ε) I + 2μ ε → 節点力 f_a = V Σ_i dN_a/dx_i σ_i を求め、
+    # 節点に足し込む(Bマトリクスを作らずにdN/dxから直接計算する)
+    # 形状は要素の範囲ごとに取り出す(self.cacheGeometryがFalseで形状キャッシュがない場合はその範囲だけを計算する)
+    # vecu : 全自由度の変位ベクトル
+    def applyFull(self, vecu):
+
+        matU = np.asarray(vecu, dtype=float).reshape(-1, self.nodeDof)
+        matF = np.zeros((self.mesh.nodeNum, self.nodeDof))
+        for start in range(0, self.mesh.elemNum, self.chunkSize):
+            elemRange = slice(start, min(start + self.chunkSize, self.mesh.elemNum))
+            conn = self.mesh.conn[elemRange]
+            materialIds = self.mesh.materialIds[elemRange]
+            detJ, dNdx = self.mesh.getGeometry(elemRange, self.cacheGeometry)
+
+            # 変位勾配 du_j/dx_i (要素数 x 3 x 3)とひずみテンソル
+            matGrad = np.matmul(dNdx, np.take(matU, conn, axis=0))
+            matStrain = 0.5 * (matGrad + matGrad.transpose(0, 2, 1))
+
+            # 応力テンソルに要素の体積を掛ける
+            volume = detJ / 6.0
+            trace = np.trace(matStrain, axis1=1, axis2=2)
+            matStress = (2.0 * self.lame2[materialIds] * volume)[:, None, None] * matStrain
+            matStress[:, np.arange(3), np.arange(3)] += (self.lame1[materialIds] * volume * trace)[:, None]
+
+            # 要素の節点力(要素数 x 4 x 3)を方向ごとに全体の節点力に足し込む
+            # (要素の自由度番号の配列を作らず、節点番号で足し込む)
+            vecElemForce = np.matmul(dNdx.transpose(0, 2, 1), matStress)
+            nodeNos = conn.ravel()
+            for j in range(self.nodeDof):
+                matF[:, j] += np.bincount(nodeNos, weights=vecElemForce[:, :, j].ravel(), minlength=self.mesh.nodeNum)
+
+        return matF.ravel()
+
+    # 節点ごとの3x3対角ブロック K_aa (節点数 x 3 x 3)を作成する(一度だけ計算する)
+    # 要素の節点aについて K_aa = V ((λ + μ) g g^T + μ |g|^2 I)、g = dN_a/dx
+    def makeNodeBlocks(self):
+
+        if not self.nodeBlocks is None:
+            return self.nodeBlocks
+
+        nodeBlocks = np.zeros((self.mesh.nodeNum, 3, 3))
+        for start in range(0, self.mesh.elemNum, self.chunkSize):
+            elemRange = slice(start, min(start + self.chunkSize, self.mesh.elemNum))
+            conn = self.mesh.conn[elemRange]
+            materialIds = self.mesh.materialIds[elemRange]
+            detJ, dNdx = self.mesh.getGeometry(elemRange, self.cacheGeometry)
+            volume = detJ / 6.0
+            lame1 = self.lame1[materialIds] * volume
+            lame2 = self.lame2[materialIds] * volume
+
+            matBlocks = (lame1 + lame2)[:, None, None, None] * np.einsum('eia,eja->eaij', dNdx, dNdx)
+            vecNorm = lame2[:, None] * np.einsum('eia,eia->ea', dNdx, dNdx)
+            matBlocks[:, :, np.arange(3), np.arange(3)] += vecNorm[:, :, None]
+            nodeNos = conn.ravel()
+            for i in range(9):
+                nodeBlocks.reshape(-1, 9)[:, i] += np.bincount(nodeNos, weights=matBlocks.reshape(-1, 9)[:, i],
+                                                               minlength=self.mesh.nodeNum)
+        self.nodeBlocks = nodeBlocks
+
+        return nodeBlocks
+
+    # 作用素の対角成分(Jacobi前処理に使う)
+    def diagonal(self):
+
+        vecDiag = self.makeNodeBlocks()[:, np.arange(3), np.arange(3)].ravel()
+
+        return vecDiag if self.dofs is None else vecDiag[self.dofs]
@@ -1,45 +1,221 @@
+import os
+import time
 import numpy as np
-import numpy.linalg as LA
+import scipy.sparse as sparse
+import scipy.sparse.linalg as SLA
+from concurrent.futures import ThreadPoolExecutor
+from AnalysisPlanner import AnalysisPlanner
 from Boundary import Boundary
+from C3D4Batch import C3D4Batch
+from DirectSolver import DirectSolver
+from ElementOperator import ElementOperator
+from Mesh import Mesh
+from NodeOrdering import NodeOrdering
+from OutOfCoreAssembly import OutOfCoreAssembly
+from OutOfCoreMatrix import OutOfCoreMatrix
+from PCGSolver import PCGSolver
 
 class FEM:
     # コンストラクタ
+    # FEM(mesh, bound)           : メッシュを配列のまま与える(Mesh型)
+    # FEM(nodes, elements, bound): Node型、C3D4型のリストから与える(互換用)
     # nodes    : 節点は1から始まる順番で並んでいる前提(Node型のリスト)
     # elements : 要素は種類ごとにソートされている前提(C3D4型のリスト)
     # bound    : 境界条件(d2Boundary型)
-    def __init__(self, nodes, elements, bound):
+    def __init__(self, nodes, elements, bound = None):
 
         # インスタンス変数を定義する
-        self.nodeDof = 3   # 節点の自由度
-        self.nodes = nodes
-        self.elements = elements
-        self.bound = bound
+        self.nodeDof = 3          # 節点の自由度
+        self.ordering = None      # 分解前の節点の並び替え("rcm", "amd"、Noneの場合はソルバーに任せる)
+        self.nodeOrdering = None  # 並び替えの結果(NodeOrdering型)
+        self.workers = None       # 全体マトリクスの作成に使うスレッド数(Noneの場合はCPUのコア数)
+        self.chunkSize = 50000    # 全体マトリクスの作成で1つのスレッドがまとめて計算する要素数の上限
+        self.minThreadElems = 2000   # 全体マトリクスの作成でスレッド1つに割り当てる最小の要素数
+        self.timings = {}         # 解析の段階ごとの計算時間[s](組み立て、境界条件、求解、応力)
+        self.matrixFree = False   # Kマトリクスを組み立てずに要素ごとの計算で反復法を解くかどうか(省メモリ)
+        self.precision = "double" # 直接法の分解の精度("single"の場合は単精度で分解して倍精度で反復改良する)
+        self.refineTol = 1e-10    # 混合精度の反復改良を終える相対残差
+        self.outOfCore = False    # K_ffをディスク上に組み立てて反復法で解くかどうか(メモリに収まらないメッシュ向け)
+        self.memoryBudget = None  # ディスク上に組み立てる場合のメモリの上限[バイト](Noneの場合は上限なし)
+        self.workDir = None       # ディスク上に組み立てる場合の一時ファイルのディレクトリ(Noneの場合はOSの一時ディレクトリ)
+        self.iterative = False    # 組み立てたKマトリクスを反復法(PCGSolver)で解くかどうか
+        self.plan = None          # 解析前の見積もりと選んだ解き方(AnalysisPlanner型)
+        if isinstance(nodes, Mesh):
+            self.mesh = nodes
+            self.bound = elements
+            self._nodes = None
+            self._elements = None
+        else:
+            self.mesh = Mesh.fromObjects(nodes, elements)
+            self.bound = bound
+            self._nodes = nodes
+            self._elements = elements
+
+    # Node型のリスト(互換用、Meshから作成した場合は必要になった時点で作成する)
+    @property
+    def nodes(self):
+        if self._nodes is None:
+            self._nodes = self.mesh.makeNodes()
+        return self._nodes
+
+    # C3D4型のリスト(互換用、Meshから作成した場合は必要になった時点で作成する)
+    @property
+    def elements(self):
+        if self._elements is None:
+            self._elements = self.mesh.makeElements(self.nodes)
+        return self._elements
+
+    # 解析前にメモリと計算時間を見積もり、メモリの上限に収まる最も速い解き方を設定する
+    # 見積もりは節点数、要素数、拘束されていない自由度数から求め、大きな配列は作らない
+    # 結果はself.planに保存する(収まる解き方がない場合は例外が発生する)
+    # paths : 候補にする解き方のリスト(Noneの場合は全て、AnalysisPlannerを参照)
+    def planAnalysis(self, paths = None):
+
+        plan = AnalysisPlanner(self, paths)
+        self.plan = plan
+        plan.apply(self)
+
+        return plan
 
     # 解析を行う
-    def analysis(self):
-
-        # 境界条件を考慮しないKマトリクスを作成する
-        matK = self.makeKmatrix()
+    # solver   : 連立方程式のソルバー(DirectSolverまたはPCGSolver、Noneの場合はDirectSolver、
+    #            self.iterativeの場合はPCGSolver)
+    #            同じソルバーを非ゼロ構造が同じ別のケースに渡すと、DirectSolverは並び替え(解析)を、
+    #            PCGSolver(reusePreconditioner)は前処理を使い回す
+    #            self.matrixFree、self.outOfCoreの場合はPCGSolver(Noneの場合はブロックJacobi前処理)のみ使える
+    # vecDisp0 : 反復法の初期値にする全節点の変位ベクトル、またはその候補を列に並べた行列
+    #            (近いケースの解など、Noneの場合は0から解く。直接法、近似再解析では使わない)
+    def analysis(self, solver = None, vecDisp0 = None):
+
+        # 境界条件を考慮しないKマトリクス(省メモリの場合は組み立てない作用素、
+        # ディスク上に組み立てる場合はK_ffを組み立てる前の作用素)を作成する
+        startTime = time.perf_counter()
+        if self.matrixFree:
+            matK = self.makeKoperator()
+        elif self.outOfCore:
+            matK = self.makeOutOfCoreAssembly()
+        else:
+            matK = self.makeKmatrix()
 
         # 荷重ベクトルを作成する
         vecf = self.makeForceVector()
-
-        # 境界条件を考慮したKマトリクス、荷重ベクトルを作成する
-        matKc, vecfc = self.setBoundCondition(matK, vecf)
-
-        if np.isclose(LA.det(matKc), 0.0) :
-            raise ValueError("有限要素法の計算に失敗しました。")
+        self.timings['assembly'] = time.perf_counter() - startTime
 
         # 変位ベクトルを計算する
-        vecDisp = LA.solve(matKc, vecfc)
+        vecDisp = self.solveDisplacement(matK, vecf, solver, vecDisp0)
         self.vecDisp = vecDisp
 
         # 節点反力を計算する
-        vecRF = np.array(matK @ vecDisp - vecf).flatten()
+        vecRF = np.asarray(matK @ vecDisp - vecf).flatten()
         self.vecRF = vecRF
 
         return vecDisp, vecRF
 
+    # 複数の荷重ケースをまとめて解析する
+    # Kマトリクスの作成と分解は一度だけ行い、全ケースを複数の右辺として一度に解く
+    # matLoad : 荷重ケースごとの節点荷重ベクトルを列に並べた行列(自由度数 x ケース数)
+    #           等価節点力(物体力)は全ケースに加える
+    # solver  : 連立方程式のソルバー(Noneの場合はDirectSolver)
+    # 戻り値  : 変位(自由度数 x ケース数)、節点反力(自由度数 x ケース数)、最大von Mises応力(ケース数)
+    def loadCaseAnalysis(self, matLoad, solver = None):
+
+        matLoad = np.asarray(matLoad, dtype=float).reshape(self.mesh.nodeNum * self.nodeDof, -1)
+
+        # 境界条件を考慮しないKマトリクスを作成する
+        matK = self.makeKmatrix()
+
+        # 荷重ケースごとの荷重ベクトルを作成する
+        matF = matLoad + self.makeEqNodeForceVector()[:, None]
+
+        # 全ケースの変位を計算する
+        matDisp = self.solveDisplacement(matK, matF, solver)
+        self.matDisp = matDisp
+
+        # 節点反力を計算する
+        matRF = np.asarray(matK @ matDisp - matF)
+        self.matRF = matRF
+
+        # ケースごとの最大von Mises応力を計算する
+        batch = self.makeElemBatch()
+        elemDofs = self.makeElemDofs()
+        vecMaxStress = np.zeros(matDisp.shape[1])
+        for i in range(matDisp.shape[1]):
+            _, vonMises = batch.calculateStress(matDisp[elemDofs, i])
+            vecMaxStress[i] = vonMises.max()
+
+        return matDisp, matRF, vecMaxStress
+
+    # 境界条件を考慮して変位を計算する
+    # matK     : 境界条件を考慮しないKマトリクス
+    # vecf     : 荷重ベクトル(複数ケースの場合は自由度数 x ケース数の行列)
+    # solver   : 連立方程式のソルバー(Noneの場合はDirectSolver)
+    # vecDisp0 : 反復法(PCGSolver)の初期値にする全節点の変位(vecfと同じ形、Noneの場合は0から解く)
+    #            vecfが1本の場合は、初期値の候補を列に並べた行列(全自由度数 x 候補数)も与えられる
+    def solveDisplacement(self, matK, vecf, solver = None, vecDisp0 = None):
+
+        # 境界条件を考慮したKマトリクス、荷重ベクトルを作成する(拘束されていない自由度のみ)
+        startTime = time.perf_counter()
+        matKc, vecfc = self.setBoundCondition(matK, vecf)
+        self.timings['boundary'] = time.perf_counter() - startTime
+
+        # ソルバーを決める
+        # 並び替え済みの場合、DirectSolverは並びをそのまま使って分解する
+        matrixFree = isinstance(matKc, SLA.LinearOperator)
+        if solver is None and (matrixFree or self.iterative):
+            solver = PCGSolver(nodeDof=self.nodeDof)
+        elif solver is None:
+            solver = DirectSolver(nodeDof=self.nodeDof,
+                                  permcSpec="MMD_AT_PLUS_A" if self.ordering is None else "NATURAL",
+                                  precision=self.precision, refineTol=self.refineTol)
+        elif matrixFree and not isinstance(solver, PCGSolver):
+            raise ValueError("剛性マトリクスを組み立てない解析、ディスク上に組み立てる解析では反復法(PCGSolver)を使ってください。")
+
+        # 節点の並び替えを行う場合は、K_ffと荷重ベクトルを新しい並びに入れ替える
+        # ソルバーには元の自由度番号を渡すため、拘束不足の節点番号は元の番号で報告される
+        # (並び替えは分解のフィルインにしか効かないため、反復法では行わない)
+        order = np.arange(len(self.freeDofs))
+        if not self.ordering is None and not isinstance(solver, PCGSolver):
+            order = self.makeNodeOrdering().makeSubsetOrder(self.freeDofs, self.nodeDof)
+            matKc = sparse.csr_matrix(matKc)[order][:, order]
+            vecfc = vecfc[order]
+
+        # 拘束されていない自由度の変位を計算する(拘束不足の場合は分解時に例外が発生する)
+        startTime = time.perf_counter()
+        try:
+            solver.factorize(matKc, self.freeDofs[order])
+            vecDispFree = np.empty_like(vecfc)
+            if vecDisp0 is None:
+                vecDispFree[order] = solver.solve(vecfc)
+            else:
+                vecDispFree[order] = solver.solve(vecfc, np.asarray(vecDisp0, dtype=float)[self.freeDofs][order])
+        finally:
+            # ディスク上のK_ffは解き終わったら一時ファイルを削除する
+            if isinstance(matKc, OutOfCoreMatrix):
+                matKc.close()
+        self.solver = solver
+        self.timings['solve'] = time.perf_counter() - startTime
+
+        # 強制変位と合わせて全節点の変位ベクトルを作成する
+        vecDisp = np.zeros(np.shape(vecf))
+        vecDisp[self.freeDofs] = vecDispFree
+        if vecDisp.ndim == 1:
+            vecDisp[self.fixedDofs] = self.vecPrescribed
+        else:
+            vecDisp[self.fixedDofs] = self.vecPrescribed[:, None]
+
+        return vecDisp
+
+    # 節点の並び替えを求める(同じメッシュと方法であれば前回の結果を使う)
+    # 並び替え前後のバンド幅、プロファイル、分解後のLの非ゼロ数はself.orderingReportに保存する
+    def makeNodeOrdering(self):
+
+        if self.nodeOrdering is None or self.nodeOrdering.method != self.ordering or \
+           self.nodeOrdering.nodeNum != self.mesh.nodeNum:
+            self.nodeOrdering = NodeOrdering(self.mesh.conn, self.mesh.nodeNum, self.ordering)
+            self.orderingReport = self.nodeOrdering.makeReport(self.nodeDof)
+
+        return self.nodeOrdering
+
     # 節点に負荷する荷重、等価節点力を考慮した荷重ベクトルを作成する
     def makeForceVector(self):
 
@@ -47,65 +223,218 @@ class FEM:
         vecCondiForce = self.bound.makeForceVector()
 
         # 等価節点力の荷重ベクトルを作成する
-        vecEqNodeForce = np.zeros(len(self.nodes) * self.nodeDof)
-        for elem in self.elements:
-            vecElemEqNodeForce = elem.makeEqNodeForceVector()
-            for i in range(len(elem.nodes)):
-                for j in range(self.nodeDof):
-                    vecEqNodeForce[self.nodeDof * (elem.nodes[i].no - 1) + j] += vecElemEqNodeForce[self.nodeDof * i + j]
+        vecEqNodeForce = self.makeEqNodeForceVector()
 
         # 境界条件、等価節点力の荷重ベクトルを足し合わせる
         vecf = vecCondiForce + vecEqNodeForce
 
         return vecf
+
+    # 等価節点力(物体力)の荷重ベクトルを作成する
+    # 要素の一時配列が大きくならないように、chunkSizeごとの範囲に分けて足し込む
+    def makeEqNodeForceVector(self):
+
+        vecEqNodeForce = np.zeros(self.mesh.nodeNum * self.nodeDof)
+        for elemRange in self.makeElemChunks():
+            vecElemEqNodeForce = self.makeElemBatch(elemRange).makeEqNodeForceVector()
+            vecEqNodeForce += np.bincount(self.makeElemDofs(elemRange).ravel(), weights=vecElemEqNodeForce.ravel(),
+                                          minlength=self.mesh.nodeNum * self.nodeDof)
+
+        return vecEqNodeForce
     
+    # 要素の節点自由度に対応する全体自由度の番号を作成する(要素数 x 12)
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemDofs(self, elemRange = slice(None)):
+
+        conn = self.mesh.conn[elemRange].astype(np.int64)
+        elemDofs = (self.nodeDof * conn[:, :, None] + np.arange(self.nodeDof)).reshape(len(conn), -1)
+
+        return elemDofs
+
+    # 全要素をまとめて計算する要素カーネルを作成する
+    # 要素の形状はメッシュの形状キャッシュを使うため、座標が変わらない限り計算し直さない
+    # (ディスク上に組み立てる場合は形状キャッシュを作らず、範囲の要素だけを計算する)
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemBatch(self, elemRange = slice(None)):
+
+        young, poisson, density = self.mesh.makeElemMaterials(elemRange)
+
+        return C3D4Batch(None, young, poisson, density, self.mesh.makeElemGravity(elemRange),
+                         self.mesh.getGeometry(elemRange, cache=not self.outOfCore))
+
+    # 要素マトリクス(要素数 x 12 x 12)を全体マトリクスの三つ組(行, 列, 値)に並べる
+    # elemRange : matElemsに対応する要素の範囲(slice型、省略した場合は全要素)
+    def makeTriplets(self, matElems, elemRange = slice(None)):
+
+        elemDofs = self.makeElemDofs(elemRange)
+        elemDofNum = elemDofs.shape[1]
+        vecRows = np.repeat(elemDofs, elemDofNum, axis=1).ravel()
+        vecCols = np.tile(elemDofs, (1, elemDofNum)).ravel()
+
+        return vecRows, vecCols, matElems.ravel()
+
+    # 要素をchunkSizeごとの範囲に分ける
+    # chunkSize : 範囲の要素数(Noneの場合はself.chunkSize)
+    def makeElemChunks(self, chunkSize = None):
+
+        elemNum = self.mesh.elemNum
+        if chunkSize is None:
+            chunkSize = self.chunkSize
+
+        return [slice(start, min(start + chunkSize, elemNum)) for start in range(0, elemNum, chunkSize)]
+
+    # 全体マトリクスの作成に使うスレッド数を決める
+    # self.workers(NoneはCPUのコア数)を上限に、スレッドごとにself.minThreadElems以上の要素を割り当てられる数にする
+    # (小さいメッシュはスレッドを起動する手間の方が大きいため1スレッドで作成する)
+    def getAssemblyWorkers(self):
+
+        workers = self.workers if not self.workers is None else (os.cpu_count() or 1)
+
+        return max(min(workers, self.mesh.elemNum // self.minThreadElems), 1)
+
+    # 要素マトリクスを足し合わせて全体マトリクス(3x3ブロックのBSR形式)を作成する
+    # 非ゼロ構造と要素成分の格納先はメッシュのシンボリック組み立てを使い、要素マトリクスをdata配列に足し込む
+    # 要素をスレッド数で等分した連続したグループに分けてスレッドごとに受け持ち(グループ内はchunkSizeごとの範囲)、
+    # 要素マトリクスの計算からdata配列への足し込み(np.add.atはGILを解放する)までを並列に行う
+    # 足し込み先はスレッドごとのdata配列で、最後にブロックの範囲を分けて並列に足し合わせる
+    # スレッドごとのdata配列は組み立て後のKの値と同じ大きさ(非ゼロのブロック数 x 72バイト)で、
+    # スレッド数 - 1 個分のメモリが増える(AnalysisPlannerの見積もりに含める)。メモリを抑える場合はself.workersを小さくする
+    # 結果はスレッド数を決めれば毎回同じになり、スレッド数を変えた場合は丸め誤差の範囲で異なる
+    # makeElemMatrices : 要素カーネル(C3D4Batch型)から要素マトリクス(要素数 x 12 x 12)を計算する関数
+    def assembleMatrix(self, makeElemMatrices):
+
+        # 形状キャッシュとシンボリック組み立てはスレッドで計算を始める前に作成しておく
+        self.mesh.getGeometry()
+        symbolic = self.mesh.getSymbolicAssembly(self.nodeDof)
+
+        workers = self.getAssemblyWorkers()
+        chunks = self.makeElemChunks(max(min(self.chunkSize, -(-self.mesh.elemNum // workers)), 1))
+        workers = max(min(workers, len(chunks)), 1)
+        vecDatas = [symbolic.makeData() for i in range(workers)]
+
+        # スレッドiは要素の範囲のi番目のグループをvecDatas[i]に足し込む
+        def addChunks(i):
+            for elemRange in chunks[i * len(chunks) // workers:(i + 1) * len(chunks) // workers]:
+                matElems = makeElemMatrices(self.makeElemBatch(elemRange))
+                symbolic.addElemMatrices(vecDatas[i], matElems, elemRange)
+
+        # ブロックの範囲ごとに、スレッドごとのdata配列をvecDatas[0]に足し合わせる
+        def reduceBlocks(blockRange):
+            for vecPartial in vecDatas[1:]:
+                vecDatas[0][blockRange] += vecPartial[blockRange]
+
+        if workers > 1:
+            blockNum = symbolic.blockNum
+            blockRanges = [slice(i * blockNum // workers, (i + 1) * blockNum // workers) for i in range(workers)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(addChunks, range(workers)))
+                list(executor.map(reduceBlocks, blockRanges))
+        else:
+            addChunks(0)
+
+        return symbolic.makeMatrix(vecDatas[0])
+
     # 境界条件を考慮しないKマトリクスを作成する
     def makeKmatrix(self):
 
-        matK = np.matrix(np.zeros((len(self.nodes) * self.nodeDof, len(self.nodes) * self.nodeDof)))
-        for elem in self.elements:
-            
-            # ketマトリクスを計算する
-            matKe = elem.makeKematrix()
+        return self.assembleMatrix(lambda batch: batch.makeKematrix())
 
-            # Ktマトリクスに代入する
-            for c in range(len(elem.nodes) * self.nodeDof):
-                ct = (elem.nodes[c // self.nodeDof].no - 1) * self.nodeDof + c % self.nodeDof
-                for r in range(len(elem.nodes) * self.nodeDof):
-                    rt = (elem.nodes[r // self.nodeDof].no - 1) * self.nodeDof + r % self.nodeDof
-                    matK[ct, rt] += matKe[c, r]
+    # Kマトリクスを組み立てずに K u を計算する作用素を作成する(省メモリ)
+    # 形状キャッシュだけを使い、反復法の反復ごとに要素の計算をやり直す(ElementOperatorを参照)
+    def makeKoperator(self):
 
-        return matK
+        return ElementOperator(self.mesh, self.nodeDof, chunkSize=self.chunkSize)
 
-    # Kマトリクス、荷重ベクトルに境界条件を考慮する
-    # matK         : 剛性マトリクス
-    # vecf         : 荷重ベクトル
-    # vecBoundDisp : 節点の境界条件の変位ベクトル
-    # vecDisp      : 全節点の変位ベクトル(np.array型)
-    def setBoundCondition(self, matKt, vecf):
+    # K_ffをディスク上に組み立てる作用素を作成する(メモリに収まらないメッシュ向け)
+    # メッシュの形状キャッシュは作らず(メッシュは変更しない)、要素の範囲の大きさはself.memoryBudgetから決める
+    # 応力などの要素の範囲ごとの計算も同じ大きさの範囲で行う(OutOfCoreAssemblyを参照)
+    def makeOutOfCoreAssembly(self):
 
-        matKtc = np.copy(matKt)
-        vecfc = np.copy(vecf)
-        vecBoundDisp = self.bound.makeDispVector()
+        assembly = OutOfCoreAssembly(self.mesh, self.nodeDof, self.memoryBudget, self.workDir)
+        self.chunkSize = min(self.chunkSize, assembly.chunkSize)
 
-        # 単点拘束条件を考慮したKマトリクス、荷重ベクトルを作成する
-        for i in range(len(vecBoundDisp)):
-            if not vecBoundDisp[i] == None:
-                # Kマトリクスからi列を抽出する
-                vecx = np.array(matKt[:, i]).flatten()
+        return assembly
 
-                # 変位ベクトルi列の影響を荷重ベクトルに適用する
-                vecfc = vecfc - (vecBoundDisp[i]) * vecx
+    # 自由度を拘束されていない自由度(free)と強制変位を与える自由度(prescribed)に分ける
+    # freeDofs      : 拘束されていない自由度の番号(np.array型)
+    # fixedDofs     : 強制変位を与える自由度の番号(np.array型)
+    # vecPrescribed : fixedDofsの強制変位(np.array型)
+    def makeDofPartition(self):
 
-                # Kマトリクスのi行、i列を全て0にし、i行i列の値を1にする
-                matKtc[:, i] = 0.0
-                matKtc[i, :] = 0.0
-                matKtc[i, i] = 1.0
-        for i in range(len(vecBoundDisp)):
-            if not vecBoundDisp[i] == None:
-                vecfc[i] = vecBoundDisp[i]
+        vecBoundDisp = self.bound.makeDispVector()
+        vecFixed = np.array([not disp is None for disp in vecBoundDisp], dtype=bool)
+        freeDofs = np.flatnonzero(~vecFixed)
+        fixedDofs = np.flatnonzero(vecFixed)
+        vecPrescribed = vecBoundDisp[fixedDofs].astype(float)
 
-        return matKtc, vecfc
+        return freeDofs, fixedDofs, vecPrescribed
+
+    # Kマトリクス、荷重ベクトルに境界条件を考慮する
+    # 拘束されていない自由度の行、列だけを取り出したK_ffを作成し、
+    # 強制変位の影響 K_fp u_p を荷重ベクトルから差し引く
+    # matK         : 剛性マトリクス(疎行列、組み立てない作用素(ElementOperator型)、
+    #                またはK_ffをディスク上に組み立てる作用素(OutOfCoreAssembly型))
+    # vecf         : 荷重ベクトル(複数ケースの場合は自由度数 x ケース数の行列)
+    # 戻り値       : K_ff(疎行列、作用素の場合は自由度を絞り込んだ作用素、
+    #                ディスク上に組み立てる場合はOutOfCoreMatrix型)、拘束されていない自由度の荷重ベクトル
+    def setBoundCondition(self, matKt, vecf):
+
+        freeDofs, fixedDofs, vecPrescribed = self.makeDofPartition()
+        self.freeDofs = freeDofs
+        self.fixedDofs = fixedDofs
+        self.vecPrescribed = vecPrescribed
+
+        if isinstance(matKt, OutOfCoreAssembly):
+            # K_ffだけをディスク上に組み立てる
+            matKff = matKt.assemble(freeDofs)
+        elif isinstance(matKt, ElementOperator):
+            # 作用素の場合は自由度を絞り込む
+            matKff = matKt.restrict(freeDofs)
+        else:
+            # K_ffを取り出す
+            matKff = self.extractSubmatrix(matKt, freeDofs)
+
+        # K_fp u_p は強制変位だけを与えた変位との積から求める
+        vecUp = np.zeros(matKt.shape[0])
+        vecUp[fixedDofs] = vecPrescribed
+        vecKfpUp = (matKt @ vecUp)[freeDofs]
+
+        # 強制変位の影響を荷重ベクトルに適用する(複数ケースの場合は各列に適用する)
+        vecfc = np.asarray(vecf, dtype=float)[freeDofs]
+        if vecfc.ndim == 1:
+            vecfc = vecfc - vecKfpUp
+        else:
+            vecfc = vecfc - vecKfpUp[:, None]
+
+        return matKff, vecfc
+
+    # 全体マトリクスから自由度dofsの行と列を取り出す
+    # BSR形式で、dofsが節点の全自由度からなる(一部の自由度だけ拘束された節点がない)場合は
+    # ブロックのまま取り出す。それ以外はCSR形式に変換して取り出す
+    # matA : 全体マトリクス(疎行列)
+    # dofs : 取り出す自由度の番号(昇順)
+    def extractSubmatrix(self, matA, dofs):
+
+        nodeDof = self.nodeDof
+        nodeNos = dofs[::nodeDof] // nodeDof
+        if not (sparse.issparse(matA) and matA.format == "bsr" and matA.blocksize == (nodeDof, nodeDof) and
+                len(dofs) == nodeDof * len(nodeNos) and
+                np.array_equal(dofs, (nodeDof * nodeNos[:, None] + np.arange(nodeDof)).ravel())):
+            return sparse.csr_matrix(matA)[dofs][:, dofs]
+
+        # 取り出す節点同士のブロックだけを残し、節点番号を詰め直す
+        vecNodeMap = np.full(matA.shape[0] // nodeDof, -1, dtype=np.int64)
+        vecNodeMap[nodeNos] = np.arange(len(nodeNos))
+        vecBlockRows = np.repeat(vecNodeMap, np.diff(matA.indptr))
+        vecBlockCols = vecNodeMap[matA.indices]
+        keep = (vecBlockRows >= 0) & (vecBlockCols >= 0)
+        indptr = np.concatenate([[0], np.cumsum(np.bincount(vecBlockRows[keep], minlength=len(nodeNos)))])
+        matSub = sparse.bsr_matrix((matA.data[keep], vecBlockCols[keep].astype(matA.indices.dtype),
+                                    indptr.astype(matA.indptr.dtype)),
+                                   shape=(len(dofs), len(dofs)), blocksize=(nodeDof, nodeDof))
+        matSub.has_sorted_indices = True
+
+        return matSub
 
     # 解析結果をテキストファイルに出力する
     def outputTxt(self, filePath):
@@ -127,11 +456,11 @@ class FEM:
         f.write("***** Node Data ******\n")
         f.write("No".rjust(columNum) + "X".rjust(columNum) + "Y".rjust(columNum) + "Z".rjust(columNum) + "\n")
         f.write("-" * columNum * 4 + "\n")
-        for node in self.nodes:
-            strNo = str(node.no).rjust(columNum)
-            strX = str(format(node.x, floatDigits).rjust(columNum))
-            strY = str(format(node.y, floatDigits).rjust(columNum))
-            strZ = str(format(node.z, floatDigits).rjust(columNum))
+        for i, coord in enumerate(self.mesh.coords):
+            strNo = str(i + 1).rjust(columNum)
+            strX = str(format(coord[0], floatDigits).rjust(columNum))
+            strY = str(format(coord[1], floatDigits).rjust(columNum))
+            strZ = str(format(coord[2], floatDigits).rjust(columNum))
             f.write(strNo + strX + strY + strZ + "\n")
         f.write("\n")
 
@@ -141,20 +470,17 @@ class FEM:
         f.write("No".rjust(columNum) + "Type".rjust(columNum) + "Node No".rjust(nodeNoColumNum) + 
                 "Young".rjust(columNum) + "Poisson".rjust(columNum) + "Density".rjust(columNum) + "\n")
         f.write("-" * columNum * 5 + "-" * nodeNoColumNum + "\n")
-        for elem in self.elements:
-            strNo = str(elem.no).rjust(columNum)
-            strType = str(elem.__class__.__name__ ).rjust(columNum)
+        young, poisson, density = self.mesh.makeElemMaterials()
+        for i, elemConn in enumerate(self.mesh.conn):
+            strNo = str(i + 1).rjust(columNum)
+            strType = "C3D4".rjust(columNum)
             strNodeNo = ""
-            for node in elem.nodes:
-                strNodeNo += " " + str(node.no)
+            for nodeIdx in elemConn:
+                strNodeNo += " " + str(nodeIdx + 1)
             strNodeNo = strNodeNo.rjust(nodeNoColumNum)
-            strYoung = str(format(elem.young, floatDigits).rjust(columNum))
-            strPoisson = "None".rjust(columNum)
-            if hasattr(elem, 'poisson'):
-                strPoisson = str(format(elem.poisson, floatDigits).rjust(columNum))
-            strDensity = "None".rjust(columNum)
-            if not elem.density is None:
-                strDensity = str(format(elem.density, floatDigits).rjust(columNum))
+            strYoung = str(format(young[i], floatDigits).rjust(columNum))
+            strPoisson = str(format(poisson[i], floatDigits).rjust(columNum))
+            strDensity = str(format(density[i], floatDigits).rjust(columNum))
             f.write(strNo + strType + strNodeNo + strYoung + strPoisson + strDensity + "\n")
         f.write("\n")
 
@@ -163,7 +489,7 @@ class FEM:
         f.write("NodeNo".rjust(columNum) + "X Displacement".rjust(columNum) + "Y Displacement".rjust(columNum) + "Z Displacement".rjust(columNum) +"\n")
         f.write("-" * columNum * 4 + "\n")
         vecd = self.bound.makeDispVector()
-        for i in range(len(self.nodes)):
+        for i in range(self.mesh.nodeNum):
             flg = False
             for j in range(self.nodeDof):
                 if not vecd[self.nodeDof * i + j] == None:
@@ -181,7 +507,7 @@ class FEM:
         f.write("NodeNo".rjust(columNum) + "X Force".rjust(columNum) + "Y Force".rjust(columNum) + "Z Force".rjust(columNum) +"\n")
         f.write("-" * columNum * 4 + "\n")
         vecf = self.makeForceVector()
-        for i in range(len(self.nodes)):
+        for i in range(self.mesh.nodeNum):
             flg = False
             for j in range(self.nodeDof):
                 if not vecf[self.nodeDof * i + j] == None:
@@ -205,7 +531,7 @@ class FEM:
         f.write("NodeNo".rjust(columNum) + "Magnitude".rjust(columNum) + "X Displacement".rjust(columNum) +
                 "Y Displacement".rjust(columNum) + "Z Displacement".rjust(columNum) + "\n")
         f.write("-" * columNum * 5 + "\n")
-        for i in range(len(self.nodes)):
+        for i in range(self.mesh.nodeNum):
             strNo = str(i + 1).rjust(columNum)
             mag = np.linalg.norm(np.array((self.vecDisp[self.nodeDof * i], self.vecDisp[self.nodeDof * i + 1], self.vecDisp[self.nodeDof * i + 2])))
             strMag = str(format(mag, floatDigits).rjust(columNum))
@@ -219,7 +545,7 @@ class FEM:
         f.write("***** Reaction Force Data ******\n")
         f.write("NodeNo".rjust(columNum) + "Magnitude".rjust(columNum) + "X Force".rjust(columNum) + "Y Force".rjust(columNum) + "Z Force".rjust(columNum) + "\n")
         f.write("-" * columNum * 5 + "\n")
-        for i in range(len(self.nodes)):
+        for i in range(self.mesh.nodeNum):
             strNo = str(i + 1).rjust(columNum)
             mag = np.linalg.norm(np.array((self.vecRF[self.nodeDof * i], self.vecRF[self.nodeDof * i + 1], self.vecRF[self.nodeDof * i + 2])))
             strMag = str(format(mag, floatDigits).rjust(columNum))
@@ -235,69 +561,95 @@ class FEM:
     # 解析結果の変位を出力する
     def outputDisplacement(self):
         displacement = []
-        for i in range(len(self.nodes)):
+        for i in range(self.mesh.nodeNum):
             displacement.append([self.vecDisp[self.nodeDof * i], self.vecDisp[self.nodeDof * i + 1], self.vecDisp[self.nodeDof * i + 2]])
             
         return displacement
     
+    def calculateStress(self):
+        """全要素の応力とvon Mises応力をまとめて計算
+        
+        Returns:
+            stresses: 全要素の応力 (要素数 x 6) [σxx, σyy, σzz, τxy, τyz, τzx] [Pa]
+            von_mises: 全要素のvon Mises応力 (要素数) [Pa]
+        """
+        if not hasattr(self, 'vecDisp'):
+            raise ValueError("解析が実行されていません。先にanalysis()を実行してください。")
+        
+        # 歪 ε = B u、応力 σ = D ε、von Mises応力をchunkSizeごとの要素の範囲でまとめて計算
+        # (Bマトリクスなどの一時配列は範囲の大きさまでに抑える)
+        startTime = time.perf_counter()
+        vecDisp = np.asarray(self.vecDisp).flatten()
+        stresses = np.empty((self.mesh.elemNum, 6))
+        von_mises = np.empty(self.mesh.elemNum)
+        for elemRange in self.makeElemChunks():
+            # 要素の節点変位ベクトルを範囲の要素まとめて取得 (要素数 x 12)
+            element_displacement = vecDisp[self.makeElemDofs(elemRange)]
+            stresses[elemRange], von_mises[elemRange] = self.makeElemBatch(elemRange).calculateStress(element_displacement)
+        self.timings['stress'] = time.perf_counter() - startTime
+        self.stresses = stresses
+        self.vonMises = von_mises
+        
+        return stresses, von_mises
+    
     def calculateMaxStress(self):
         """全要素の最大von Mises応力を計算
         
         Returns:
             max_stress: 最大von Mises応力 [Pa]
             max_element_id: 最大応力が発生した要素ID
-            all_stresses: 全要素のvon Mises応力リスト
-        """
-        if not hasattr(self, 'vecDisp'):
-            raise ValueError("解析が実行されていません。先にanalysis()を実行してください。")
+            all_stresses: 全要素のvon Mises応力 (np.array型)
         
-        max_stress = 0.0
-        max_element_id = 0
-        all_stresses = []
+        全要素の応力テンソル (要素数 x 6) は self.stresses に保存される
+        """
+        _, von_mises_stress = self.calculateStress()
+        all_stresses = von_mises_stress
         
-        for element in self.elements:
-            # 要素の節点変位ベクトルを取得
-            element_displacement = np.zeros(12)  # 4節点 × 3自由度
-            
-            for i, node in enumerate(element.nodes):
-                node_id = node.no - 1  # ノード番号は1から始まるため
-                for j in range(3):  # x, y, z方向
-                    element_displacement[i*3 + j] = self.vecDisp[node_id*3 + j]
-            
-            # 要素の応力を計算
-            stress_vector, von_mises_stress = element.calculateStress(element_displacement)
-            all_stresses.append(von_mises_stress)
-            
-            # 最大応力を更新
-            if von_mises_stress > max_stress:
-                max_stress = von_mises_stress
-                max_element_id = element.no
+        # 最大応力を取得
+        max_index = int(np.argmax(von_mises_stress))
+        max_stress = float(von_mises_stress[max_index])
+        max_element_id = max_index + 1
         
         return max_stress, max_element_id, all_stresses
     
-    def makeMmatrix(self):
-        """全体質量マトリクスMを作成する"""
+    def makeMmatrix(self, lumped=False):
+        """全体質量マトリクスMを作成する（疎行列、CSR形式）
         
-        matM = np.matrix(np.zeros((len(self.nodes) * self.nodeDof, len(self.nodes) * self.nodeDof)))
+        Args:
+            lumped: Trueの場合は集中質量マトリクス（対角行列）、Falseの場合は整合質量マトリクス
+        """
         
-        for elem in self.elements:
-            # 要素質量マトリクスを計算する
-            matMe = elem.makeMematrix()
-            
-            # 全体質量マトリクスに代入する
-            for c in range(len(elem.nodes) * self.nodeDof):
-                ct = (elem.nodes[c // self.nodeDof].no - 1) * self.nodeDof + c % self.nodeDof
-                for r in range(len(elem.nodes) * self.nodeDof):
-                    rt = (elem.nodes[r // self.nodeDof].no - 1) * self.nodeDof + r % self.nodeDof
-                    matM[ct, rt] += matMe[c, r]
+        if lumped:
+            return sparse.diags(self.makeLumpedMassVector()).tocsr()
         
-        return matM
+        # 全要素の要素質量マトリクスを要素の範囲ごとに並列に計算して足し合わせる
+        return self.assembleMatrix(lambda batch: batch.makeMematrix())
     
-    def vibrationAnalysis(self, num_modes=10):
+    def makeLumpedMassVector(self):
+        """集中質量マトリクスの対角成分を作成する（要素質量マトリクスの行和）
+        
+        陽解法の時間積分では、このベクトルで割るだけで加速度が求まり、質量マトリクスの分解が不要
+        
+        Returns:
+            vecMass: 各自由度の質量 (自由度数)
+        """
+        
+        matMe = self.makeElemBatch().makeMematrix()
+        vecMass = np.bincount(self.makeElemDofs().ravel(), weights=matMe.sum(axis=2).ravel(),
+                              minlength=self.mesh.nodeNum * self.nodeDof)
+        
+        return vecMass
+    
+    def vibrationAnalysis(self, num_modes=10, lumped=False, shift=None):
         """振動解析（固有値問題）を実行
         
+        疎行列のK、Mに対してshift-invert Lanczos法（ARPACK）で、シフト点に近い
+        num_modes個のモードだけを計算する。自由度が少なくLanczos法が使えない場合は密行列で解く。
+        
         Args:
             num_modes: 解析するモード数
+            lumped: Trueの場合は集中質量マトリクスを使用する
+            shift: 目標とする振動数 [Hz]（Noneの場合は0 Hz、すなわち低次のモードから求める）
             
         Returns:
             eigenvalues: 固有値（角振動数の2乗）
@@ -307,43 +659,46 @@ class FEM:
         
         # 全体剛性マトリクスと質量マトリクスを作成
         matK = self.makeKmatrix()
-        matM = self.makeMmatrix()
+        matM = self.makeMmatrix(lumped)
         
         # 境界条件を適用（自由度を削減）
         # 固定端の自由度を除去
-        vecBoundDisp = self.bound.makeDispVector()
-        free_dofs = []
-        
-        for i in range(len(vecBoundDisp)):
-            if vecBoundDisp[i] is None:  # 自由な自由度
-                free_dofs.append(i)
+        free_dofs, _, _ = self.makeDofPartition()
         
         if len(free_dofs) == 0:
             raise ValueError("全ての自由度が拘束されています。振動解析できません。")
         
         # 自由な自由度のみ抽出
-        K_free = np.array(matK)[np.ix_(free_dofs, free_dofs)]
-        M_free = np.array(matM)[np.ix_(free_dofs, free_dofs)]
+        K_free = self.extractSubmatrix(matK, free_dofs)
+        M_free = self.extractSubmatrix(matM, free_dofs)
         
-        # 一般化固有値問題を解く: K φ = λ M φ
-        # scipy.linalg.eighを使用（対称行列用）
-        from scipy.linalg import eigh
+        # シフト点 σ = (2πf)^2
+        sigma = 0.0 if shift is None else (2 * np.pi * shift) ** 2
         
         try:
-            # 固有値・固有ベクトルを計算（最小のnum_modes個）
-            eigenvalues, eigenvectors = eigh(K_free, M_free, subset_by_index=[0, num_modes-1])
+            if num_modes < len(free_dofs) - 1:
+                # 一般化固有値問題 K φ = λ M φ をshift-invert Lanczos法で解く
+                # (K - σM)を一度だけ分解し、σに近い固有値をnum_modes個求める
+                from scipy.sparse.linalg import eigsh
+                eigenvalues, eigenvectors = eigsh(K_free.tocsc(), k=num_modes, M=M_free.tocsc(),
+                                                  sigma=sigma, which='LM')
+                order = np.argsort(eigenvalues)
+                eigenvalues = eigenvalues[order]
+                eigenvectors = eigenvectors[:, order]
+            else:
+                # 自由度が少ない場合は密行列の一般化固有値問題として解く
+                from scipy.linalg import eigh
+                eigenvalues, eigenvectors = eigh(K_free.toarray(), M_free.toarray(),
+                                                 subset_by_index=[0, min(num_modes, len(free_dofs)) - 1])
             
             # 固有振動数を計算 [Hz]
             frequencies = np.sqrt(np.maximum(eigenvalues, 0)) / (2 * np.pi)
             
             # 固有ベクトルを全自由度に拡張
-            full_eigenvectors = np.zeros((len(self.nodes) * self.nodeDof, len(eigenvalues)))
-            for i, dof in enumerate(free_dofs):
-                full_eigenvectors[dof, :] = eigenvectors[i, :]
+            full_eigenvectors = np.zeros((self.mesh.nodeNum * self.nodeDof, len(eigenvalues)))
+            full_eigenvectors[free_dofs, :] = eigenvectors
             
             return eigenvalues, full_eigenvectors, frequencies
             
         except Exception as e:
             raise ValueError(f"固有値解析に失敗しました: {str(e)}")
-        
-
@@ -0,0 +1,178 @@
+import numpy as np
+from Node import Node
+from C3D4 import C3D4
+from C3D4Batch import C3D4Batch
+from SymbolicAssembly import SymbolicAssembly
+
+# 四面体4節点要素の解析用メッシュを配列で保持するクラス
+# 節点や要素ごとのPythonオブジェクトを作らずにFEMへ渡すために使う
+class Mesh:
+    # コンストラクタ
+    # coords       : 節点座標(節点数 x 3のnp.array型)
+    # conn         : 要素を構成する節点のインデックス(0始まり、要素数 x 4のnp.array型)
+    # young        : ヤング率(スカラーまたは材料数の長さの配列)
+    # poisson      : ポアソン比(スカラーまたは材料数の長さの配列)
+    # density      : 密度(スカラーまたは材料数の長さの配列)
+    # materialIds  : 要素ごとの材料番号(Noneの場合は全要素が材料0)
+    # vecGravity   : 重力加速度のベクトル(np.array型、Noneの場合は物体力なし)
+    def __init__(self, coords, conn, young, poisson, density, materialIds = None, vecGravity = None):
+
+        # インスタンス変数を定義する
+        self.coords = coords                                                          # 節点座標
+        self.conn = np.ascontiguousarray(conn, dtype=np.int32).reshape(-1, 4)         # 要素の節点インデックス
+        self.young = np.atleast_1d(np.asarray(young, dtype=np.float64))               # 材料ごとのヤング率
+        self.poisson = np.atleast_1d(np.asarray(poisson, dtype=np.float64))           # 材料ごとのポアソン比
+        self.density = np.atleast_1d(np.asarray(density, dtype=np.float64))           # 材料ごとの密度
+        if materialIds is None:
+            materialIds = np.zeros(len(self.conn))
+        self.materialIds = np.ascontiguousarray(materialIds, dtype=np.int32)          # 要素ごとの材料番号
+        self.vecGravity = None if vecGravity is None else np.asarray(vecGravity, dtype=np.float64)
+        self.symbolicAssembly = None   # 全体マトリクスのシンボリック組み立て(接続関係が同じメッシュで共有する)
+
+    # 節点座標(節点数 x 3、読み取り専用)
+    # 要素の形状キャッシュを正しく保つため、座標を変更する場合は配列ごと代入する
+    # 書き込みできる配列は複製して保持し、読み取り専用の配列(共有メモリなど)は複製せずに参照する
+    @property
+    def coords(self):
+        return self._coords
+
+    @coords.setter
+    def coords(self, coords):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 3)
+        if coords.flags.writeable:
+            coords = coords.copy()
+            coords.flags.writeable = False
+        self._coords = coords
+        self.geometry = None   # 要素の形状キャッシュ(座標が変わると作り直す)
+
+    # 要素の形状(ヤコビアン、形状関数の微分dN/dx)を返す
+    # 節点座標ごとに一度だけ計算し、剛性、質量、物体力、応力の計算で共有する
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    # cache     : 形状キャッシュがない場合に全要素の形状を計算して保持するかどうか
+    #             (Falseの場合は保持せず、elemRangeの要素だけをその都度計算する、省メモリ)
+    def getGeometry(self, elemRange = slice(None), cache = True):
+
+        if self.geometry is None and not cache:
+            return C3D4Batch.makeGeometry(self.makeElemCoords(elemRange))
+        if self.geometry is None:
+            self.geometry = C3D4Batch.makeGeometry(self.makeElemCoords())
+        detJ, dNdxy = self.geometry
+
+        return detJ[elemRange], dNdxy[elemRange]
+
+    # 全体マトリクスのシンボリック組み立てを返す(要素の接続関係ごとに一度だけ作成する)
+    # nodeDof : 節点の自由度
+    def getSymbolicAssembly(self, nodeDof = 3):
+
+        if self.symbolicAssembly is None or self.symbolicAssembly.nodeDof != nodeDof:
+            self.symbolicAssembly = SymbolicAssembly(self.conn, self.nodeNum, nodeDof)
+
+        return self.symbolicAssembly
+
+    # 節点座標だけを変えたメッシュを作成する
+    # 要素の接続関係、材料、シンボリック組み立ては元のメッシュと共有する
+    # (シンボリック組み立てがまだない場合は元のメッシュで作成してから共有する)
+    # coords : 新しい節点座標(節点数 x 3のnp.array型)
+    def withCoords(self, coords):
+
+        mesh = Mesh(coords, self.conn, self.young, self.poisson, self.density, self.materialIds, self.vecGravity)
+        if mesh.nodeNum != self.nodeNum:
+            raise ValueError("節点数が元のメッシュと一致しません。")
+        mesh.symbolicAssembly = self.getSymbolicAssembly()
+
+        return mesh
+
+    # 材料だけを変えたメッシュを作成する
+    # 節点座標、要素の接続関係、形状キャッシュ、シンボリック組み立ては元のメッシュと共有する
+    # young, poisson, density : 材料ごとの物性値(コンストラクタと同じ)
+    def withMaterials(self, young, poisson, density):
+
+        mesh = Mesh(self.coords, self.conn, young, poisson, density, self.materialIds, self.vecGravity)
+        mesh.geometry = self.getGeometry()
+        mesh.symbolicAssembly = self.getSymbolicAssembly()
+
+        return mesh
+
+    # 要素の体積(要素数)を返す
+    def getVolumes(self):
+
+        return self.getGeometry()[0] / 6.0
+
+    # 節点数
+    @property
+    def nodeNum(self):
+        return len(self.coords)
+
+    # 要素数
+    @property
+    def elemNum(self):
+        return len(self.conn)
+
+    # 要素ごとのヤング率、ポアソン比、密度を返す
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemMaterials(self, elemRange = slice(None)):
+
+        materialIds = self.materialIds[elemRange]
+
+        return (self.young[materialIds], self.poisson[materialIds], self.density[materialIds])
+
+    # 要素ごとの節点座標(要素数 x 4 x 3)を返す
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemCoords(self, elemRange = slice(None)):
+
+        return self.coords[self.conn[elemRange]]
+
+    # 要素ごとの重力加速度を返す(全要素で同じ場合は1つのベクトル)
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemGravity(self, elemRange = slice(None)):
+
+        if self.vecGravity is None or self.vecGravity.ndim == 1:
+            return self.vecGravity
+
+        return self.vecGravity[elemRange]
+
+    # Node型のリストを作成する(互換用)
+    def makeNodes(self):
+
+        return [Node(i + 1, coord[0], coord[1], coord[2]) for i, coord in enumerate(self.coords)]
+
+    # C3D4型のリストを作成する(互換用)
+    # nodes : 要素が参照するNode型のリスト(Noneの場合は新しく作成する)
+    def makeElements(self, nodes = None):
+
+        if nodes is None:
+            nodes = self.makeNodes()
+        young, poisson, density = self.makeElemMaterials()
+        elements = []
+        for i, elemConn in enumerate(self.conn):
+            vecGravity = self.vecGravity
+            if not vecGravity is None and vecGravity.ndim == 2:
+                vecGravity = vecGravity[i]
+            elements.append(C3D4(i + 1, [nodes[j] for j in elemConn], young[i], poisson[i], density[i], vecGravity))
+
+        return elements
+
+    # Node型、C3D4型のリストからメッシュを作成する
+    # nodes    : 節点は1から始まる順番で並んでいる前提(Node型のリスト)
+    # elements : C3D4型のリスト
+    @classmethod
+    def fromObjects(cls, nodes, elements):
+
+        coords = np.array([[node.x, node.y, node.z] for node in nodes], dtype=np.float64)
+        conn = np.array([[node.no - 1 for node in elem.nodes] for elem in elements], dtype=np.int32)
+
+        # 物性値の組み合わせごとに材料番号を割り当てる
+        props = np.array([[elem.young, elem.poisson, 0.0 if elem.density is None else elem.density]
+                          for elem in elements], dtype=np.float64).reshape(-1, 3)
+        materials, materialIds = np.unique(props, axis=0, return_inverse=True)
+
+        # 重力加速度が全要素で同じ場合は1つのベクトル、異なる場合は要素数 x 3の配列にする
+        gravities = [elem.vecGravity for elem in elements]
+        vecGravity = None
+        if any(not g is None for g in gravities):
+            vecGravity = np.array([np.zeros(3) if g is None else g for g in gravities], dtype=np.float64)
+            if np.all(vecGravity == vecGravity[0]):
+                vecGravity = vecGravity[0]
+
+        return cls(coords, conn, materials[:, 0], materials[:, 1], materials[:, 2],
+                   materialIds.ravel(), vecGravity)
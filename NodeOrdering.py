@@ -0,0 +1,158 @@
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as SLA
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+
+# 節点の並び替え(フィルインを減らすための番号付け)を求めるクラス
+# 要素の接続関係から節点グラフを作り、RCMまたは最小次数順序で節点を並び替える
+# 剛性マトリクスは節点ごとに3x3のブロックを持つため、節点の並びから自由度の並びを作る
+class NodeOrdering:
+    # コンストラクタ
+    # conn    : 要素を構成する節点のインデックス(0始まり、要素数 x 4のnp.array型)
+    # nodeNum : 節点数
+    # method  : 並び替えの方法
+    #           "rcm"     : reverse Cuthill-McKee(バンド幅、プロファイルを小さくする)
+    #           "amd"     : 最小次数順序(フィルインを小さくする)
+    #                       SciPyにはAMDがないため、SuperLUの多重最小次数順序(MMD)で代用する
+    #           "natural" : 並び替えない(元の節点番号のまま)
+    def __init__(self, conn, nodeNum, method = "rcm"):
+
+        # インスタンス変数を定義する
+        self.method = method                                  # 並び替えの方法
+        self.nodeNum = nodeNum                                # 節点数
+        self.matGraph = self.makeNodeGraph(conn, nodeNum)     # 節点グラフ(対角成分を含む隣接行列)
+        self.reports = {}                                     # 節点の自由度ごとの並び替え前後の比較(makeReportの結果)
+
+        # perm[新しい番号] = 元の番号、iperm[元の番号] = 新しい番号(いずれも0始まり)
+        self.perm = self.makePermutation()
+        self.iperm = np.argsort(self.perm)
+
+    # 要素の接続関係から節点グラフ(節点数 x 節点数のCSR形式)を作成する
+    def makeNodeGraph(self, conn, nodeNum):
+
+        conn = np.asarray(conn, dtype=np.int64)
+        elemNodeNum = conn.shape[1]
+        vecRows = np.repeat(conn, elemNodeNum, axis=1).ravel()
+        vecCols = np.tile(conn, (1, elemNodeNum)).ravel()
+        matGraph = sparse.coo_matrix((np.ones(len(vecRows)), (vecRows, vecCols)),
+                                     shape=(nodeNum, nodeNum)).tocsr()
+        matGraph.data[:] = 1.0
+
+        return matGraph
+
+    # 節点グラフと同じ非ゼロ構造を持つ対角優位な行列(CSC形式)を作成する(分解で順序やフィルインを求めるのに使う)
+    # iperm : iperm[元の番号] = 新しい番号(Noneの場合は元の並び)
+    def makeGraphMatrix(self, iperm = None):
+
+        vecDeg = np.diff(self.matGraph.indptr)
+        matA = sparse.csr_matrix(sparse.diags(2.0 * vecDeg) - self.matGraph)
+        if not iperm is None:
+            perm = np.argsort(iperm)
+            matA = matA[perm][:, perm]
+
+        return sparse.csc_matrix(matA)
+
+    # 節点の並び(perm)を求める
+    def makePermutation(self):
+
+        if self.method == "rcm":
+            perm = reverse_cuthill_mckee(self.matGraph, symmetric_mode=True)
+        elif self.method == "amd":
+            # 節点グラフと同じ非ゼロ構造を持つ対角優位な行列を分解し、SuperLUが選んだ順序を使う
+            factor = SLA.splu(self.makeGraphMatrix(), permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0.0,
+                              options=dict(SymmetricMode=True))
+            perm = np.argsort(factor.perm_c)
+        elif self.method == "natural":
+            perm = np.arange(self.nodeNum)
+        else:
+            raise ValueError("未対応の並び替えの方法です: " + str(self.method))
+
+        return np.asarray(perm, dtype=np.int64)
+
+    # 自由度の並び(dofPerm[新しい自由度番号] = 元の自由度番号)を作成する
+    # nodeDof : 節点の自由度
+    def makeDofPermutation(self, nodeDof):
+
+        return (nodeDof * self.perm[:, None] + np.arange(nodeDof)).ravel()
+
+    # 一部の自由度だけを取り出した係数行列の並びを作成する
+    # dofs    : 係数行列の各行に対応する元の自由度番号(np.array型)
+    # nodeDof : 節点の自由度
+    # 戻り値  : 新しい並びで何番目にdofsの何番目の自由度が来るかを表すインデックス
+    def makeSubsetOrder(self, dofs, nodeDof):
+
+        dofs = np.asarray(dofs, dtype=np.int64)
+        vecNewDofs = nodeDof * self.iperm[dofs // nodeDof] + dofs % nodeDof
+
+        return np.argsort(vecNewDofs, kind="stable")
+
+    # 新しい節点のインデックスから元の節点番号(1始まり)を求める
+    def getOriginalNodeNos(self, newNodeIdx):
+
+        return self.perm[np.asarray(newNodeIdx, dtype=np.int64)] + 1
+
+    # 節点の並びからバンド幅、プロファイル、分解後のLの非ゼロ数を求める
+    # 値は自由度単位(節点ごとに3x3のブロックとして数える)
+    # Lの非ゼロ数は、その並びのまま(並び替えなしで)節点グラフを分解して数える
+    # 節点の3x3ブロックは分解後も密なブロックのままなので、節点グラフのLの非対角成分1つが自由度の9成分になる
+    # iperm   : iperm[元の番号] = 新しい番号
+    # nodeDof : 節点の自由度
+    def measure(self, iperm, nodeDof):
+
+        matCoo = self.matGraph.tocoo()
+        vecRows = iperm[matCoo.row]
+        vecCols = iperm[matCoo.col]
+
+        # 各行で最も左にある非ゼロ成分の列を求める(下三角のみ)
+        vecFirst = np.arange(self.nodeNum)
+        np.minimum.at(vecFirst, vecRows, vecCols)
+        nodeBandwidth = int(np.max(np.abs(vecRows - vecCols))) if len(vecRows) > 0 else 0
+        nodeProfile = int(np.sum(np.arange(self.nodeNum) - vecFirst))
+
+        # 節点の1成分は自由度の3x3ブロックになる
+        bandwidth = nodeDof * (nodeBandwidth + 1) - 1
+        profile = nodeDof * nodeDof * nodeProfile + nodeDof * (nodeDof - 1) // 2 * self.nodeNum
+
+        # コレスキー分解のフィルインはエンベロープ(各行の最も左の非ゼロから対角まで)に収まる
+        diagNnz = nodeDof * (nodeDof + 1) // 2 * self.nodeNum
+        envelopeNnz = nodeDof * nodeDof * nodeProfile + diagNnz
+
+        # 並び替えなしの分解でもSuperLUは消去木の後順序で列を入れ替えるが、フィルインは変わらない
+        factor = SLA.splu(self.makeGraphMatrix(iperm), permc_spec="NATURAL", diag_pivot_thresh=0.0,
+                          options=dict(SymmetricMode=True))
+        factorNnz = nodeDof * nodeDof * (factor.L.nnz - self.nodeNum) + diagNnz
+
+        return {'bandwidth': bandwidth, 'profile': profile, 'envelopeNnz': envelopeNnz, 'factorNnz': factorNnz}
+
+    # 並び替え前後のバンド幅、プロファイル、予測フィルインをまとめる(節点の自由度ごとに一度だけ求める)
+    # predictedNnz    : 分解後のLの非ゼロ数(自由度単位、対角を含む下三角)
+    #                   並び替え前後とも、その並びで節点グラフを分解して数えた値(境界条件で除く自由度も含む)
+    # predictedMemory : LU分解(LとUを両方保持する)に必要なメモリの予測[byte]
+    def makeReport(self, nodeDof = 3):
+
+        if nodeDof in self.reports:
+            return self.reports[nodeDof]
+
+        report = {'method': self.method, 'nodeNum': self.nodeNum, 'dofNum': nodeDof * self.nodeNum}
+        for key, iperm in [('before', np.arange(self.nodeNum)), ('after', self.iperm)]:
+            stats = self.measure(iperm, nodeDof)
+            stats['predictedNnz'] = stats['factorNnz']
+            stats['predictedMemory'] = (2 * stats['predictedNnz'] - report['dofNum']) * (8 + 4)
+            report[key] = stats
+        self.reports[nodeDof] = report
+
+        return report
+
+    # 並び替え前後の比較を文字列にする(makeReportで求めた結果を使う)
+    def formatReport(self, nodeDof = 3):
+
+        report = self.makeReport(nodeDof)
+        lines = ["節点の並び替え: " + report['method'] + " (節点数 " + str(report['nodeNum']) +
+                 ", 自由度数 " + str(report['dofNum']) + ")"]
+        lines.append("".ljust(16) + "並び替え前".rjust(16) + "並び替え後".rjust(16))
+        for label, key in [("バンド幅", 'bandwidth'), ("プロファイル", 'profile'), ("分解後のLの非ゼロ数", 'predictedNnz')]:
+            lines.append(label.ljust(16) + str(report['before'][key]).rjust(16) + str(report['after'][key]).rjust(16))
+        lines.append("予測メモリ[MB]".ljust(16) + format(report['before']['predictedMemory'] / 1e6, ".1f").rjust(16) +
+                     format(report['after']['predictedMemory'] / 1e6, ".1f").rjust(16))
+
+        return "\n".join(lines)
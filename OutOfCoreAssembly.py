@@ -0,0 +1,213 @@
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+import scipy.sparse as sparse
+from C3D4Batch import C3D4Batch
+from ElementOperator import ElementOperator
+from OutOfCoreMatrix import OutOfCoreMatrix
+
+# メモリに収まらない大きさのメッシュ向けに、剛性マトリクスをディスク上で組み立てるクラス(アウトオブコア)
+# 境界条件を考慮しないKは組み立てずに要素ごとの計算で作用させ(ElementOperatorと同じ)、
+# 拘束されていない自由度のK_ffだけを次の手順でディスク上にCSR形式で組み立てる
+#   1. 要素の範囲ごとにK_ffの行ごとの成分数を数え、成分数が上限に収まるように行をブロック(バケット)に分ける
+#   2. 要素の範囲ごとに要素マトリクスを計算し、三つ組(行, 列, 値)をバケットごとの位置に
+#      メモリマップトファイルで書き出す
+#   3. バケットごとに三つ組を読み込み、同じ位置の成分を足し合わせてCSR形式の値と列番号をファイルに追記する
+# 要素の範囲の大きさとバケットの成分数は、メモリの上限から常駐する配列の分を引いた残りの半分ずつで決める
+# メッシュの形状キャッシュは作らず(既にある場合はそれを使う)、要素の範囲ごとに形状を計算し直す
+class OutOfCoreAssembly(ElementOperator):
+    # コンストラクタ
+    # mesh         : メッシュ(Mesh型)
+    # nodeDof      : 節点の自由度
+    # memoryBudget : メモリの上限[バイト](Noneの場合は上限を設けず、要素の範囲を50000要素にする)
+    # workDir      : 一時ファイルを置くディレクトリ(Noneの場合はOSの一時ディレクトリ)
+    def __init__(self, mesh, nodeDof = 3, memoryBudget = None, workDir = None):
+
+        # メモリ使用量の見積もりに使う大きさ[バイト]
+        self.nodeBytes = 700         # 節点あたりの常駐する配列(座標、境界条件、荷重・変位・反力、反復法のベクトル、前処理)
+        self.elemBytes = 80          # 要素あたりの常駐する配列(接続関係、材料番号、応力の結果)
+        self.chunkElemBytes = 12000  # 要素の範囲の計算で要素あたりに使う一時配列(Bマトリクス、要素マトリクス、三つ組)
+        self.tripletBytes = 48       # バケットの足し合わせで三つ組あたりに使う一時配列(読み込み、CSR形式への変換)
+        self.minChunkSize = 1000     # 要素の範囲の最小の要素数
+
+        # インスタンス変数を定義する
+        self.memoryBudget = memoryBudget                         # メモリの上限
+        self.workDir = workDir                                   # 一時ファイルを置くディレクトリ
+        self.residentBytes = self.estimateResidentBytes(mesh)    # 常駐する配列の見積もり
+        self.info = {}                                           # 組み立ての情報
+
+        # 残りのメモリの半分を要素の範囲の計算に、残りの半分をバケットの足し合わせに使う
+        chunkSize = 50000
+        self.tripletCapacity = chunkSize * (4 * nodeDof) ** 2   # バケットの三つ組の上限
+        if not memoryBudget is None:
+            available = memoryBudget - self.residentBytes
+            chunkSize = int(0.5 * available / self.chunkElemBytes)
+            if chunkSize < self.minChunkSize:
+                required = self.residentBytes + 2 * self.minChunkSize * self.chunkElemBytes
+                raise ValueError("メモリの上限が小さすぎます。このメッシュの解析には少なくとも " +
+                                 format(required / 1e6, ".0f") + " MB が必要です。")
+            self.tripletCapacity = int(0.5 * available / self.tripletBytes)
+
+        super().__init__(mesh, nodeDof, None, chunkSize)
+        self.cacheGeometry = False
+
+    # 組み立て中も含めて常駐する配列のバイト数を見積もる
+    # mesh : メッシュ(Mesh型)
+    def estimateResidentBytes(self, mesh):
+
+        return self.nodeBytes * mesh.nodeNum + self.elemBytes * mesh.elemNum
+
+    # 要素の節点自由度に対応する全体自由度の番号を作成する(要素数 x 12)
+    def makeElemDofs(self, elemRange):
+
+        conn = self.mesh.conn[elemRange].astype(np.int64)
+
+        return (self.nodeDof * conn[:, :, None] + np.arange(self.nodeDof)).reshape(len(conn), -1)
+
+    # 要素剛性マトリクス(要素数 x 12 x 12)を計算する(形状は要素の範囲ごとに求める)
+    def makeElemMatrices(self, elemRange):
+
+        young, poisson, density = self.mesh.makeElemMaterials(elemRange)
+        batch = C3D4Batch(None, young, poisson, density, None, self.mesh.getGeometry(elemRange, self.cacheGeometry))
+
+        return batch.makeKematrix()
+
+    # 自由度dofsの行と列からなるK_ffをディスク上に組み立てる
+    # dofs   : 取り出す自由度の番号(昇順)
+    # 戻り値 : K_ff(OutOfCoreMatrix型、使い終わったらclose()で一時ファイルを削除する)
+    def assemble(self, dofs):
+
+        startTime = time.perf_counter()
+        dofs = np.asarray(dofs)
+        vecDofMap = np.full(self.dofNum, -1, dtype=np.int64)
+        vecDofMap[dofs] = np.arange(len(dofs))
+
+        # 行ごとの成分数から、三つ組の書き出し位置とバケットを決める
+        vecRowPtr = np.concatenate([[0], np.cumsum(self.countRowEntries(vecDofMap, len(dofs)))])
+        blockRows = self.makeRowBlocks(vecRowPtr)
+
+        workDir = tempfile.mkdtemp(prefix="fem_ooc_", dir=self.workDir)
+        try:
+            tripletPath = os.path.join(workDir, "triplets.bin")
+            nodeBlocks = self.writeTriplets(tripletPath, vecDofMap, vecRowPtr, blockRows)
+            indptr, vecDiag = self.reduceTriplets(tripletPath, workDir, vecRowPtr, blockRows)
+            os.remove(tripletPath)
+        except BaseException:
+            shutil.rmtree(workDir, ignore_errors=True)
+            raise
+
+        matKff = OutOfCoreMatrix(workDir, indptr, blockRows, vecDiag, nodeBlocks)
+        self.info = {
+            'chunkSize': self.chunkSize,
+            'blockNum': len(blockRows) - 1,
+            'tripletNum': int(vecRowPtr[-1]),
+            'nnz': matKff.nnz,
+            'diskBytes': matKff.diskBytes,
+            'assemblyTime': time.perf_counter() - startTime,
+        }
+
+        return matKff
+
+    # K_ffの行ごとに、要素マトリクスから書き出す三つ組の数を数える
+    # 要素の拘束されていない自由度の行には、その要素の拘束されていない自由度の数だけ成分がある
+    def countRowEntries(self, vecDofMap, freeNum):
+
+        vecRowCounts = np.zeros(freeNum, dtype=np.int64)
+        for start in range(0, self.mesh.elemNum, self.chunkSize):
+            elemRange = slice(start, min(start + self.chunkSize, self.mesh.elemNum))
+            elemRows = vecDofMap[self.makeElemDofs(elemRange)]
+            vecFree = elemRows >= 0
+            freeCounts = vecFree.sum(axis=1)
+            np.add.at(vecRowCounts, elemRows[vecFree], np.repeat(freeCounts, freeCounts))
+
+        return vecRowCounts
+
+    # 三つ組の数がself.tripletCapacity以下になるように行をバケットに分ける
+    # vecRowPtr : 行ごとの三つ組の書き出し位置(行数 + 1)
+    # 戻り値    : バケットの境界の行番号(バケット数 + 1)
+    def makeRowBlocks(self, vecRowPtr):
+
+        rowNum = len(vecRowPtr) - 1
+        blockRows = [0]
+        while blockRows[-1] < rowNum:
+            start = blockRows[-1]
+            end = int(np.searchsorted(vecRowPtr, vecRowPtr[start] + self.tripletCapacity, side='right')) - 1
+            blockRows.append(min(max(end, start + 1), rowNum))
+
+        return np.array(blockRows, dtype=np.int64)
+
+    # 要素の範囲ごとに要素マトリクスを計算し、K_ffの三つ組をバケットごとの位置に書き出す
+    # 節点ごとの3x3対角ブロック(ブロックJacobi前処理に使う)も同時に足し合わせる
+    # 戻り値 : 節点ごとの3x3対角ブロック(全節点数 x 3 x 3)
+    def writeTriplets(self, tripletPath, vecDofMap, vecRowPtr, blockRows):
+
+        tripletType = np.dtype([('row', np.int32), ('col', np.int32), ('value', np.float64)])
+        with open(tripletPath, 'wb') as f:
+            f.truncate(int(vecRowPtr[-1]) * tripletType.itemsize)
+
+        blockNum = len(blockRows) - 1
+        vecCursor = vecRowPtr[blockRows[:-1]].copy()   # バケットごとの次の書き出し位置
+        nodeBlocks = np.zeros((self.mesh.nodeNum, self.nodeDof, self.nodeDof))
+        nodeIdx = np.arange(4)
+        for start in range(0, self.mesh.elemNum, self.chunkSize):
+            elemRange = slice(start, min(start + self.chunkSize, self.mesh.elemNum))
+            matKe = self.makeElemMatrices(elemRange)
+            elemRows = vecDofMap[self.makeElemDofs(elemRange)]
+
+            # 要素の節点ごとの対角ブロックを節点に足し込む
+            matKeBlocks = matKe.reshape(-1, 4, self.nodeDof, 4, self.nodeDof)[:, nodeIdx, :, nodeIdx, :]
+            np.add.at(nodeBlocks, self.mesh.conn[elemRange].T, matKeBlocks)
+
+            # 行と列がどちらも拘束されていない成分だけを三つ組にし、バケットの順に並べる
+            shape = matKe.shape
+            mask = (elemRows[:, :, None] >= 0) & (elemRows[:, None, :] >= 0)
+            vecRows = np.broadcast_to(elemRows[:, :, None], shape)[mask]
+            vecBlockIds = np.searchsorted(blockRows, vecRows, side='right') - 1
+            order = np.argsort(vecBlockIds, kind='stable')
+            triplets = np.empty(len(order), dtype=tripletType)
+            triplets['row'] = vecRows[order]
+            triplets['col'] = np.broadcast_to(elemRows[:, None, :], shape)[mask][order]
+            triplets['value'] = matKe[mask][order]
+            del matKe, vecRows, order
+
+            # バケットごとの位置にメモリマップトファイルで書き出す(書き出したら対応付けを解除する)
+            vecCounts = np.bincount(vecBlockIds, minlength=blockNum)
+            offset = 0
+            for block in np.flatnonzero(vecCounts):
+                count = int(vecCounts[block])
+                mapped = np.memmap(tripletPath, dtype=tripletType, mode='r+',
+                                   offset=int(vecCursor[block]) * tripletType.itemsize, shape=(count,))
+                mapped[:] = triplets[offset:offset + count]
+                del mapped
+                vecCursor[block] += count
+                offset += count
+
+        return nodeBlocks
+
+    # バケットごとに三つ組を読み込み、同じ位置の成分を足し合わせてCSR形式の値と列番号をファイルに追記する
+    # 戻り値 : 行ポインタ(行数 + 1)、対角成分
+    def reduceTriplets(self, tripletPath, workDir, vecRowPtr, blockRows):
+
+        tripletType = np.dtype([('row', np.int32), ('col', np.int32), ('value', np.float64)])
+        rowNum = len(vecRowPtr) - 1
+        indptr = np.zeros(rowNum + 1, dtype=np.int64)
+        vecDiag = np.zeros(rowNum)
+        with open(os.path.join(workDir, "data.bin"), 'wb') as fData, \
+             open(os.path.join(workDir, "indices.bin"), 'wb') as fIndices:
+            for start, end in zip(blockRows[:-1], blockRows[1:]):
+                mapped = np.memmap(tripletPath, dtype=tripletType, mode='r',
+                                   offset=int(vecRowPtr[start]) * tripletType.itemsize,
+                                   shape=(int(vecRowPtr[end] - vecRowPtr[start]),))
+                matBlock = sparse.csr_matrix((mapped['value'], (mapped['row'] - start, mapped['col'])),
+                                             shape=(end - start, rowNum))
+                del mapped
+                matBlock.sum_duplicates()
+
+                indptr[start + 1:end + 1] = indptr[start] + matBlock.indptr[1:]
+                vecDiag[start:end] = matBlock.diagonal(k=start)
+                matBlock.data.astype(np.float64).tofile(fData)
+                matBlock.indices.astype(np.int32).tofile(fIndices)
+
+        return indptr, vecDiag
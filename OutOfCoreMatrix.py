@@ -0,0 +1,103 @@
+import os
+import shutil
+import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as SLA
+
+# ディスク上のファイルにCSR形式で格納した係数行列の線形作用素(アウトオブコア)
+# 行をブロックに分けて格納し、A x の計算ではブロックごとに値と列番号をファイルから読み込んで掛ける
+# メモリに置くのは行ポインタ、対角成分、節点の3x3対角ブロック(前処理に使う)と、読み込み中の1ブロックだけ
+# (ファイルの内容はOSのページキャッシュに残るため、メモリに余裕があれば2回目以降の読み込みは速い)
+class OutOfCoreMatrix(SLA.LinearOperator):
+    # コンストラクタ
+    # workDir    : 値(data.bin、float64)と列番号(indices.bin、int32)のファイルを置いたディレクトリ
+    #              close()でディレクトリごと削除する
+    # indptr     : 行ポインタ(行数 + 1)
+    # blockRows  : 行ブロックの境界の行番号(ブロック数 + 1)
+    # vecDiag    : 対角成分
+    # nodeBlocks : 節点ごとの3x3対角ブロック(全節点数 x 3 x 3、境界条件を考慮しない)
+    def __init__(self, workDir, indptr, blockRows, vecDiag, nodeBlocks):
+
+        # インスタンス変数を定義する
+        self.workDir = workDir                                     # ファイルを置いたディレクトリ
+        self.dataPath = os.path.join(workDir, "data.bin")          # 値のファイル
+        self.indicesPath = os.path.join(workDir, "indices.bin")    # 列番号のファイル
+        self.indptr = indptr                                       # 行ポインタ
+        self.blockRows = blockRows                                 # 行ブロックの境界の行番号
+        self.vecDiag = vecDiag                                     # 対角成分
+        self.nodeBlocks = nodeBlocks                               # 節点ごとの3x3対角ブロック
+        self.nnz = int(indptr[-1])                                 # 非ゼロ成分の数
+        self.closed = False                                        # ファイルを削除したかどうか
+
+        size = len(indptr) - 1
+        super().__init__(dtype=np.float64, shape=(size, size))
+
+    # メモリに置く配列のバイト数(行ポインタ、対角成分、節点の対角ブロック、読み込む1ブロック分の値と列番号)
+    @property
+    def nbytes(self):
+
+        blockNnz = np.diff(self.indptr[self.blockRows]).max() if len(self.blockRows) > 1 else 0
+
+        return self.indptr.nbytes + self.vecDiag.nbytes + self.nodeBlocks.nbytes + 12 * int(blockNnz)
+
+    # ディスク上のファイルのバイト数
+    @property
+    def diskBytes(self):
+
+        return 12 * self.nnz
+
+    # 行ブロックごとに(ブロックの疎行列, 行の範囲)を順に返す
+    def iterateBlocks(self):
+
+        if self.closed:
+            raise ValueError("ディスク上の係数行列は削除されています。")
+
+        with open(self.dataPath, 'rb') as fData, open(self.indicesPath, 'rb') as fIndices:
+            for start, end in zip(self.blockRows[:-1], self.blockRows[1:]):
+                nnzStart, nnzEnd = int(self.indptr[start]), int(self.indptr[end])
+                fData.seek(8 * nnzStart)
+                fIndices.seek(4 * nnzStart)
+                data = np.fromfile(fData, dtype=np.float64, count=nnzEnd - nnzStart)
+                indices = np.fromfile(fIndices, dtype=np.int32, count=nnzEnd - nnzStart)
+                matBlock = sparse.csr_matrix((data, indices, self.indptr[start:end + 1] - nnzStart),
+                                             shape=(end - start, self.shape[1]))
+                yield matBlock, slice(start, end)
+
+    def _matvec(self, vecx):
+
+        vecx = np.ravel(vecx)
+        vecy = np.empty(self.shape[0])
+        for matBlock, rows in self.iterateBlocks():
+            vecy[rows] = matBlock @ vecx
+
+        return vecy
+
+    # 複数の列をまとめて掛ける(ファイルの読み込みは1回で済む)
+    def _matmat(self, matX):
+
+        matY = np.empty((self.shape[0], matX.shape[1]))
+        for matBlock, rows in self.iterateBlocks():
+            matY[rows] = matBlock @ matX
+
+        return matY
+
+    def _adjoint(self):
+
+        return self
+
+    # 対角成分(Jacobi前処理に使う)
+    def diagonal(self):
+
+        return self.vecDiag
+
+    # 節点ごとの3x3対角ブロック(ブロックJacobi前処理に使う)
+    def makeNodeBlocks(self):
+
+        return self.nodeBlocks
+
+    # ディスク上のファイルを削除する
+    def close(self):
+
+        if not self.closed:
+            shutil.rmtree(self.workDir, ignore_errors=True)
+            self.closed = True
@@ -0,0 +1,317 @@
+import time
+import numpy as np
+import numpy.linalg as LA
+import scipy.sparse as sparse
+import scipy.sparse.linalg as SLA
+
+# 前処理付き共役勾配法(PCG)のソルバー
+# 対称正定値の係数行列を対象とし、係数行列と前処理以外に大きな配列を持たない
+class PCGSolver:
+    # コンストラクタ
+    # preconditioner : 前処理の種類("jacobi", "block_jacobi", "ichol", "none")
+    # tol            : 収束判定に使う相対残差 ||b - Ax|| / ||b||
+    # maxIter        : 最大反復回数(Noneの場合は自由度数)
+    # nodeDof        : 節点の自由度(ブロックJacobi前処理のブロックサイズ)
+    # dropTol        : 不完全分解で捨てる成分の相対許容値
+    # fillFactor     : 不完全分解で許容するフィルインの倍率
+    # reusePreconditioner : 係数行列の大きさと自由度が前回と同じ場合に前回の前処理を使い回すかどうか
+    #                       (形状を少しずつ変えるパラメトリック解析で前処理の作成を省く)
+    # rebuildRatio   : 前処理を作成した直後の反復回数のこの倍を超えたら、次の分解で前処理を作り直す
+    def __init__(self, preconditioner = "block_jacobi", tol = 1e-8, maxIter = None, nodeDof = 3,
+                 dropTol = 1e-2, fillFactor = 10.0, reusePreconditioner = False, rebuildRatio = 1.5):
+
+        # インスタンス変数を定義する
+        self.preconditioner = preconditioner   # 前処理の種類
+        self.tol = tol                         # 収束判定の相対残差
+        self.maxIter = maxIter                 # 最大反復回数
+        self.nodeDof = nodeDof                 # 節点の自由度
+        self.dropTol = dropTol                 # 不完全分解の許容値
+        self.fillFactor = fillFactor           # 不完全分解のフィルインの倍率
+        self.matA = None                       # 係数行列
+        self.applyPreconditioner = None        # 前処理 z = M^-1 r を計算する関数
+        self.reusePreconditioner = reusePreconditioner   # 前処理を使い回すかどうか
+        self.rebuildRatio = rebuildRatio       # 前処理を作り直す反復回数の倍率
+        self.preconditionerDofs = None         # 前処理を作成したときの自由度番号
+        self.freshIterations = None            # 前処理を作成した直後の反復回数
+        self.preconditionerStale = False       # 前処理の効果が落ちたため作り直すかどうか
+        self.coldIterations = None             # 直近の初期値0から解いたときの反復回数(初期値の効果の目安に使う)
+        self.info = {}                         # 反復回数、残差履歴、計算時間
+
+    # 係数行列を設定し、前処理を作成する
+    # matA : 係数行列(疎行列、行列を組み立てない作用素(ElementOperator型)、
+    #        またはディスク上の行列(OutOfCoreMatrix型))
+    #        作用素の場合、前処理は"jacobi"または"block_jacobi"を使う
+    # dofs : matAの各行に対応する全体自由度の番号(Noneの場合は行番号)
+    def factorize(self, matA, dofs = None):
+
+        if dofs is None:
+            dofs = np.arange(matA.shape[0])
+        dofs = np.asarray(dofs)
+
+        startTime = time.perf_counter()
+        self.matA = matA
+
+        # 前回と同じ自由度の係数行列で、前処理の効果が落ちていなければ前回の前処理を使い回す
+        reuse = (self.reusePreconditioner and not self.applyPreconditioner is None and
+                 not self.preconditionerStale and not self.preconditionerDofs is None and
+                 np.array_equal(self.preconditionerDofs, dofs))
+        if reuse:
+            self.info = {
+                'dofNum': matA.shape[0],
+                'preconditioner': self.preconditioner,
+                'preconditionerReused': True,
+                'setupTime': time.perf_counter() - startTime,
+            }
+            return
+
+        self.applyPreconditioner = None
+        if self.preconditioner == "jacobi":
+            self.applyPreconditioner = self.makeJacobi(matA)
+        elif self.preconditioner == "block_jacobi":
+            self.applyPreconditioner = self.makeBlockJacobi(matA, dofs)
+        elif self.preconditioner == "ichol":
+            self.applyPreconditioner = self.makeIncompleteCholesky(matA)
+        elif self.preconditioner == "none":
+            self.applyPreconditioner = lambda vecr: vecr
+        else:
+            raise ValueError("未対応の前処理です: " + str(self.preconditioner))
+        self.preconditionerDofs = dofs.copy()
+        self.freshIterations = None
+        self.preconditionerStale = False
+
+        self.info = {
+            'dofNum': matA.shape[0],
+            'preconditioner': self.preconditioner,
+            'preconditionerReused': False,
+            'setupTime': time.perf_counter() - startTime,
+        }
+
+    # 対角スケーリング(Jacobi)前処理を作成する
+    def makeJacobi(self, matA):
+
+        vecDiag = matA.diagonal()
+        if np.any(vecDiag <= 0.0):
+            raise ValueError("有限要素法の計算に失敗しました。剛性マトリクスの対角成分が正ではありません。")
+        vecInvDiag = 1.0 / vecDiag
+
+        return lambda vecr: vecInvDiag * vecr
+
+    # 節点ごとの3x3ブロック対角(ブロックJacobi)前処理を作成する
+    # 一部の自由度が拘束された節点のブロックは、欠けた自由度を単位行列で埋めて逆行列を求める
+    def makeBlockJacobi(self, matA, dofs):
+
+        nodeNos, blockIdx = np.unique(dofs // self.nodeDof, return_inverse=True)
+        localIdx = dofs % self.nodeDof
+
+        vecDiagMask = self.findDiagonalBlocks(matA, nodeNos, dofs)
+        if not vecDiagMask is None:
+            # 節点の全自由度が並んだBSR形式の場合は、対角ブロックをそのまま取り出す
+            matBlocks = matA.data[vecDiagMask]
+        elif sparse.issparse(matA):
+            # 同じ節点に属する行と列の成分だけを取り出してブロックに足し込む
+            matCoo = sparse.coo_matrix(matA)
+            mask = blockIdx[matCoo.row] == blockIdx[matCoo.col]
+            vecRows = matCoo.row[mask]
+            vecCols = matCoo.col[mask]
+            matBlocks = np.zeros((len(nodeNos), self.nodeDof, self.nodeDof))
+            matBlocks[:, np.arange(self.nodeDof), np.arange(self.nodeDof)] = 1.0
+            matBlocks[blockIdx, localIdx, localIdx] = 0.0
+            np.add.at(matBlocks, (blockIdx[vecRows], localIdx[vecRows], localIdx[vecCols]), matCoo.data[mask])
+        else:
+            # 行列を組み立てない作用素、ディスク上の行列は、要素から計算した節点のブロックのうち
+            # 作用素の自由度に含まれる行と列だけを残す
+            vecFree = np.zeros((len(nodeNos), self.nodeDof), dtype=bool)
+            vecFree[blockIdx, localIdx] = True
+            matBlocks = matA.makeNodeBlocks()[nodeNos] * (vecFree[:, :, None] & vecFree[:, None, :])
+            matBlocks[:, np.arange(self.nodeDof), np.arange(self.nodeDof)] += ~vecFree
+
+        try:
+            matInvBlocks = LA.inv(matBlocks)
+        except LA.LinAlgError:
+            raise ValueError("有限要素法の計算に失敗しました。剛性マトリクスの対角ブロックが特異です。")
+
+        def apply(vecr):
+            vecPad = np.zeros((len(nodeNos), self.nodeDof))
+            vecPad[blockIdx, localIdx] = vecr
+            vecz = np.einsum('bij,bj->bi', matInvBlocks, vecPad)
+            return vecz[blockIdx, localIdx]
+
+        return apply
+
+    # BSR形式の係数行列の対角ブロックの位置を求める
+    # 行が節点の全自由度の順に並び、全ての節点に対角ブロックがある場合のみ求める
+    # 戻り値 : data配列のブロックのうち対角ブロックを示すマスク(求められない場合はNone)
+    def findDiagonalBlocks(self, matA, nodeNos, dofs):
+
+        if not (sparse.issparse(matA) and matA.format == "bsr" and
+                matA.blocksize == (self.nodeDof, self.nodeDof) and
+                np.array_equal(dofs, (self.nodeDof * nodeNos[:, None] + np.arange(self.nodeDof)).ravel())):
+            return None
+
+        vecBlockRows = np.repeat(np.arange(len(nodeNos)), np.diff(matA.indptr))
+        vecDiagMask = matA.indices == vecBlockRows
+        if np.count_nonzero(vecDiagMask) != len(nodeNos):
+            return None
+
+        return vecDiagMask
+
+    # 不完全Cholesky分解 M = L D L^T による前処理を作成する
+    # SciPyには不完全Cholesky分解がないため、対角スケーリングした行列を対称な並び替えのみで
+    # 不完全LU分解し、そのLとUの対角成分から対称な前処理を組み立てる
+    # Dに正でない成分が現れた場合は、対角成分を少しずつ増やして分解し直す
+    def makeIncompleteCholesky(self, matA):
+
+        if not sparse.issparse(matA):
+            raise ValueError("不完全Cholesky前処理は剛性マトリクスを組み立てない解析では使えません。")
+        vecDiag = matA.diagonal()
+        if np.any(vecDiag <= 0.0):
+            raise ValueError("有限要素法の計算に失敗しました。剛性マトリクスの対角成分が正ではありません。")
+        vecScale = 1.0 / np.sqrt(vecDiag)
+        matScale = sparse.diags(vecScale)
+        matS = sparse.csc_matrix(matScale @ matA @ matScale)
+
+        factor = None
+        for shift in [0.0, 1e-3, 1e-2, 1e-1]:
+            try:
+                factor = SLA.spilu(matS + shift * sparse.identity(matS.shape[0], format="csc"),
+                                   drop_tol=self.dropTol, fill_factor=self.fillFactor,
+                                   permc_spec="MMD_AT_PLUS_A", diag_pivot_thresh=0.0,
+                                   options=dict(SymmetricMode=True))
+            except RuntimeError:
+                continue
+            if np.all(factor.U.diagonal() > 0.0):
+                break
+            factor = None
+        if factor is None:
+            raise ValueError("有限要素法の計算に失敗しました。不完全分解の対角成分が正になりませんでした。")
+
+        matL = sparse.csr_matrix(factor.L)
+        matLT = sparse.csr_matrix(factor.L.T)
+        vecD = factor.U.diagonal()
+        perm = factor.perm_c
+
+        def apply(vecr):
+            vecy = np.empty_like(vecr)
+            vecy[perm] = vecScale * vecr
+            vecy = SLA.spsolve_triangular(matL, vecy, lower=True, unit_diagonal=True)
+            vecy = SLA.spsolve_triangular(matLT, vecy / vecD, lower=False, unit_diagonal=True)
+            return vecScale * vecy[perm]
+
+        return apply
+
+    # 前処理付き共役勾配法で連立方程式を解く
+    # vecb  : 右辺ベクトル(複数の右辺を列に並べた行列も可)
+    #         複数の右辺は前処理を共有して1列ずつ解き、反復回数などはケースごとのリストにする
+    # vecx0 : 反復の初期値(Noneの場合は0)
+    #         vecbが1本の場合は、初期値の候補を1本または列に並べた複数本(自由度数 x 候補数)で与え、
+    #         候補が張る空間で誤差のA-ノルムが最小になる組み合わせを初期値にする
+    #         vecbが複数の場合は、vecbと同じ形で列ごとに初期値を与える
+    #         近いケースの解を与えると反復回数が減る。初期値が0より悪い場合は0から解く
+    def solve(self, vecb, vecx0 = None):
+
+        if self.matA is None:
+            raise ValueError("係数行列が設定されていません。先にfactorize()を実行してください。")
+
+        vecb = np.asarray(vecb, dtype=float)
+        if not vecx0 is None:
+            vecx0 = np.asarray(vecx0, dtype=float)
+        if vecb.ndim == 1:
+            return self.solveVector(vecb, vecx0)
+
+        vecx = np.zeros_like(vecb)
+        caseInfo = []
+        for i in range(vecb.shape[1]):
+            vecx[:, i] = self.solveVector(vecb[:, i], None if vecx0 is None else vecx0[:, i])
+            caseInfo.append(dict(self.info))
+        for key in ['iterations', 'residuals', 'relativeResidual', 'converged', 'solveTime',
+                    'warmStarted', 'coldIterations']:
+            self.info[key] = [info[key] for info in caseInfo]
+
+        return vecx
+
+    # 初期値の候補から、誤差のA-ノルムが最小になる初期値を求める(Galerkin射影)
+    # x0 = V (V^T A V)^-1 V^T b は候補が張る空間で全ポテンシャルエネルギーを最小にする
+    # 収束判定は残差 ||b - A x|| / ||b|| で行うため、エネルギーが小さくなっても残差が0から始める場合
+    # (||b||)より小さくならない初期値は反復回数を増やす。その場合は使わずに0から解く
+    # vecb  : 右辺ベクトル
+    # vecx0 : 初期値の候補(自由度数、または自由度数 x 候補数)
+    # 戻り値: 初期値とA x0(候補から初期値を作れない場合はNone, None)
+    def projectInitialGuess(self, vecb, vecx0):
+
+        matV = vecx0.reshape(len(vecb), -1)
+        matAV = self.matA @ matV
+        vecy = LA.lstsq(matV.T @ matAV, matV.T @ vecb, rcond=1e-12)[0]
+        if not np.all(np.isfinite(vecy)):
+            return None, None
+
+        vecAx0 = matAV @ vecy
+        if LA.norm(vecb - vecAx0) >= LA.norm(vecb):
+            return None, None
+
+        return matV @ vecy, vecAx0
+
+    # 右辺ベクトル1本について前処理付き共役勾配法で解く
+    # vecx0 : 反復の初期値またはその候補(Noneの場合は0)
+    def solveVector(self, vecb, vecx0 = None):
+
+        startTime = time.perf_counter()
+        maxIter = self.maxIter if not self.maxIter is None else self.matA.shape[0]
+
+        vecx = np.zeros_like(vecb)
+        normb = LA.norm(vecb)
+        residuals = [0.0]
+        iteration = 0
+        warmStarted = False
+        if normb > 0.0:
+            vecr = vecb.copy()
+            if not vecx0 is None:
+                vecx0, vecAx0 = self.projectInitialGuess(vecb, vecx0)
+                if not vecx0 is None:
+                    vecx = vecx0
+                    vecr = vecb - vecAx0
+                    warmStarted = True
+            vecz = self.applyPreconditioner(vecr)
+            vecp = vecz.copy()
+            rz = vecr @ vecz
+            residuals = [LA.norm(vecr) / normb]
+            while residuals[-1] > self.tol and iteration < maxIter:
+                vecAp = self.matA @ vecp
+                pAp = vecp @ vecAp
+                if pAp <= 0.0:
+                    raise ValueError("有限要素法の計算に失敗しました。剛性マトリクスが正定値ではありません(拘束不足の可能性があります)。")
+                alpha = rz / pAp
+                vecx += alpha * vecp
+                vecr -= alpha * vecAp
+                iteration += 1
+                residuals.append(LA.norm(vecr) / normb)
+
+                vecz = self.applyPreconditioner(vecr)
+                rzNew = vecr @ vecz
+                vecp = vecz + (rzNew / rz) * vecp
+                rz = rzNew
+
+        # 初期値を与えた場合の効果は、直近の初期値0からの反復回数と比べて見積もる
+        coldIterations = self.coldIterations
+        if not warmStarted:
+            self.coldIterations = iteration
+            coldIterations = iteration
+
+        # 前処理を使い回す場合、作成直後より反復回数が大きく増えたら次の分解で作り直す
+        if self.freshIterations is None:
+            self.freshIterations = iteration
+        elif iteration > self.rebuildRatio * max(self.freshIterations, 1):
+            self.preconditionerStale = True
+
+        self.info['iterations'] = iteration
+        self.info['residuals'] = residuals
+        self.info['relativeResidual'] = residuals[-1]
+        self.info['converged'] = residuals[-1] <= self.tol
+        self.info['warmStarted'] = warmStarted
+        self.info['coldIterations'] = coldIterations
+        self.info['solveTime'] = time.perf_counter() - startTime
+
+        if not self.info['converged']:
+            raise ValueError("有限要素法の計算に失敗しました。反復法が" + str(iteration) +
+                             "回で収束しませんでした(相対残差: " + format(residuals[-1], ".3e") + ")。")
+
+        return vecx
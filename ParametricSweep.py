@@ -0,0 +1,354 @@
+import os
+import itertools
+import numpy as np
+import numpy.linalg as LA
+from scipy.stats import qmc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from FEM import FEM
+from DirectSolver import DirectSolver
+from PCGSolver import PCGSolver
+from CASolver import CASolver
+from SharedMesh import SharedMesh
+
+# GUIに依存しないパラメトリック解析(形状スケールのスイープ)を行うクラス
+# 基準メッシュの節点座標を重心まわりにX/Y/Z方向へ拡大縮小した各ケースを解析し、
+# 解析が終わったケースから順に結果を返す
+class ParametricSweep:
+    # コンストラクタ
+    # mesh             : 基準メッシュ(Mesh型、材料と重力加速度を含む)
+    # bound            : 境界条件(Boundary型、全ケースで共通)
+    # workers          : 並列に解析するプロセス数(Noneの場合はCPUのコア数、1の場合は同じプロセスで順に解析する)
+    # keepDisplacement : 結果に全節点の変位を含めるかどうか
+    #                    Falseの場合は最大値などの小さな結果だけを返す(必要なケースはanalyzeCaseで解析し直す)
+    # solverType       : 連立方程式のソルバー
+    #                    "direct"     : DirectSolver
+    #                    "pcg"        : PCGSolver
+    #                    "reanalysis" : CASolver(基準メッシュの分解だけで近似的に解く、スクリーニング用)
+    # warmStart        : 反復法で、解いたケースの変位から予測した値を初期値にするかどうか
+    #                    前処理も効果が落ちるまで前のケースのものを使い回す
+    #                    (片持ち梁のスケールのスイープでは反復回数が減らないケースが多いため、既定では行わない)
+    # reanalysisTol    : 近似再解析で厳密に解き直す誤差指標(変位の相対誤差の見積もり)の許容値
+    def __init__(self, mesh, bound, workers = None, keepDisplacement = False, solverType = "direct",
+                 warmStart = False, reanalysisTol = 1e-2):
+
+        # インスタンス変数を定義する
+        self.mesh = mesh                                   # 基準メッシュ
+        self.bound = bound                                 # 境界条件
+        self.workers = workers                             # 並列に解析するプロセス数
+        self.keepDisplacement = keepDisplacement           # 結果に全節点の変位を含めるかどうか
+        self.solverType = solverType                       # 連立方程式のソルバーの種類
+        self.warmStart = warmStart                         # 反復法の初期値を予測するかどうか
+        self.reanalysisTol = reanalysisTol                 # 近似再解析の誤差指標の許容値
+        self.historySize = 4                               # 初期値の予測に使う解の数
+        self.history = []                                  # 解いたケースの(スケール, 全節点の変位)のリスト
+        self.femWorkers = None                             # 1ケースの全体マトリクスの作成に使うスレッド数
+        self.baseVolume = None                             # 基準メッシュの体積(体積比の計算に使う)
+        self.centroid = None                               # 拡大縮小の中心(基準メッシュの節点の重心)
+        if not mesh is None:
+            self.baseVolume = float(mesh.getVolumes().sum())
+            self.centroid = mesh.coords.mean(axis=0)
+        self.sharedMesh = None                             # open()で共有メモリに置いたメッシュ
+        self.executor = None                               # open()で起動したワーカーのプロセスプール
+
+        # 全ケースでK_ffの非ゼロ構造は同じため、同じソルバーで直接法の並び替え(解析)や反復法の前処理を使い回す
+        self.solver = self.makeSolver()
+
+    # ケース間で使い回すソルバーを作成する
+    def makeSolver(self):
+
+        if self.solverType == "direct":
+            return DirectSolver()
+        elif self.solverType == "pcg":
+            return PCGSolver(reusePreconditioner=self.warmStart)
+        elif self.solverType == "reanalysis":
+            return CASolver(errorTol=self.reanalysisTol)
+        else:
+            raise ValueError("未対応のソルバーです: " + str(self.solverType))
+
+    # X/Y/Z方向のスケール[%]の全組み合わせ(X、Y、Zの順に入れ子)を作成する
+    # xScales, yScales, zScales : 各方向のスケール[%]のリスト
+    @staticmethod
+    def makeGridCases(xScales, yScales, zScales):
+
+        return [(float(x), float(y), float(z)) for x, y, z in itertools.product(xScales, yScales, zScales)]
+
+    # X/Y/Z方向のスケール[%]の範囲からラテン超方格でケースを作成する
+    # 各方向の範囲をケース数で等分した区間に1ケースずつ入るため、少ないケース数でも範囲全体を覆える
+    # bounds  : 各方向の(最小, 最大)のスケール[%]の組のリスト(最小と最大が同じ方向は固定)
+    # caseNum : ケース数
+    # seed    : 乱数のシード(Noneの場合は毎回異なる)
+    @staticmethod
+    def makeLatinHypercubeCases(bounds, caseNum, seed = None):
+
+        sampler = qmc.LatinHypercube(d=len(bounds), seed=seed)
+
+        return ParametricSweep.scaleSamples(sampler.random(caseNum), bounds)
+
+    # X/Y/Z方向のスケール[%]の範囲からSobol列(スクランブルあり)でケースを作成する
+    # 低食い違い量列のため、ケースを追加しても範囲全体に均一に分布する
+    # ケース数は2のべき乗にすると均一性が最もよくなる
+    # bounds, caseNum, seed : makeLatinHypercubeCasesと同じ
+    @staticmethod
+    def makeSobolCases(bounds, caseNum, seed = None):
+
+        sampler = qmc.Sobol(d=len(bounds), scramble=True, seed=seed)
+
+        return ParametricSweep.scaleSamples(sampler.random(caseNum), bounds)
+
+    # 単位超立方体内のサンプルをスケール[%]の範囲に写像し、ケースのリストにする
+    # samples : サンプル(ケース数 x 方向数、各成分は0～1)
+    # bounds  : 各方向の(最小, 最大)のスケール[%]の組のリスト
+    @staticmethod
+    def scaleSamples(samples, bounds):
+
+        bounds = np.asarray(bounds, dtype=float)
+        scales = bounds[:, 0] + samples * (bounds[:, 1] - bounds[:, 0])
+
+        return [tuple(float(scale) for scale in row) for row in scales]
+
+    # 開始、終了、刻みからスケール[%]のリストを作成する(終了値を含む)
+    @staticmethod
+    def makeScaleRange(start, end, step):
+
+        return [start + i * step for i in range(int((end - start) / step) + 1) if start + i * step <= end]
+
+    # 並列に解析するプロセス数を求める
+    # caseNum : ケース数
+    def getWorkerNum(self, caseNum):
+
+        workers = self.workers if not self.workers is None else (os.cpu_count() or 1)
+
+        return max(1, min(workers, caseNum))
+
+    # ワーカーのプロセスプールを起動する
+    # run()を何度も呼ぶ場合(適応的サンプリングなど)に、共有メモリやワーカーごとのソルバーの分解、
+    # 前処理を呼び出しの間で使い回すために使う(with文でも使える)
+    # caseNum : 解析する予定のケース数(Noneの場合はself.workersのとおりに起動する)
+    def open(self, caseNum = None):
+
+        if not self.executor is None:
+            return self
+
+        # シンボリック組み立てはワーカーに渡す前に作成し、各ワーカーで作り直さないようにする
+        self.mesh.getSymbolicAssembly()
+
+        workers = self.getWorkerNum(np.inf if caseNum is None else caseNum)
+        if workers == 1:
+            return self
+
+        # 基準メッシュ、境界条件、シンボリック組み立ての配列は共有メモリに置き、ワーカーは複製せずに参照する
+        # ケースごとに受け渡すのはスケールと小さな結果だけにする
+        # 各ワーカーは1ケースを1スレッドで解析する(プロセス数 x スレッド数がコア数を超えないようにする)
+        # 反復法の初期値は、各ワーカーが自分で解いたケースのうちスケールが近いものから予測する
+        self.sharedMesh = SharedMesh(self.mesh, self.bound)
+        options = {'keepDisplacement': self.keepDisplacement, 'solverType': self.solverType,
+                   'warmStart': self.warmStart, 'reanalysisTol': self.reanalysisTol}
+        try:
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initSweepWorker,
+                                                initargs=(self.sharedMesh.spec, self.baseVolume, self.centroid,
+                                                          options))
+        except Exception:
+            self.close()
+            raise
+
+        return self
+
+    # ワーカーのプロセスプールを終了し、共有メモリを解放する
+    def close(self):
+
+        if not self.executor is None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        if not self.sharedMesh is None:
+            self.sharedMesh.close()
+            self.sharedMesh = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    # 全ケースを解析し、解析が終わったケースから順に結果を返す(ジェネレータ)
+    # 複数のプロセスで解析する場合、結果はケースの順番どおりには返らない
+    # open()していない場合は、このケースのためだけにプロセスプールを起動する
+    # cases       : ケースごとのX/Y/Z方向のスケール[%]の組のリスト
+    # firstCaseNo : 最初のケースのケース番号
+    def run(self, cases, firstCaseNo = 1):
+
+        cases = [tuple(float(scale) for scale in scales) for scales in cases]
+
+        temporary = self.executor is None
+        if temporary:
+            self.open(len(cases))
+        if self.executor is None:
+            for i, scales in enumerate(cases):
+                yield self.analyzeCase(firstCaseNo + i, scales)
+            return
+
+        futures = []
+        try:
+            futures = [self.executor.submit(analyzeSweepCase, firstCaseNo + i, scales)
+                       for i, scales in enumerate(cases)]
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            if temporary:
+                self.close()
+            else:
+                for future in futures:
+                    future.cancel()
+
+    # 基準メッシュの節点座標にスケールを適用する
+    # scales : X/Y/Z方向のスケール[%]の組
+    def makeScaledCoords(self, scales):
+
+        return (self.mesh.coords - self.centroid) * (np.asarray(scales, dtype=float) / 100.0) + self.centroid
+
+    # 近似再解析の基準として、基準メッシュ(スケール100%)の剛性マトリクスを分解する
+    # ワーカーごとに一度だけ行い、以降のケースはこの分解だけで近似する
+    def setReanalysisBaseline(self):
+
+        fem = FEM(self.mesh, self.bound)
+        fem.workers = self.femWorkers
+        matKc, _ = fem.setBoundCondition(fem.makeKmatrix(), np.zeros(self.mesh.nodeNum * fem.nodeDof))
+        self.solver.setBaseline(matKc, fem.freeDofs)
+
+    # 解いたケースの変位から、新しいケースの反復の初期値の候補を作成する
+    # スケールが近い順に並べた変位を候補とし、PCGSolverが候補の最適な組み合わせ(近いケースの解や
+    # その外挿を含む)を初期値にする
+    # scales : X/Y/Z方向のスケール[%]の組
+    # 戻り値 : 候補を列に並べた行列(全自由度数 x 候補数、候補がない場合はNone)
+    def predictDisplacement(self, scales):
+
+        if not self.warmStart or self.solverType != "pcg" or len(self.history) == 0:
+            return None
+
+        vecScales = np.asarray(scales, dtype=float)
+        distances = [LA.norm(vecScales - histScales) for histScales, _ in self.history]
+
+        return np.column_stack([self.history[i][1] for i in np.argsort(distances, kind="stable")])
+
+    # 解いたケースの変位を初期値の予測のために記録する(新しいものからhistorySize個まで)
+    def addHistory(self, scales, vecDisp):
+
+        if not self.warmStart or self.solverType != "pcg":
+            return
+        self.history.append((np.asarray(scales, dtype=float), vecDisp))
+        self.history = self.history[-self.historySize:]
+
+    # 1ケースの計算時間の内訳、反復回数をログ用の文字列にする
+    # result : analyzeCaseの戻り値
+    @staticmethod
+    def formatCaseLog(result):
+
+        if not result['error'] is None:
+            return "ケース " + str(result['case']) + " でエラー: " + result['error']
+
+        timings = result['timings']
+        info = result['solver_info']
+        text = (f"ケース {result['case']} (X:{result['x_scale']}%, Y:{result['y_scale']}%, Z:{result['z_scale']}%)\n"
+                f"  計算時間: 組み立て {timings['assembly']:.3f}s, 境界条件 {timings['boundary']:.3f}s, ")
+        if 'factorTime' in info:
+            if info['analysisReused']:
+                text += f"解析 再利用({info['analysisTimeSaved']:.3f}s削減), "
+            else:
+                text += f"解析 {info['analysisTime']:.3f}s, "
+            text += f"数値分解 {info['factorTime']:.3f}s, "
+        elif 'preconditioner' in info:
+            text += f"前処理 {info['setupTime']:.3f}s{'(再利用)' if info['preconditionerReused'] else ''}, "
+        text += f"求解 {info['solveTime']:.3f}s, 応力 {timings['stress']:.3f}s"
+        if 'errorIndicator' in info and not info['baseline']:
+            text += f"\n  近似再解析: 基底 {info['basisSize']}本, 誤差指標 {info['errorIndicator']:.2e}"
+            if info['fallback']:
+                text += " (許容値を超えたため厳密に解き直し)"
+        if 'iterations' in info:
+            text += f"\n  反復回数: {info['iterations']}回"
+            if info['warmStarted'] and not info['coldIterations'] is None:
+                change = info['iterations'] - info['coldIterations']
+                text += (f" (初期値の予測あり、0から解いた直近のケースは{info['coldIterations']}回で" +
+                         ("同じ" if change == 0 else f"{'増加' if change > 0 else '削減'} {abs(change)}回") + ")")
+            elif info['warmStarted']:
+                text += " (初期値の予測あり)"
+
+        return text
+
+    # 1ケースを解析する
+    # caseNo           : ケース番号(1始まり)
+    # scales           : X/Y/Z方向のスケール[%]の組
+    # keepDisplacement : 結果に全節点の変位を含めるかどうか(Noneの場合はself.keepDisplacement)
+    # 戻り値           : 結果の辞書(解析に失敗した場合は応力、変位がNoneで、errorにメッセージが入る)
+    def analyzeCase(self, caseNo, scales, keepDisplacement = None):
+
+        if keepDisplacement is None:
+            keepDisplacement = self.keepDisplacement
+
+        result = {
+            'case': caseNo,
+            'x_scale': scales[0],
+            'y_scale': scales[1],
+            'z_scale': scales[2],
+            'max_stress': None,
+            'max_element_id': None,
+            'volume_ratio': 1.0,
+            'displacement': None,
+            'max_displacement': None,
+            'approximate': False,
+            'timings': {},
+            'solver_info': {},
+            'error': None,
+        }
+
+        try:
+            if self.solverType == "reanalysis" and self.solver.matBase is None:
+                self.setReanalysisBaseline()
+
+            mesh = self.mesh.withCoords(self.makeScaledCoords(scales))
+            if self.baseVolume > 0.0:
+                result['volume_ratio'] = float(mesh.getVolumes().sum()) / self.baseVolume
+
+            fem = FEM(mesh, self.bound)
+            fem.workers = self.femWorkers
+            vecDisp, _ = fem.analysis(self.solver, self.predictDisplacement(scales))
+            self.addHistory(scales, vecDisp)
+            maxStress, maxElementId, _ = fem.calculateMaxStress()
+
+            displacement = vecDisp.reshape(-1, fem.nodeDof)
+            result['max_stress'] = maxStress
+            result['max_element_id'] = maxElementId
+            if keepDisplacement:
+                result['displacement'] = displacement
+            result['max_displacement'] = float(np.max(np.linalg.norm(displacement, axis=1)))
+            result['timings'] = dict(fem.timings)
+            result['solver_info'] = dict(fem.solver.info)
+            result['approximate'] = bool(fem.solver.info.get('approximate', False))
+        except Exception as e:
+            result['error'] = str(e)
+
+        return result
+
+# ワーカープロセスごとのスイープと参照中の共有メモリ(initSweepWorkerで作成する)
+_sweepWorker = None
+_sharedBlocks = []
+
+# ワーカープロセスの起動時に共有メモリのメッシュと境界条件を参照する
+# spec       : SharedMesh.specの値
+# baseVolume : 基準メッシュの体積
+# centroid   : 拡大縮小の中心
+# options    : ParametricSweepのコンストラクタに渡すオプション(辞書)
+def initSweepWorker(spec, baseVolume, centroid, options):
+
+    global _sweepWorker, _sharedBlocks
+    mesh, bound, _sharedBlocks = SharedMesh.attach(spec)
+
+    # 体積と重心は親プロセスで求めた値を使い、基準メッシュの形状キャッシュを作らない
+    _sweepWorker = ParametricSweep(None, bound, workers=1, **options)
+    _sweepWorker.mesh = mesh
+    _sweepWorker.baseVolume = baseVolume
+    _sweepWorker.centroid = centroid
+    _sweepWorker.femWorkers = 1
+
+# ワーカープロセスで1ケースを解析する
+def analyzeSweepCase(caseNo, scales):
+
+    return _sweepWorker.analyzeCase(caseNo, scales)
@@ -150,7 +150,7 @@ class ProjectData:
             self.max_displacement = max(displacements_magnitude)
         
         if stress_data is not None:
-            self.max_stress = max(stress_data) if len(stress_data) > 0 else None
+            self.max_stress = float(np.max(stress_data)) if len(stress_data) > 0 else None
             
             # 安全率を計算
             yield_strength = None
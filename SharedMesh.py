@@ -0,0 +1,101 @@
+import numpy as np
+from multiprocessing import shared_memory
+from Boundary import Boundary
+from Mesh import Mesh
+from SymbolicAssembly import SymbolicAssembly
+
+# メッシュ、境界条件、シンボリック組み立ての配列を共有メモリに置くクラス
+# 並列に解析するワーカープロセスは共有メモリを読み取り専用で参照し、配列を複製しない
+# プロセス間で受け渡すのは共有メモリの名前と配列の形状だけ(self.spec)になる
+class SharedMesh:
+    # コンストラクタ
+    # mesh    : 共有するメッシュ(Mesh型)
+    # bound   : 共有する境界条件(Boundary型)
+    # nodeDof : 節点の自由度(シンボリック組み立ての作成に使う)
+    def __init__(self, mesh, bound, nodeDof = 3):
+
+        # インスタンス変数を定義する
+        self.blocks = []   # 作成した共有メモリ(SharedMemory型のリスト)
+        self.spec = {      # ワーカープロセスに渡す共有メモリの情報(pickleできる値のみ)
+            'arrays': {},
+            'young': mesh.young,
+            'poisson': mesh.poisson,
+            'density': mesh.density,
+            'vecGravity': mesh.vecGravity if mesh.vecGravity is None or mesh.vecGravity.ndim == 1 else None,
+            'nodeNum': mesh.nodeNum,
+            'nodeDof': nodeDof,
+        }
+
+        # 強制変位は拘束されていない自由度をNaNにした実数の配列として共有する
+        vecBoundDisp = np.array([np.nan if disp is None else disp for disp in bound.makeDispVector()],
+                                dtype=np.float64)
+        symbolic = mesh.getSymbolicAssembly(nodeDof)
+
+        try:
+            self.addArray('coords', mesh.coords)
+            self.addArray('conn', mesh.conn)
+            self.addArray('materialIds', mesh.materialIds)
+            if not mesh.vecGravity is None and mesh.vecGravity.ndim == 2:
+                self.addArray('vecGravity', mesh.vecGravity)
+            self.addArray('vecForce', np.asarray(bound.makeForceVector(), dtype=np.float64))
+            self.addArray('vecBoundDisp', vecBoundDisp)
+            self.addArray('indptr', symbolic.indptr)
+            self.addArray('indices', symbolic.indices)
+            self.addArray('scatter', symbolic.scatter)
+        except Exception:
+            self.close()
+            raise
+
+    # 配列を共有メモリに複製し、名前と形状をspecに登録する
+    def addArray(self, key, array):
+
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.blocks.append(block)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        self.spec['arrays'][key] = (block.name, array.shape, array.dtype.str)
+
+    # 共有メモリを解放する(作成したプロセスで、全てのワーカーが終了した後に呼ぶ)
+    def close(self):
+
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    # 共有メモリを参照してメッシュと境界条件を作成する(ワーカープロセスで呼ぶ)
+    # 配列は共有メモリを直接参照する読み取り専用のビューで、複製しない
+    # spec   : SharedMesh.specの値
+    # 戻り値 : メッシュ(Mesh型)、境界条件(Boundary型)、参照中の共有メモリのリスト
+    #          共有メモリのリストはメッシュを使い終わるまで保持しておく
+    @staticmethod
+    def attach(spec):
+
+        blocks = []
+        arrays = {}
+        for key, (name, shape, dtype) in spec['arrays'].items():
+            block = shared_memory.SharedMemory(name=name)
+            blocks.append(block)
+            array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+            array.flags.writeable = False
+            arrays[key] = array
+
+        vecGravity = arrays['vecGravity'] if 'vecGravity' in arrays else spec['vecGravity']
+        mesh = Mesh(arrays['coords'], arrays['conn'], spec['young'], spec['poisson'], spec['density'],
+                    arrays['materialIds'], vecGravity)
+        mesh.symbolicAssembly = SymbolicAssembly.fromArrays(arrays['indptr'], arrays['indices'], arrays['scatter'],
+                                                            spec['nodeNum'], spec['nodeDof'])
+
+        # 荷重ベクトルは共有メモリをそのまま参照し、強制変位だけはBoundaryの形式(Noneを含む配列)に戻す
+        bound = Boundary(spec['nodeNum'])
+        bound.vecForce = arrays['vecForce']
+        vecBoundDisp = arrays['vecBoundDisp']
+        bound.vecDisp = np.array([None if np.isnan(disp) else float(disp) for disp in vecBoundDisp], dtype=object)
+
+        return mesh, bound, blocks
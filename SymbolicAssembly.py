@@ -0,0 +1,115 @@
+import numpy as np
+import scipy.sparse as sparse
+
+# 全体マトリクスのシンボリック組み立て(非ゼロ構造と要素成分の格納先)を保持するクラス
+# 要素の接続関係だけから決まるため、座標や材料が変わっても同じ接続関係であれば使い回せる
+# 全体マトリクスは節点の自由度(3x3)のブロックを単位としたBSR形式で保持し、
+# 非ゼロ構造と格納先もブロック(節点の組)単位で持つ(成分単位のCSR形式より添字の配列が約1/9になる)
+# 組み立ては要素マトリクスの4x4個のブロックをBSR形式のdata配列に足し込むだけになる
+class SymbolicAssembly:
+    # コンストラクタ
+    # conn    : 要素を構成する節点のインデックス(0始まり、要素数 x 4のnp.array型)
+    # nodeNum : 節点数
+    # nodeDof : 節点の自由度(ブロックの大きさ)
+    def __init__(self, conn, nodeNum, nodeDof = 3):
+
+        # インスタンス変数を定義する
+        self.nodeNum = nodeNum                       # 節点数
+        self.nodeDof = nodeDof                       # 節点の自由度
+        self.dofNum = nodeNum * nodeDof              # 全体の自由度数
+        self.elemNum = len(conn)                     # 要素数
+
+        # 節点の組ごとに非ゼロ構造を求める
+        self.makePattern(np.asarray(conn, dtype=np.int64))
+
+    # 作成済みの非ゼロ構造と要素成分の格納先からシンボリック組み立てを作成する(配列は複製しない)
+    # indptr, indices : BSR形式(ブロック単位)の非ゼロ構造
+    # scatter         : 要素マトリクスの各ブロックの格納先(要素数 x 16)
+    # nodeNum         : 節点数
+    # nodeDof         : 節点の自由度
+    @classmethod
+    def fromArrays(cls, indptr, indices, scatter, nodeNum, nodeDof = 3):
+
+        symbolic = cls.__new__(cls)
+        symbolic.nodeNum = nodeNum
+        symbolic.nodeDof = nodeDof
+        symbolic.dofNum = nodeNum * nodeDof
+        symbolic.elemNum = len(scatter)
+        symbolic.blockNum = len(indices)
+        symbolic.nnz = nodeDof * nodeDof * len(indices)
+        symbolic.indptr = indptr
+        symbolic.indices = indices
+        symbolic.scatter = scatter
+
+        return symbolic
+
+    # 非ゼロ構造(indptr, indices)と要素のブロックの格納先(scatter)を作成する
+    def makePattern(self, conn):
+
+        elemNodeNum = conn.shape[1]
+
+        # 節点の組(行の節点, 列の節点)を重複なく並べる(行優先で並べるとBSR形式の順番になる)
+        vecNodeRows = np.repeat(conn, elemNodeNum, axis=1).ravel()
+        vecNodeCols = np.tile(conn, (1, elemNodeNum)).ravel()
+        vecKeys, vecNodeScatter = np.unique(vecNodeRows * self.nodeNum + vecNodeCols, return_inverse=True)
+        vecRows = vecKeys // self.nodeNum
+        vecCols = vecKeys % self.nodeNum
+
+        self.blockNum = len(vecKeys)                                 # 非ゼロのブロック数
+        self.nnz = self.nodeDof * self.nodeDof * self.blockNum       # 非ゼロ成分の数
+        indexType = np.int32 if self.blockNum < np.iinfo(np.int32).max else np.int64
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(vecRows, minlength=self.nodeNum))]).astype(indexType)
+        self.indices = vecCols.astype(indexType)
+
+        # 要素マトリクスの節点の組(a, b)のブロックの格納先(要素数 x 16)
+        self.scatter = vecNodeScatter.reshape(len(conn), -1).astype(indexType)
+
+    # 要素マトリクスを足し合わせたBSR形式の全体マトリクスを作成する
+    # matElems : 要素マトリクス(要素数 x 12 x 12)
+    def assemble(self, matElems):
+
+        vecData = self.makeData()
+        self.addElemMatrices(vecData, matElems)
+
+        return self.makeMatrix(vecData)
+
+    # BSR形式のdata配列(ブロック数 x 3 x 3)を0で作成する
+    def makeData(self):
+
+        return np.zeros((self.blockNum, self.nodeDof, self.nodeDof))
+
+    # 要素マトリクスの各成分のdata配列での位置(要素数 x 144)を、範囲の要素についてだけ展開する
+    # 要素マトリクスの(3*a+i, 3*b+j)成分は、節点の組(a, b)のブロックの(i, j)成分に入る
+    # (成分ごとの位置は一時配列で、保持するのはブロックの格納先だけ)
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    def makeElemPositions(self, elemRange = slice(None)):
+
+        nodeDof = self.nodeDof
+        scatter = self.scatter[elemRange]
+        elemNodeNum = int(np.sqrt(scatter.shape[1]))
+        a, i, b, j = np.meshgrid(np.arange(elemNodeNum), np.arange(nodeDof), np.arange(elemNodeNum),
+                                 np.arange(nodeDof), indexing='ij')
+        vecPos = np.take(nodeDof * nodeDof * scatter, (elemNodeNum * a + b).ravel(), axis=1)
+        vecPos += (nodeDof * i + j).ravel().astype(scatter.dtype)
+
+        return vecPos
+
+    # 要素マトリクスの成分をdata配列に足し込む
+    # vecData   : BSR形式のdata配列(ブロック数 x 3 x 3)
+    # matElems  : elemRangeの要素の要素マトリクス(要素数 x 12 x 12)
+    # elemRange : 対象とする要素の範囲(slice型、省略した場合は全要素)
+    # vecPos    : makeElemPositions(elemRange)の結果(Noneの場合はここで作成する)
+    def addElemMatrices(self, vecData, matElems, elemRange = slice(None), vecPos = None):
+
+        if vecPos is None:
+            vecPos = self.makeElemPositions(elemRange)
+        np.add.at(vecData.reshape(-1), vecPos.ravel(), np.asarray(matElems).ravel())
+
+    # data配列からBSR形式の全体マトリクスを作成する(非ゼロ構造の配列は共有する)
+    def makeMatrix(self, vecData):
+
+        matA = sparse.bsr_matrix((vecData, self.indices, self.indptr), shape=(self.dofNum, self.dofNum),
+                                 blocksize=(self.nodeDof, self.nodeDof), copy=False)
+        matA.has_sorted_indices = True
+
+        return matA
@@ -24,6 +24,9 @@ pyinstaller --onefile \
     --hidden-import numpy \
     --hidden-import scipy \
     --hidden-import scipy.linalg \
+    --hidden-import scipy.sparse \
+    --hidden-import scipy.sparse.linalg \
+    --hidden-import scipy.sparse.csgraph \
     --hidden-import matplotlib \
     --hidden-import matplotlib.backends.backend_tkagg \
     --hidden-import mpl_toolkits.mplot3d \
@@ -51,6 +54,20 @@ pyinstaller --onefile \
     --add-data "FEM.py:." \
     --add-data "Boundary.py:." \
     --add-data "Dmatrix.py:." \
+    --add-data "C3D4Batch.py:." \
+    --add-data "DirectSolver.py:." \
+    --add-data "PCGSolver.py:." \
+    --add-data "Mesh.py:." \
+    --add-data "NodeOrdering.py:." \
+    --add-data "SymbolicAssembly.py:." \
+    --add-data "ParametricSweep.py:." \
+    --add-data "SharedMesh.py:." \
+    --add-data "CASolver.py:." \
+    --add-data "AdaptiveSweep.py:." \
+    --add-data "ElementOperator.py:." \
+    --add-data "OutOfCoreMatrix.py:." \
+    --add-data "OutOfCoreAssembly.py:." \
+    --add-data "AnalysisPlanner.py:." \
     main.py
 
 # ビルド結果をチェック
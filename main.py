@@ -7,11 +7,15 @@ from matplotlib.figure import Figure
 from mpl_toolkits.mplot3d.art3d import Poly3DCollection
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import os
+import multiprocessing
+import queue
+import threading
 
-from Node import Node
-from C3D4 import C3D4
+from Mesh import Mesh
 from Boundary import Boundary
 from FEM import FEM
+from ParametricSweep import ParametricSweep
+from AdaptiveSweep import AdaptiveSweep
 from ProjectData import ProjectData
 from DocumentExporter import DocumentExporter
 from MaterialDatabase import MaterialDatabase
@@ -51,6 +55,9 @@ class EnhancedFEMTool:
         self.boundary_conditions = []  # 設定済み境界条件のリスト
         self.condition_id_counter = 0  # 条件IDカウンター
         
+        # 荷重ケース管理
+        self.load_cases = []  # [{'name': ケース名, 'loads': [[node_id, fx, fy, fz], ...]}]
+        
         # 選択管理
         self.selected_edges = []  # 選択されたエッジ（ノードペアのリスト）
         self.selected_faces = []  # 選択された面（ノード3つ組のリスト）
@@ -353,10 +360,70 @@ class EnhancedFEMTool:
         self.entry_scale.pack(pady=2)
         self.entry_scale.insert(0, "10000.0")
         
+        # 解き方の自動選択（組み立て前にメモリと計算時間を見積もり、メモリ上限に収まる最も速い解き方を選ぶ）
+        # 下の省メモリ解析、混合精度、ディスク上で組み立てるとは同時に選べない（どちらかを選ぶと他方を外す）
+        self.var_auto_solver = tk.BooleanVar(value=True)
+        tk.Checkbutton(analysis_frame, text="解き方を自動で選ぶ（メモリと計算時間を見積もる）",
+                      variable=self.var_auto_solver, command=self.on_auto_solver_changed).pack(anchor=tk.W)
+        
+        # 省メモリ解析（剛性マトリクスを組み立てず、要素ごとの計算で反復法を解く。メモリは約1/8、計算は遅くなる）
+        self.var_matrix_free = tk.BooleanVar(value=False)
+        tk.Checkbutton(analysis_frame, text="省メモリ解析（マトリクスを組み立てない反復法）",
+                      variable=self.var_matrix_free, command=self.on_matrix_free_changed).pack(anchor=tk.W)
+        
+        # 混合精度（単精度で分解して分解のメモリと時間を減らし、倍精度の残差による反復改良で精度を戻す）
+        self.var_mixed_precision = tk.BooleanVar(value=False)
+        tk.Checkbutton(analysis_frame, text="混合精度（単精度分解＋反復改良）",
+                      variable=self.var_mixed_precision, command=self.on_solver_option_changed).pack(anchor=tk.W)
+        
+        # ディスク上で組み立てる解析（メモリに収まらない大規模メッシュ向け。K_ffを一時ファイルに組み立てて反復法で解く）
+        self.var_out_of_core = tk.BooleanVar(value=False)
+        tk.Checkbutton(analysis_frame, text="ディスク上で組み立てる（大規模メッシュ向け）",
+                      variable=self.var_out_of_core, command=self.on_out_of_core_changed).pack(anchor=tk.W)
+        budget_frame = tk.Frame(analysis_frame)
+        budget_frame.pack(anchor=tk.W)
+        tk.Label(budget_frame, text="メモリ上限 [MB]（空欄: 実メモリの8割）:").pack(side=tk.LEFT)
+        self.entry_memory_budget = tk.Entry(budget_frame, width=8)
+        self.entry_memory_budget.pack(side=tk.LEFT, padx=2)
+        
+        # 直接法で分解する前の節点の並び替え（amd: フィルインを小さくする、rcm: バンド幅を小さくする、
+        # なし: ソルバーの並び替えに任せる）
+        ordering_frame = tk.Frame(analysis_frame)
+        ordering_frame.pack(anchor=tk.W)
+        tk.Label(ordering_frame, text="節点の並び替え（直接法）:").pack(side=tk.LEFT)
+        self.combo_ordering = ttk.Combobox(ordering_frame, width=6, state="readonly", values=("amd", "rcm", "なし"))
+        self.combo_ordering.pack(side=tk.LEFT, padx=2)
+        self.combo_ordering.set("amd")
+        
         # 解析実行ボタン
         tk.Button(analysis_frame, text="解析開始", command=self.start_analysis,
                  bg="lightgreen", font=("Arial", 12, "bold")).pack(pady=20)
         
+        # 解析計画（解き方ごとのメモリと計算時間の見積もり、選んだ解き方）
+        self.label_plan = tk.Label(analysis_frame, text="", font=("Courier", 8), justify=tk.LEFT, anchor=tk.W)
+        self.label_plan.pack(fill=tk.X, padx=5)
+        
+        # 荷重ケース（同じ形状・固定端で複数の荷重条件をまとめて解析）
+        case_frame = tk.LabelFrame(analysis_frame, text="荷重ケース", font=("Arial", 10, "bold"))
+        case_frame.pack(fill=tk.X, padx=5, pady=5)
+        
+        case_name_frame = tk.Frame(case_frame)
+        case_name_frame.pack(fill=tk.X, padx=5, pady=2)
+        tk.Label(case_name_frame, text="ケース名:").pack(side=tk.LEFT)
+        self.entry_load_case_name = tk.Entry(case_name_frame, width=15)
+        self.entry_load_case_name.pack(side=tk.LEFT, padx=2)
+        self.entry_load_case_name.insert(0, "ケース1")
+        tk.Button(case_name_frame, text="現在の荷重を登録", command=self.add_load_case).pack(side=tk.LEFT, padx=2)
+        
+        self.load_case_listbox = tk.Listbox(case_frame, height=4)
+        self.load_case_listbox.pack(fill=tk.X, padx=5, pady=2)
+        
+        case_button_frame = tk.Frame(case_frame)
+        case_button_frame.pack(fill=tk.X, padx=5, pady=2)
+        tk.Button(case_button_frame, text="全ケース削除", command=self.clear_load_cases).pack(side=tk.LEFT, padx=2)
+        tk.Button(case_button_frame, text="荷重ケース一括解析", bg="lightgreen",
+                 command=lambda: self.start_analysis(load_cases=self.load_cases)).pack(side=tk.LEFT, padx=2)
+        
         # 結果表示
         tk.Label(analysis_frame, text="解析結果", font=("Arial", 12, "bold")).pack(pady=(20,5))
         
@@ -448,6 +515,64 @@ class EnhancedFEMTool:
         self.param_z_step.insert(0, "25")
         tk.Label(z_frame, text="%").pack(side=tk.LEFT)
         
+        # 並列数設定
+        workers_frame = tk.Frame(param_settings_frame)
+        workers_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(workers_frame, text="並列数:", width=12).pack(side=tk.LEFT)
+        self.param_workers = tk.Entry(workers_frame, width=8)
+        self.param_workers.pack(side=tk.LEFT, padx=2)
+        self.param_workers.insert(0, str(os.cpu_count() or 1))
+        tk.Label(workers_frame, text="プロセス").pack(side=tk.LEFT)
+        
+        # ソルバー設定（直接法は並び替えを、反復法は前処理を使い回す）
+        # 近似再解析は基準形状の分解だけで各ケースを近似する（誤差が大きいケースは厳密に解き直す）
+        solver_frame = tk.Frame(param_settings_frame)
+        solver_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(solver_frame, text="ソルバー:", width=12).pack(side=tk.LEFT)
+        self.param_solver_type = tk.StringVar(value="direct")
+        tk.Radiobutton(solver_frame, text="直接法", variable=self.param_solver_type,
+                      value="direct", command=self.update_warm_start_state).pack(side=tk.LEFT)
+        tk.Radiobutton(solver_frame, text="反復法(PCG)", variable=self.param_solver_type,
+                      value="pcg", command=self.update_warm_start_state).pack(side=tk.LEFT)
+        tk.Radiobutton(solver_frame, text="近似再解析(CA)", variable=self.param_solver_type,
+                      value="reanalysis", command=self.update_warm_start_state).pack(side=tk.LEFT)
+        
+        # 反復法の初期値の予測（解いたケースの変位から初期値を予測し、前処理も使い回す。反復法のみ）
+        # 反復回数が減らないケースも多いため既定では使わない（ケースごとのログで0から解いた場合と比べられる）
+        warm_start_frame = tk.Frame(param_settings_frame)
+        warm_start_frame.pack(fill=tk.X, padx=10)
+        tk.Label(warm_start_frame, text="", width=12).pack(side=tk.LEFT)
+        self.param_warm_start = tk.BooleanVar(value=False)
+        self.check_warm_start = tk.Checkbutton(warm_start_frame, text="前のケースの解から初期値を予測する",
+                                               variable=self.param_warm_start, state=tk.DISABLED)
+        self.check_warm_start.pack(side=tk.LEFT)
+        
+        # サンプリング設定（格子は開始・終了・刻み、それ以外は開始～終了の範囲とケース数を使う）
+        # 適応的サンプリングは目標安全率を満たす最も軽い形状を、少ない解析回数で探す
+        sampling_frame = tk.Frame(param_settings_frame)
+        sampling_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(sampling_frame, text="サンプリング:", width=12).pack(side=tk.LEFT)
+        self.param_sampling = tk.StringVar(value="grid")
+        tk.Radiobutton(sampling_frame, text="格子", variable=self.param_sampling,
+                      value="grid").pack(side=tk.LEFT)
+        tk.Radiobutton(sampling_frame, text="ラテン超方格", variable=self.param_sampling,
+                      value="lhs").pack(side=tk.LEFT)
+        tk.Radiobutton(sampling_frame, text="Sobol", variable=self.param_sampling,
+                      value="sobol").pack(side=tk.LEFT)
+        tk.Radiobutton(sampling_frame, text="適応的(最軽量探索)", variable=self.param_sampling,
+                      value="adaptive").pack(side=tk.LEFT)
+        
+        sample_count_frame = tk.Frame(param_settings_frame)
+        sample_count_frame.pack(fill=tk.X, padx=10, pady=5)
+        tk.Label(sample_count_frame, text="ケース数:", width=12).pack(side=tk.LEFT)
+        self.param_sample_count = tk.Entry(sample_count_frame, width=8)
+        self.param_sample_count.pack(side=tk.LEFT, padx=2)
+        self.param_sample_count.insert(0, "32")
+        tk.Label(sample_count_frame, text="目標安全率:", width=10).pack(side=tk.LEFT)
+        self.param_target_safety = tk.Entry(sample_count_frame, width=8)
+        self.param_target_safety.pack(side=tk.LEFT, padx=2)
+        self.param_target_safety.insert(0, "2.0")
+        
         # 実行ボタン
         tk.Button(param_settings_frame, text="パラメトリック解析実行", 
                  command=self.run_parametric_analysis, bg="#FF9800", fg="white", 
@@ -539,6 +664,11 @@ class EnhancedFEMTool:
         self.vib_num_modes.insert(0, "10")
         tk.Label(mode_frame, text="個").pack(side=tk.LEFT)
         
+        # 質量マトリクスの種類
+        self.vib_lumped_mass = tk.BooleanVar(value=False)
+        tk.Checkbutton(params_frame, text="集中質量マトリクスを使用（高速）",
+                      variable=self.vib_lumped_mass).pack(anchor=tk.W, pady=2)
+        
         # 解析実行ボタン
         tk.Button(vib_settings_frame, text="振動解析実行", 
                  command=self.run_vibration_analysis, bg="#9C27B0", fg="white", 
@@ -819,17 +949,12 @@ class EnhancedFEMTool:
     def read_stl(self, file_path):
         """STLファイルを読み込んでメッシュ生成"""
         stl_mesh = mesh.Mesh.from_file(file_path)
-        points = np.unique(stl_mesh.vectors.reshape(-1, 3), axis=0)
         
-        faces = []
-        for triangle in stl_mesh.vectors:
-            face = []
-            for vertex in triangle:
-                index = np.where((points == vertex).all(axis=1))[0][0]
-                face.append(index)
-            faces.append(face)
+        # 重複する頂点をまとめ、三角形の頂点番号は頂点ごとの逆引きで求める（頂点数に比例する時間とメモリで済む）
+        points, inverse = np.unique(stl_mesh.vectors.reshape(-1, 3), axis=0, return_inverse=True)
+        faces = inverse.reshape(-1, 3)
         
-        tet = tetgen.TetGen(points, np.array(faces))
+        tet = tetgen.TetGen(points, faces)
         nodes, elems = tet.tetrahedralize(order=1)
         
         return nodes, elems
@@ -1576,12 +1701,56 @@ class EnhancedFEMTool:
             self.canvas.draw()
     
     
-    def start_analysis(self):
-        """解析を開始"""
+    def get_current_loads(self):
+        """現在設定されている荷重を等価点荷重のリスト [node_id, fx, fy, fz] として取得"""
+        if self.load_manager:
+            return [list(load) for load in self.load_manager.get_all_equivalent_point_loads()]
+        return [list(force) for force in self.project_data.applied_forces]
+    
+    def add_load_case(self):
+        """現在の荷重を名前付きの荷重ケースとして登録"""
+        loads = self.get_current_loads()
+        if len(loads) == 0:
+            messagebox.showerror("エラー", "荷重が設定されていません。")
+            return
+        
+        name = self.entry_load_case_name.get().strip() or f"ケース{len(self.load_cases) + 1}"
+        self.load_cases.append({'name': name, 'loads': loads})
+        self.load_case_listbox.insert(tk.END, f"{name} (等価点荷重{len(loads)}個)")
+        
+        # 次のケース名を用意
+        self.entry_load_case_name.delete(0, tk.END)
+        self.entry_load_case_name.insert(0, f"ケース{len(self.load_cases) + 1}")
+    
+    def clear_load_cases(self):
+        """登録済みの荷重ケースをすべて削除"""
+        self.load_cases = []
+        self.load_case_listbox.delete(0, tk.END)
+    
+    def make_load_case_matrix(self, load_cases, node_count):
+        """荷重ケースのリストから荷重行列（自由度数 x ケース数）を作成"""
+        load_matrix = np.zeros((node_count * 3, len(load_cases)))
+        for i, case in enumerate(load_cases):
+            for load in case['loads']:
+                node_id = int(load[0])
+                load_matrix[node_id * 3:node_id * 3 + 3, i] += load[1:4]
+        return load_matrix
+    
+    def start_analysis(self, load_cases=None):
+        """解析を開始
+        
+        Args:
+            load_cases: 荷重ケースのリスト。指定した場合は全ケースを一度の分解でまとめて解析し、
+                        最大応力となったケースを結果として表示する
+        """
         if self.nodes is None or self.elems is None:
             messagebox.showerror("エラー", "メッシュが読み込まれていません")
             return
         
+        if load_cases is not None and len(load_cases) == 0:
+            messagebox.showerror("エラー", "荷重ケースが登録されていません")
+            return
+        
         # 前回の解析結果をクリア
         self.clear_analysis_results()
         
@@ -1599,15 +1768,8 @@ class EnhancedFEMTool:
             # 重力ベクトル
             vec_grav = np.array([0.0, 0.0, -9.81]) if gravity_enabled else np.array([0.0, 0.0, 0.0])
             
-            # FEMノードと要素を作成
-            fem_nodes = []
-            for i in range(len(self.nodes)):
-                fem_nodes.append(Node(i + 1, self.nodes[i][0], self.nodes[i][1], self.nodes[i][2]))
-            
-            fem_elems = []
-            for i in range(len(self.elems)):
-                elem_nodes = [fem_nodes[self.elems[i][j]] for j in range(4)]
-                fem_elems.append(C3D4(i + 1, elem_nodes, young, poisson, density, vec_grav))
+            # 解析用メッシュを作成
+            fem_mesh = Mesh(self.nodes, self.elems, young, poisson, density, vecGravity=vec_grav)
             
             # 境界条件を設定
             boundary = Boundary(len(self.nodes))
@@ -1660,8 +1822,59 @@ class EnhancedFEMTool:
                     print(f"  荷重 - ノード{force[0]+1}: ({force[1]:.2f}, {force[2]:.2f}, {force[3]:.2f}) N")
             
             # FEM解析実行
-            fem = FEM(fem_nodes, fem_elems, boundary)
-            fem.analysis()
+            # 分解前に節点を解析タブで選んだ方法で並び替え、並び替え前後のバンド幅・予測フィルインをコンソールに出力する
+            fem = FEM(fem_mesh, boundary)
+            fem.ordering = self.get_ordering()
+            fem.precision = "single" if self.var_mixed_precision.get() else "double"
+            fem.memoryBudget = self.get_memory_budget()
+            if self.var_auto_solver.get():
+                # 組み立て前にメモリと計算時間を見積もり、上限に収まる最も速い解き方を選ぶ
+                # （荷重ケースの一括解析は直接法だけが使える。上限に収まらない場合は例外で中止する）
+                paths = ["dense", "direct", "direct_single"] if load_cases else None
+                try:
+                    fem.planAnalysis(paths)
+                finally:
+                    if fem.plan is not None:
+                        self.show_analysis_plan(fem.plan)
+            load_case_results = None
+            if load_cases:
+                # 全荷重ケースを一度の分解でまとめて解く
+                load_matrix = self.make_load_case_matrix(load_cases, len(self.nodes))
+                case_disp, case_rf, case_max_stress = fem.loadCaseAnalysis(load_matrix)
+                
+                load_case_results = []
+                for i, case in enumerate(load_cases):
+                    case_max_disp = np.max(np.linalg.norm(case_disp[:, i].reshape(-1, 3), axis=1))
+                    load_case_results.append({
+                        'name': case['name'],
+                        'max_displacement': case_max_disp,
+                        'max_stress': case_max_stress[i],
+                        'safety_factor': self.project_data.calculate_safety_factor(
+                            case_max_stress[i], self.current_yield_strength)
+                    })
+                
+                # 最大応力となったケースを代表ケースとして表示・出力する
+                worst = int(np.argmax(case_max_stress))
+                boundary.vecForce = load_matrix[:, worst].copy()
+                fem.vecDisp = case_disp[:, worst]
+                fem.vecRF = case_rf[:, worst]
+                print(f"荷重ケース一括解析完了: {len(load_cases)}ケース, 最大応力ケース = {load_cases[worst]['name']}")
+            else:
+                if not self.var_auto_solver.get():
+                    fem.matrixFree = self.var_matrix_free.get()
+                    fem.outOfCore = self.var_out_of_core.get()
+                fem.analysis()
+                if fem.matrixFree:
+                    print(f"省メモリ解析: 反復回数 {fem.solver.info['iterations']}回, "
+                          f"作用素のメモリ {fem.solver.matA.nbytes/1e6:.1f} MB")
+                elif fem.outOfCore:
+                    print(f"ディスク上の組み立て: 一時ファイル {fem.solver.matA.diskBytes/1e6:.1f} MB, "
+                          f"メモリ上の配列 {fem.solver.matA.nbytes/1e6:.1f} MB, "
+                          f"反復回数 {fem.solver.info['iterations']}回")
+                elif fem.iterative:
+                    print(f"反復法(PCG): 反復回数 {fem.solver.info['iterations']}回")
+            if not fem.nodeOrdering is None:
+                print(fem.nodeOrdering.formatReport(fem.nodeDof))
             
             # 結果をテキスト出力
             fem.outputTxt("analysis_result")
@@ -1690,6 +1903,9 @@ class EnhancedFEMTool:
             
             # 結果を表示
             self.display_results()
+            self.display_solver_info(fem)
+            if load_case_results:
+                self.display_load_case_results(load_case_results)
             
             # 変形形状を描画
             self.draw_deformed_shape(displacement)
@@ -1755,6 +1971,89 @@ class EnhancedFEMTool:
         
         self.result_text.insert(tk.END, summary)
     
+    def update_warm_start_state(self):
+        """反復法を選んだ場合だけ、初期値の予測を選べるようにする"""
+        self.check_warm_start.config(state=tk.NORMAL if self.param_solver_type.get() == "pcg" else tk.DISABLED)
+    
+    def on_auto_solver_changed(self):
+        """解き方の自動選択を選んだら、個別の解き方の設定を外す（自動選択の結果で上書きされるため）"""
+        if self.var_auto_solver.get():
+            self.var_matrix_free.set(False)
+            self.var_mixed_precision.set(False)
+            self.var_out_of_core.set(False)
+    
+    def on_solver_option_changed(self):
+        """個別の解き方の設定を選んだら、解き方の自動選択を外す"""
+        if self.var_matrix_free.get() or self.var_mixed_precision.get() or self.var_out_of_core.get():
+            self.var_auto_solver.set(False)
+    
+    def on_matrix_free_changed(self):
+        """省メモリ解析を選んだら、ディスク上で組み立てる解析を外す（どちらか一方の解き方しか使えないため）"""
+        if self.var_matrix_free.get():
+            self.var_out_of_core.set(False)
+        self.on_solver_option_changed()
+    
+    def on_out_of_core_changed(self):
+        """ディスク上で組み立てる解析を選んだら、省メモリ解析を外す（どちらか一方の解き方しか使えないため）"""
+        if self.var_out_of_core.get():
+            self.var_matrix_free.set(False)
+        self.on_solver_option_changed()
+    
+    def get_ordering(self):
+        """節点の並び替えの選択をFEM.orderingの値に変換（なしの場合はNoneで、ソルバーの並び替えを使う）"""
+        ordering = self.combo_ordering.get()
+        return None if ordering == "なし" else ordering
+    
+    def get_memory_budget(self):
+        """メモリ上限の入力[MB]をバイトに変換（空欄の場合はNoneで、解析計画では実メモリの8割を上限にする）"""
+        text = self.entry_memory_budget.get().strip()
+        return float(text) * 1e6 if text else None
+    
+    def show_analysis_plan(self, plan):
+        """解析計画（解き方ごとの見積もりと選んだ解き方）を解析タブとコンソールに表示"""
+        text = plan.formatPlan()
+        print(text)
+        self.label_plan.config(text=text)
+        self.root.update_idletasks()
+    
+    def display_solver_info(self, fem):
+        """連立方程式の解き方と、混合精度の場合は反復改良の最終相対残差を解析結果テキストに追加表示"""
+        info = fem.solver.info
+        summary = "\n\nソルバー\n========\n"
+        if fem.plan is not None:
+            selected = fem.plan.selected
+            summary += (f"- 自動選択: {selected['label']} "
+                        f"(見積もり {selected['time']:.3g} s, {selected['memory']/1e6:.0f} MB)\n")
+        if fem.matrixFree:
+            summary += f"- 省メモリ反復法: {info['iterations']}回, 相対残差 {info['relativeResidual']:.2e}\n"
+        elif fem.outOfCore:
+            summary += f"- ディスク上で組み立てた反復法: {info['iterations']}回, 相対残差 {info['relativeResidual']:.2e}\n"
+            summary += f"- 一時ファイル: {fem.solver.matA.diskBytes/1e6:.1f} MB (解析後に削除)\n"
+        elif fem.iterative:
+            summary += f"- 反復法(PCG): {info['iterations']}回, 相対残差 {info['relativeResidual']:.2e}\n"
+        elif info.get('precision') == "single":
+            summary += f"- 混合精度: 反復改良 {info['refinementSteps']}回\n"
+            summary += f"- 最終相対残差: {info['relativeResidual']:.2e}\n"
+            if info['precisionFallback']:
+                summary += "- 単精度では収束しなかったため倍精度で解き直しました\n"
+        else:
+            summary += "- 直接法(倍精度)\n"
+        
+        self.result_text.insert(tk.END, summary)
+    
+    def display_load_case_results(self, load_case_results):
+        """荷重ケースごとの結果を解析結果テキストに追加表示"""
+        summary = "\n\n荷重ケース別結果\n================\n"
+        for result in load_case_results:
+            summary += f"\n[{result['name']}]\n"
+            summary += f"- 最大変位: {result['max_displacement']:.6f} m\n"
+            summary += f"- 最大von Mises応力: {result['max_stress']/1e6:.2f} MPa\n"
+            if result['safety_factor'] is not None:
+                summary += f"- 安全率: {result['safety_factor']:.2f}\n"
+        summary += "\n(変形表示と analysis_result.txt は最大応力のケース)\n"
+        
+        self.result_text.insert(tk.END, summary)
+    
     def draw_deformed_shape(self, displacement, custom_scale=None):
         """変形後の形状を描画"""
         if self.display_nodes is None or self.elems is None:
@@ -2022,28 +2321,63 @@ class EnhancedFEMTool:
             z_start = float(self.param_z_start.get())
             z_end = float(self.param_z_end.get())
             z_step = float(self.param_z_step.get())
+            workers = int(self.param_workers.get())
+            sampling = self.param_sampling.get()
+            sample_count = int(self.param_sample_count.get())
+            target_safety = float(self.param_target_safety.get())
+            if sample_count < 1 or target_safety <= 0:
+                raise ValueError
         except ValueError:
             messagebox.showerror("エラー", "スケール設定に無効な値があります。")
             return
         
-        # 元の座標を保存（解析用メッシュから）
-        original_nodes = self.base_nodes.copy()
+        try:
+            # 材料物性を取得
+            young = float(self.entry_young.get())
+            poisson = float(self.entry_poisson.get())
+            density = float(self.entry_density.get())
+            gravity = self.var_gravity.get()
+        except ValueError:
+            messagebox.showerror("エラー", "材料物性に無効な値があります。")
+            return
         
         # 結果テーブルをクリア
         for item in self.param_tree.get_children():
             self.param_tree.delete(item)
         
-        # スケール範囲を生成
-        x_scales = [x_start + i * x_step for i in range(int((x_end - x_start) / x_step) + 1) if x_start + i * x_step <= x_end]
-        y_scales = [y_start + i * y_step for i in range(int((y_end - y_start) / y_step) + 1) if y_start + i * y_step <= y_end]
-        z_scales = [z_start + i * z_step for i in range(int((z_end - z_start) / z_step) + 1) if z_start + i * z_step <= z_end]
+        # スケールのケースを生成
+        bounds = [(x_start, x_end), (y_start, y_end), (z_start, z_end)]
+        if sampling == "grid":
+            x_scales = ParametricSweep.makeScaleRange(x_start, x_end, x_step)
+            y_scales = ParametricSweep.makeScaleRange(y_start, y_end, y_step)
+            z_scales = ParametricSweep.makeScaleRange(z_start, z_end, z_step)
+            cases = ParametricSweep.makeGridCases(x_scales, y_scales, z_scales)
+        elif sampling == "lhs":
+            cases = ParametricSweep.makeLatinHypercubeCases(bounds, sample_count)
+        elif sampling == "sobol":
+            cases = ParametricSweep.makeSobolCases(bounds, sample_count)
+        else:
+            cases = []
         
-        total_cases = len(x_scales) * len(y_scales) * len(z_scales)
+        # 適応的サンプリングのケース数は上限（改善が見込めなくなった時点で終了する）
+        total_cases = sample_count if sampling == "adaptive" else len(cases)
         
         if total_cases > 100:
             if not messagebox.askyesno("確認", f"解析ケース数が{total_cases}件になります。実行しますか？"):
                 return
         
+        # 解析エンジンを作成（基準メッシュ、材料、境界条件はGUIから一度だけ読み取る）
+        gravity_vec = np.array([0.0, 0.0, -9.81]) if gravity else None
+        base_mesh = Mesh(self.base_nodes, self.elems, young, poisson, density, vecGravity=gravity_vec)
+        sweep = ParametricSweep(base_mesh, self.make_parametric_boundary(base_mesh.nodeNum), workers,
+                                solverType=self.param_solver_type.get(),
+                                warmStart=self.param_warm_start.get() and self.param_solver_type.get() == "pcg")
+        self.parametric_sweep = sweep
+        adaptive = None
+        if sampling == "adaptive":
+            allowable_stress = self.current_yield_strength / target_safety
+            adaptive = AdaptiveSweep(sweep, bounds, allowable_stress, maxCases=sample_count)
+        
         # プログレスバー表示
         progress_window = tk.Toplevel(self.root)
         progress_window.title("パラメトリック解析中...")
@@ -2057,73 +2391,157 @@ class EnhancedFEMTool:
         progress_bar = ttk.Progressbar(progress_window, length=300, mode='determinate')
         progress_bar.pack(pady=10)
         progress_bar['maximum'] = total_cases
+        progress_window.protocol("WM_DELETE_WINDOW", lambda: None)   # 解析が終わるまで閉じない
+        progress_window.update()
         
-        # パラメトリック解析実行
+        # パラメトリック解析実行（解析は別スレッドで行い、終わったケースから順にキューで受け取る）
+        # Tkのメインスレッドは受け取った結果でテーブルと進捗を更新するだけにし、解析中もウィンドウを応答させる
+        print(f"パラメトリック解析開始: {total_cases}ケース, 並列数 {sweep.getWorkerNum(total_cases)}")
         results = []
-        case_num = 0
+        warm_iterations = 0
+        cold_iterations = 0
+        approximate_count = 0
+        result_queue = queue.Queue()
         
-        for x_scale in x_scales:
-            for y_scale in y_scales:
-                for z_scale in z_scales:
-                    case_num += 1
-                    
-                    # プログレス更新
-                    progress_label.config(text=f"ケース {case_num}/{total_cases} (X:{x_scale}%, Y:{y_scale}%, Z:{z_scale}%)")
-                    progress_bar['value'] = case_num
-                    progress_window.update()
-                    
-                    try:
-                        # スケール適用（解析用メッシュで作業）
-                        scaled_nodes = original_nodes.copy()
-                        self.apply_scale_to_nodes(scaled_nodes, x_scale/100, y_scale/100, z_scale/100)
-                        
-                        # 解析実行（スケールされたメッシュで）
-                        result = self.analyze_single_case_with_nodes(scaled_nodes)
-                        if result[0] is not None and len(result) == 5:
-                            max_stress, safety_factor, volume_ratio, displacement, max_displacement = result
-                        else:
-                            max_stress, safety_factor, volume_ratio = result[0], result[1], result[2]
-                            displacement, max_displacement = None, None
-                        
-                        # 結果保存
-                        results.append({
-                            'case': case_num,
-                            'x_scale': x_scale,
-                            'y_scale': y_scale,
-                            'z_scale': z_scale,
-                            'max_stress': max_stress,
-                            'safety_factor': safety_factor,
-                            'volume_ratio': volume_ratio,
-                            'displacement': displacement,
-                            'max_displacement': max_displacement
-                        })
-                        
-                        # テーブルに追加
-                        self.param_tree.insert("", "end", values=(
-                            case_num,
-                            f"{x_scale:.0f}%",
-                            f"{y_scale:.0f}%", 
-                            f"{z_scale:.0f}%",
-                            f"{max_stress/1e6:.2f}" if max_stress else "N/A",
-                            f"{safety_factor:.2f}" if safety_factor else "N/A",
-                            f"{volume_ratio:.3f}"
-                        ))
-                        
-                    except Exception as e:
-                        print(f"ケース {case_num} でエラー: {e}")
-                        continue
+        def run_sweep():
+            """解析スレッド: 終わったケースの結果をキューに入れる（最後に完了またはエラーを入れる）"""
+            try:
+                for result in (adaptive.run() if not adaptive is None else sweep.run(cases)):
+                    result_queue.put(("result", result))
+                result_queue.put(("done", None))
+            except Exception as e:
+                result_queue.put(("error", e))
+        
+        def add_result(result):
+            """1ケースの結果で進捗、ログ、結果テーブルを更新する"""
+            nonlocal warm_iterations, cold_iterations, approximate_count
+            case_num = result['case']
+            x_scale, y_scale, z_scale = result['x_scale'], result['y_scale'], result['z_scale']
+            
+            # プログレス更新
+            progress_label.config(text=f"{len(results) + 1}/{total_cases}ケース完了 (ケース{case_num} X:{x_scale}%, Y:{y_scale}%, Z:{z_scale}%)")
+            progress_bar['value'] = len(results) + 1
+            
+            # ケースごとの計算時間の内訳、反復回数を出力する
+            print(ParametricSweep.formatCaseLog(result))
+            solver_info = result['solver_info']
+            if solver_info.get('warmStarted') and not solver_info.get('coldIterations') is None:
+                warm_iterations += solver_info['iterations']
+                cold_iterations += solver_info['coldIterations']
+            approximate_count += result['approximate']
+            
+            max_stress = result['max_stress']
+            safety_factor = self.project_data.calculate_safety_factor(max_stress, self.current_yield_strength)
+            volume_ratio = result['volume_ratio']
+            
+            # 結果保存
+            results.append({
+                'case': case_num,
+                'x_scale': x_scale,
+                'y_scale': y_scale,
+                'z_scale': z_scale,
+                'max_stress': max_stress,
+                'safety_factor': safety_factor,
+                'volume_ratio': volume_ratio,
+                'displacement': result['displacement'],
+                'max_displacement': result['max_displacement'],
+                'approximate': result['approximate']
+            })
+            
+            # テーブルに追加（近似再解析で近似したケースの応力には「≈」を付ける）
+            stress_mark = "≈" if result['approximate'] else ""
+            self.param_tree.insert("", "end", values=(
+                case_num,
+                f"{round(x_scale, 1):g}%",
+                f"{round(y_scale, 1):g}%", 
+                f"{round(z_scale, 1):g}%",
+                f"{stress_mark}{max_stress/1e6:.2f}" if max_stress else "N/A",
+                f"{safety_factor:.2f}" if safety_factor else "N/A",
+                f"{volume_ratio:.3f}"
+            ))
         
-        # 表示メッシュをリセット（元の形状に戻す）
-        self.reset_display_mesh()
-        self.draw_mesh()
+        def poll_results():
+            """キューに届いた結果を画面に反映し、解析が終わるまで一定間隔で繰り返す"""
+            while True:
+                try:
+                    kind, value = result_queue.get_nowait()
+                except queue.Empty:
+                    self.root.after(100, poll_results)
+                    return
+                if kind == "result":
+                    add_result(value)
+                elif kind == "error":
+                    progress_window.destroy()
+                    messagebox.showerror("エラー", f"パラメトリック解析に失敗しました: {value}")
+                    return
+                else:
+                    finish_sweep()
+                    return
         
-        # プログレスウィンドウを閉じる
-        progress_window.destroy()
+        def finish_sweep():
+            """全ケースの解析が終わったら、集計を出力して結果を保存する"""
+            
+            # 表示メッシュをリセット（元の形状に戻す）
+            self.reset_display_mesh()
+            self.draw_mesh()
+            
+            # プログレスウィンドウを閉じる
+            progress_window.destroy()
+            
+            if sweep.solverType == "pcg" and cold_iterations > 0:
+                change = warm_iterations - cold_iterations
+                print(f"初期値を予測したケースの反復回数: 合計{warm_iterations}回 "
+                      f"(0から解いた直近のケースの回数では合計{cold_iterations}回、" +
+                      ("同じ" if change == 0 else f"{'増加' if change > 0 else '削減'} {abs(change)}回") + ")")
+            elif sweep.solverType == "reanalysis":
+                print(f"近似再解析: {approximate_count}/{len(results)}ケースを近似、"
+                      f"{len(results) - approximate_count}ケースを厳密に解析")
+            
+            # 結果保存（ケース番号順に並べる）
+            results.sort(key=lambda r: r['case'])
+            self.parametric_results = results
+            
+            message = f"パラメトリック解析が完了しました。\n{len(results)}ケースの解析を実行しました。"
+            if not adaptive is None:
+                best = adaptive.best
+                if best is None:
+                    message += f"\n\n安全率{target_safety}を満たす形状は見つかりませんでした。"
+                else:
+                    message += (f"\n\n安全率{target_safety}を満たす最も軽い形状: ケース{best['case']}\n"
+                                f"X:{best['x_scale']:.1f}%, Y:{best['y_scale']:.1f}%, Z:{best['z_scale']:.1f}%\n"
+                                f"最大応力: {best['max_stress']/1e6:.2f} MPa, 体積比: {best['volume_ratio']:.3f}")
+                
+                    # テーブルで最軽量のケースを選択する
+                    for item in self.param_tree.get_children():
+                        if int(self.param_tree.item(item, 'values')[0]) == best['case']:
+                            self.param_tree.selection_set(item)
+                            self.param_tree.see(item)
+                            break
+                if not adaptive.converged:
+                    message += "\n(ケース数の上限で終了しました)"
+            
+            messagebox.showinfo("完了", message)
+            
+        threading.Thread(target=run_sweep, daemon=True).start()
+        self.root.after(100, poll_results)
+    
+    def make_parametric_boundary(self, node_count):
+        """パラメトリック解析用の境界条件を作成（固定端と荷重は全ケース共通）"""
+        boundary = Boundary(node_count)
         
-        # 結果保存
-        self.parametric_results = results
+        # 固定端設定
+        for node_id in self.project_data.fixed_nodes:
+            boundary.addSPC(node_id + 1, 0.0, 0.0, 0.0)
         
-        messagebox.showinfo("完了", f"パラメトリック解析が完了しました。\n{len(results)}ケースの解析を実行しました。")
+        # 荷重設定（LoadManagerが等価点荷重をすべて管理している場合はそちらを使い、重複適用を避ける）
+        if self.load_manager:
+            for load in self.load_manager.get_all_equivalent_point_loads():
+                boundary.addForce(load[0] + 1, load[1], load[2], load[3])
+        else:
+            for force in self.project_data.applied_forces:
+                boundary.addForce(force[0] + 1, force[1], force[2], force[3])
+        
+        return boundary
     
     def apply_scale_to_nodes(self, nodes, x_scale, y_scale, z_scale):
         """指定されたノード座標にスケールを適用"""
@@ -2168,21 +2586,12 @@ class EnhancedFEMTool:
             density = float(self.entry_density.get())
             gravity = self.var_gravity.get()
             
-            # ノードオブジェクト作成
-            nodes = []
-            for i, coord in enumerate(self.nodes):
-                nodes.append(Node(i + 1, coord[0], coord[1], coord[2]))
-            
-            # 要素オブジェクト作成
-            elements = []
+            # 解析用メッシュ作成
             gravity_vec = np.array([0.0, 0.0, -9.81]) if gravity else None
-            
-            for i, elem in enumerate(self.elems):
-                elem_nodes = [nodes[j] for j in elem]
-                elements.append(C3D4(i + 1, elem_nodes, young, poisson, density, gravity_vec))
+            fem_mesh = Mesh(self.nodes, self.elems, young, poisson, density, vecGravity=gravity_vec)
             
             # 境界条件作成
-            boundary = Boundary(len(nodes))
+            boundary = Boundary(fem_mesh.nodeNum)
             
             # 固定端設定
             for node_id in self.project_data.fixed_nodes:
@@ -2201,7 +2610,7 @@ class EnhancedFEMTool:
                     boundary.addForce(node_id, fx, fy, fz)
             
             # FEM解析実行
-            fem = FEM(nodes, elements, boundary)
+            fem = FEM(fem_mesh, boundary)
             displacement_vec, _ = fem.analysis()
             
             # 変位を2次元配列に変換
@@ -2227,74 +2636,6 @@ class EnhancedFEMTool:
             print(f"詳細: {traceback.format_exc()}")
             return None, None, 1.0, None, None
     
-    def analyze_single_case_with_nodes(self, nodes):
-        """指定されたノードで単一ケースの解析実行"""
-        try:
-            # 解析実行（既存のメソッドを利用）
-            young = float(self.entry_young.get())
-            poisson = float(self.entry_poisson.get())
-            density = float(self.entry_density.get())
-            gravity = self.var_gravity.get()
-            
-            # ノードオブジェクト作成
-            node_objects = []
-            for i, coord in enumerate(nodes):
-                node_objects.append(Node(i + 1, coord[0], coord[1], coord[2]))
-            
-            # 要素オブジェクト作成
-            elements = []
-            gravity_vec = np.array([0.0, 0.0, -9.81]) if gravity else None
-            
-            for i, elem in enumerate(self.elems):
-                elem_nodes = [node_objects[j] for j in elem]
-                elements.append(C3D4(i + 1, elem_nodes, young, poisson, density, gravity_vec))
-            
-            # 境界条件作成
-            boundary = Boundary(len(node_objects))
-            
-            # 固定端設定
-            for node_id in self.project_data.fixed_nodes:
-                boundary.addSPC(node_id, 0.0, 0.0, 0.0)
-            
-            # 荷重設定
-            for force in self.project_data.applied_forces:
-                boundary.addForce(force[0], force[1], force[2], force[3])
-            
-            # LoadManagerからの荷重も適用
-            if self.load_manager:
-                equivalent_loads = self.load_manager.get_all_equivalent_point_loads()
-                for load in equivalent_loads:
-                    node_id = load[0] + 1  # ノード番号は0ベースから1ベースに変換
-                    fx, fy, fz = load[1], load[2], load[3]
-                    boundary.addForce(node_id, fx, fy, fz)
-            
-            # FEM解析実行
-            fem = FEM(node_objects, elements, boundary)
-            displacement_vec, _ = fem.analysis()
-            
-            # 変位を2次元配列に変換
-            displacement = fem.outputDisplacement()
-            
-            # 応力計算
-            max_stress, _, _ = fem.calculateMaxStress()
-            
-            # 安全率計算
-            safety_factor = self.project_data.calculate_safety_factor(max_stress, self.current_yield_strength)
-            
-            # 体積比計算（指定されたノードで）
-            volume_ratio = self.calculate_volume_ratio_with_nodes(nodes)
-            
-            # 変位の最大値計算
-            max_displacement = np.max([np.linalg.norm(disp) for disp in displacement])
-            
-            return max_stress, safety_factor, volume_ratio, displacement, max_displacement
-            
-        except Exception as e:
-            import traceback
-            print(f"解析エラー: {e}")
-            print(f"詳細: {traceback.format_exc()}")
-            return None, None, 1.0, None, None
-    
     def calculate_volume_ratio(self):
         """現在の形状の体積比を計算"""
         if not hasattr(self, 'original_volume') or self.original_volume == 0:
@@ -2330,41 +2671,6 @@ class EnhancedFEMTool:
         
         return total_volume
     
-    def calculate_volume_ratio_with_nodes(self, nodes):
-        """指定されたノードで体積比を計算"""
-        if not hasattr(self, 'original_volume') or self.original_volume == 0:
-            return 1.0
-        
-        current_volume = self.calculate_mesh_volume_with_nodes(nodes)
-        return current_volume / self.original_volume
-    
-    def calculate_mesh_volume_with_nodes(self, nodes):
-        """指定されたノードでメッシュの体積を計算"""
-        if nodes is None or self.elems is None:
-            return 0.0
-        
-        # numpy配列であることを確認
-        if not isinstance(nodes, np.ndarray):
-            nodes_array = np.array(nodes)
-        else:
-            nodes_array = nodes
-        
-        total_volume = 0.0
-        for elem in self.elems:
-            try:
-                # 四面体の体積計算
-                tetra = nodes_array[elem]
-                v1 = tetra[1] - tetra[0]
-                v2 = tetra[2] - tetra[0] 
-                v3 = tetra[3] - tetra[0]
-                volume = abs(np.dot(v1, np.cross(v2, v3))) / 6.0
-                total_volume += volume
-            except Exception as e:
-                print(f"体積計算エラー (要素 {elem}): {e}")
-                continue
-        
-        return total_volume
-    
     def display_selected_case(self):
         """選択されたケースを表示"""
         selection = self.param_tree.selection()
@@ -2385,6 +2691,13 @@ class EnhancedFEMTool:
                 self.apply_scale(result['x_scale']/100, result['y_scale']/100, result['z_scale']/100)
                 self.draw_mesh()
                 
+                # スイープでは変位を保持しないため、選択したケースだけを解析し直して変位を求める
+                if result.get('displacement') is None and result['max_stress'] is not None and \
+                   getattr(self, 'parametric_sweep', None) is not None:
+                    scales = (result['x_scale'], result['y_scale'], result['z_scale'])
+                    case_result = self.parametric_sweep.analyzeCase(case_num, scales, keepDisplacement=True)
+                    result['displacement'] = case_result['displacement']
+                
                 # 変形表示が可能な場合は変形も表示
                 if result.get('displacement') is not None:
                     # 変形表示スケールの入力ダイアログを表示
@@ -2452,7 +2765,7 @@ class EnhancedFEMTool:
                 import csv
                 with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
                     fieldnames = ['Case', 'X_Scale[%]', 'Y_Scale[%]', 'Z_Scale[%]', 
-                                'Max_Stress[MPa]', 'Safety_Factor', 'Volume_Ratio']
+                                'Max_Stress[MPa]', 'Safety_Factor', 'Volume_Ratio', 'Approximate']
                     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
                     
                     writer.writeheader()
@@ -2464,7 +2777,8 @@ class EnhancedFEMTool:
                             'Z_Scale[%]': result['z_scale'],
                             'Max_Stress[MPa]': result['max_stress']/1e6 if result['max_stress'] else 'N/A',
                             'Safety_Factor': result['safety_factor'] if result['safety_factor'] else 'N/A',
-                            'Volume_Ratio': result['volume_ratio']
+                            'Volume_Ratio': result['volume_ratio'],
+                            'Approximate': result.get('approximate', False)
                         })
                 
                 messagebox.showinfo("完了", f"CSV出力が完了しました: {filename}")
@@ -2523,22 +2837,14 @@ class EnhancedFEMTool:
             for node_id in self.project_data.fixed_nodes:
                 boundary.addSPC(node_id + 1, 0.0, 0.0, 0.0)
             
-            # C3D4要素を作成（解析用メッシュを使用）
-            elems = []
-            for i, elem in enumerate(self.elems):
-                nodes = [Node(j + 1, self.base_nodes[j, 0], self.base_nodes[j, 1], self.base_nodes[j, 2]) for j in elem]
-                c3d4_elem = C3D4(i + 1, nodes, young, poisson, density)
-                elems.append(c3d4_elem)
-            
-            # ノードオブジェクトを作成（解析用メッシュを使用）
-            node_objects = [Node(i + 1, self.base_nodes[i, 0], self.base_nodes[i, 1], self.base_nodes[i, 2]) 
-                           for i in range(len(self.base_nodes))]
+            # 解析用メッシュを作成（振動解析では重力を考慮しない）
+            fem_mesh = Mesh(self.base_nodes, self.elems, young, poisson, density)
             
             # FEMオブジェクト作成
-            fem = FEM(node_objects, elems, boundary)
+            fem = FEM(fem_mesh, boundary)
             
             # 振動解析実行
-            eigenvalues, eigenvectors, frequencies = fem.vibrationAnalysis(num_modes)
+            eigenvalues, eigenvectors, frequencies = fem.vibrationAnalysis(num_modes, lumped=self.vib_lumped_mass.get())
             
             # 結果を保存
             self.vibration_results = {
@@ -2758,5 +3064,7 @@ class EnhancedFEMTool:
         self.root.mainloop()
 
 if __name__ == "__main__":
+    # パラメトリック解析のワーカープロセスを実行ファイル(PyInstaller)からも起動できるようにする
+    multiprocessing.freeze_support()
     app = EnhancedFEMTool()
     app.run()
\ No newline at end of file
@@ -17,11 +17,28 @@ a = Analysis(
         ('FEM.py', '.'),
         ('Boundary.py', '.'),
         ('Dmatrix.py', '.'),
+        ('C3D4Batch.py', '.'),
+        ('DirectSolver.py', '.'),
+        ('PCGSolver.py', '.'),
+        ('Mesh.py', '.'),
+        ('NodeOrdering.py', '.'),
+        ('SymbolicAssembly.py', '.'),
+        ('ParametricSweep.py', '.'),
+        ('SharedMesh.py', '.'),
+        ('CASolver.py', '.'),
+        ('AdaptiveSweep.py', '.'),
+        ('ElementOperator.py', '.'),
+        ('OutOfCoreMatrix.py', '.'),
+        ('OutOfCoreAssembly.py', '.'),
+        ('AnalysisPlanner.py', '.'),
     ],
     hiddenimports=[
         'numpy',
         'scipy',
         'scipy.linalg',
+        'scipy.sparse',
+        'scipy.sparse.linalg',
+        'scipy.sparse.csgraph',
         'matplotlib',
         'matplotlib.backends.backend_tkagg',
         'mpl_toolkits.mplot3d',